@@ -0,0 +1,104 @@
+'''
+Benchmarks Image.resize against the uint8 QImage round-trip it replaced, which converted every
+image to uint8, scaled it with QImage.scaled (nearest-neighbour), and converted it back.
+
+Reports the time and the peak memory numpy allocates for each (Qt's own allocations aren't
+seen by tracemalloc), and for integer factors, the mean and largest error against an exact
+float64 box average of the source, in 1/255 steps. Nearest-neighbour strays furthest from the
+average, and Lanczos is sharper than it by design. Nothing is asserted.
+
+	python scripts/bench_resize.py [--repeat N]
+'''
+
+from pathlib import Path
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from module.core.io.image import Image
+from module.core.io.qtio import image_to_qimage, qimage_to_image
+from module.core.io.resample import ResampleFilter
+from PySide6.QtCore import Qt
+
+from numpy.typing import DTypeLike
+from time import perf_counter
+from typing import Callable
+import numpy as np
+import argparse, tracemalloc
+
+CASES: list[tuple[tuple[int, int], tuple[int, int], int]] = [
+	((4096, 4096), (2048, 2048), 4),
+	((4096, 4096), (1024, 1024), 1),
+	((4096, 4096), (2048, 2048), 1),
+	((3000, 3000), (2048, 2048), 3),
+	((1024, 1024), (2048, 2048), 3),
+]
+''' The (source, target, channels) of each case. '''
+
+DTYPES = [np.uint8, np.uint16, np.float32]
+
+def make_source(size: tuple[int, int], channels: int, dtype: DTypeLike) -> Image:
+	''' A smooth gradient with noise, so both the low and high frequencies are exercised. '''
+	width, height = size
+	y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+	rng = np.random.default_rng(0)
+	planes = [(0.5 + 0.3 * np.sin(x / (37 + c) + y / (53 + c)) + rng.normal(0, 0.1, (height, width))).clip(0, 1).astype(np.float32) for c in range(channels)]
+	return Image(np.stack(planes, axis=2)).convert(dtype)
+
+def resize_qimage(image: Image, size: tuple[int, int]) -> Image:
+	''' The resize that the QImage backend used to do, followed by the conversion that normalize did afterwards. '''
+	scaled = image_to_qimage(image).scaled(size[0], size[1], Qt.AspectRatioMode.IgnoreAspectRatio)
+	return qimage_to_image(scaled, image.channels).convert(np.float32)
+
+def resize_float(filter: ResampleFilter) -> Callable[[Image, tuple[int, int]], Image]:
+	return lambda image, size: image.resize(size, filter).convert(np.float32)
+
+def get_box_reference(image: Image, size: tuple[int, int]) -> np.ndarray|None:
+	''' Returns the exact average of each output pixel's footprint in float64, or None if the factor isn't an integer. '''
+	width, height = image.size
+	if width % size[0] or height % size[1]: return None
+	data = image.convert(np.float32).data.astype(np.float64)
+	return data.reshape(size[1], height // size[1], size[0], width // size[0], image.channels).mean(axis=(1, 3))
+
+def measure(resize: Callable[[Image, tuple[int, int]], Image], image: Image, size: tuple[int, int], repeat: int) -> tuple[float, int, Image]:
+	''' Returns the best time, the peak bytes allocated besides the result, and the result of resizing. '''
+	best = float('inf')
+	for _ in range(repeat):
+		start = perf_counter()
+		result = resize(image, size)
+		best = min(best, perf_counter() - start)
+
+	tracemalloc.start()
+	result = resize(image, size)
+	peak = tracemalloc.get_traced_memory()[1] - result.data.nbytes
+	tracemalloc.stop()
+	return (best, peak, result)
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmarks Image.resize against the old QImage path.')
+	parser.add_argument('--repeat', type=int, default=3, help='The runs of each case. The best time is reported.')
+	args = parser.parse_args()
+
+	methods: dict[str, Callable[[Image, tuple[int, int]], Image]] = {
+		'qimage': resize_qimage,
+		'box': resize_float(ResampleFilter.Box),
+		'lanczos': resize_float(ResampleFilter.Lanczos),
+	}
+
+	print(f'{"case":<36}{"method":<10}{"time (ms)":>10}{"numpy peak (MB)":>17}{"mean err":>10}{"max err":>9}')
+	for source, size, channels in CASES:
+		for dtype in DTYPES:
+			image = make_source(source, channels, dtype)
+			reference = get_box_reference(image, size)
+			case = f'{source[0]}x{source[1]}->{size[0]}x{size[1]} {channels}ch {np.dtype(dtype).name}'
+
+			for name, resize in methods.items():
+				seconds, peak, result = measure(resize, image, size, args.repeat)
+				errors = ''
+				if reference is not None:
+					error = np.abs(result.data - reference) * 255
+					errors = f'{error.mean():>10.3f}{error.max():>9.2f}'
+				print(f'{case:<36}{name:<10}{seconds * 1000:>10.1f}{peak / (1024 * 1024):>17.1f}{errors}')
+				case = ''
+
+if __name__ == '__main__':
+	main()
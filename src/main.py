@@ -1,4 +1,6 @@
 import module
+from multiprocessing import freeze_support
 
 if __name__ == '__main__':
+	freeze_support()
 	module.init()
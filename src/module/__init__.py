@@ -1,21 +1,59 @@
+from .core.io.image import IO_BACKENDS
+
 def init():
-	from .core.io.qtio import QtIOBackend
-	from .core.io.image import Image
-	from . import gui
-	
-	from logging import DEBUG, basicConfig, FileHandler, root
-	basicConfig(level=DEBUG)
+	from logging import DEBUG, INFO, basicConfig, FileHandler, root
 
 	from argparse import ArgumentParser
 
 	parser = ArgumentParser()
 	parser.add_argument('--logfile', help='Writes errors and information to the specified file.')
 	parser.add_argument('--config', help='Uses the specified config path instead of the installation config path.')
+	parser.add_argument('--backend', choices=IO_BACKENDS, default='qt', help='The backend used to load and save images.')
+
+	commands = parser.add_subparsers(dest='command', metavar='{convert}')
+	convert = commands.add_parser('convert', help='Converts presets to materials without opening the gui.')
+	convert.add_argument('presets', nargs='+', help='The preset files or globs to convert.')
+	convert.add_argument('-o', '--output', help='Writes materials to the specified folder instead of the folder of each preset.')
+	convert.add_argument('-j', '--jobs', type=int, help='The number of worker processes to use. Defaults to the number of cores.')
+	convert.add_argument('--no-overwrite-vmt', action='store_true', help='Skips writing VMTs that already exist.')
+
 	args = parser.parse_args()
+	basicConfig(level=INFO if args.command else DEBUG)
 
 	if args.logfile != None:
 		from .core.config import root_path
 		root.addHandler(FileHandler(root_path / args.logfile))
 
-	Image.set_backend(QtIOBackend)
+	if args.command == 'convert':
+		return convert_presets(args)
+
+	from .core.io.image import Image, get_backend
+	from . import gui
+
+	Image.set_backend(get_backend(args.backend))
 	gui.start_gui(args)
+
+def convert_presets(args):
+	from .core.batch import expand_presets, run_batch
+	from .core.config import load_config
+	from pathlib import Path
+	import logging as log
+
+	presets = expand_presets(args.presets)
+	if not presets:
+		log.error('No presets were found!')
+		exit(1)
+
+	# Load (or create) the config once up-front, so workers never race to write it.
+	load_config(False, pathOverride=args.config)
+
+	output = Path(args.output).absolute() if args.output else None
+	results = run_batch(presets, output, args.jobs, overwriteVmt=not args.no_overwrite_vmt, configPath=args.config, backend=args.backend)
+
+	failed = [x for x in results if not x.ok]
+	total = sum(x.total for x in results)
+	log.info(f'Converted {len(results) - len(failed)}/{len(results)} presets. ({round(total, 3)}s of work)')
+
+	if failed:
+		for result in failed: log.error(f'Failed: {result.preset}')
+		exit(1)
@@ -0,0 +1,141 @@
+from .io.image import Image, get_backend
+from .material import ImageRole
+from .preset import Preset
+from .export import make_material, make_material_header, is_material_current, save_material, load_images, get_load_size
+from .manifest import get_source_hashes
+from .vmt import get_material_name
+from .config import load_config, get_decode_cache_path
+from .io.cache import setup_decode_cache
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from traceback import format_exc
+from time import perf_counter
+from pathlib import Path
+from glob import glob
+import logging as log
+import os
+
+'''
+Headless batch conversion. Presets are converted in worker processes,
+each of which loads the app config and I/O backend once on startup.
+'''
+
+@dataclass
+class BatchResult():
+	preset: str
+	''' The path to the converted preset. '''
+	vmt: str|None = None
+	''' The path to the written VMT, if the preset was loaded successfully. '''
+	error: str|None = None
+	''' The traceback of the failure, if any. '''
+	timings: dict[str, float] = field(default_factory=dict)
+	''' The time (seconds) spent in each stage of the conversion. '''
+
+	@property
+	def ok(self) -> bool:
+		return self.error == None
+
+	@property
+	def total(self) -> float:
+		return sum(self.timings.values())
+
+def expand_presets(patterns: list[str]) -> list[Path]:
+	''' Expands a list of preset paths and globs, removing duplicates. '''
+	paths: dict[Path, None] = {}
+	for pattern in patterns:
+		matches = glob(pattern, recursive=True) or [pattern]
+		for match in sorted(matches):
+			paths[Path(match).absolute()] = None
+	return list(paths)
+
+def init_worker(configPath: str|None, backend: str='qt'):
+	''' Prepares a worker process for conversion. Workers never construct a QApplication. '''
+	Image.set_backend(get_backend(backend))
+	config = load_config(False, pathOverride=configPath)
+	setup_decode_cache(get_decode_cache_path(), config.decodeCacheSize * 1024 * 1024)
+
+def convert_preset(presetPath: Path, outPath: Path|None=None, overwriteVmt: bool=True) -> BatchResult:
+	''' Converts a single preset, writing the material to outPath or the preset's folder. '''
+	result = BatchResult(str(presetPath))
+	lastTime = perf_counter()
+
+	def mark(stage: str):
+		nonlocal lastTime
+		now = perf_counter()
+		result.timings[stage] = now - lastTime
+		lastTime = now
+
+	try:
+		preset = Preset.load(str(presetPath))
+		folder = outPath or presetPath.parent.absolute()
+		folder.mkdir(parents=True, exist_ok=True)
+
+		baseName = preset.name.rsplit('/', 1)[-1] if preset.name else presetPath.stem
+		vmtPath = folder / (baseName + '.vmt')
+		result.vmt = str(vmtPath)
+
+		# Files are hashed before they are decoded, so a file that changes in between is exported again next time.
+		paths = { role: preset.get_path(role) for role in ImageRole }
+		sources = get_source_hashes(paths)
+
+		# Images are decoded at the size of the textures, rather than at full size and then resized.
+		size = get_load_size(paths[ImageRole.Albedo], preset.scaleTarget)
+
+		# Everything the outputs are fingerprinted from is known by now, so unchanged materials are skipped without decoding them.
+		if size:
+			header = make_material_header(paths, preset.mode, preset.game, preset.normalType, size, sources)
+			header.name = get_material_name(vmtPath)
+			if is_material_current(header, folder, overwriteVmt):
+				log.info(f'Skipped {vmtPath}, since it is up-to-date.')
+				mark('check')
+				return result
+		mark('check')
+
+		images = load_images(paths, size)
+		mark('load')
+
+		material = make_material(images, preset.mode, preset.game, preset.normalType, preset.scaleTarget, sources=sources, size=size)
+		material.name = get_material_name(vmtPath)
+		mark('material')
+
+		# Presets are already spread across processes, so textures are encoded serially.
+		save_material(material, folder, overwrite_vmt=overwriteVmt, encodeWorkers=1)
+		mark('export')
+
+	except Exception:
+		mark('failed')
+		result.error = format_exc()
+
+	return result
+
+def run_batch(presets: list[Path], outPath: Path|None=None, jobs: int|None=None, overwriteVmt: bool=True, configPath: str|None=None, backend: str='qt') -> list[BatchResult]:
+	''' Converts a list of presets across a pool of worker processes, logging each result as it completes. '''
+	jobs = max(1, min(jobs or os.cpu_count() or 1, len(presets)))
+	log.info(f'Converting {len(presets)} presets with {jobs} worker(s)...')
+
+	results: list[BatchResult] = []
+
+	def report(result: BatchResult):
+		results.append(result)
+		stages = ', '.join(f'{k}={v:.3f}s' for k, v in result.timings.items())
+		if result.ok:
+			log.info(f'[{len(results)}/{len(presets)}] {result.vmt} ({result.total:.3f}s: {stages})')
+		else:
+			log.error(f'[{len(results)}/{len(presets)}] Failed to convert {result.preset} ({stages})\n\n{result.error}')
+
+	# Single-job batches run in-process, which is easier to debug.
+	if jobs == 1:
+		init_worker(configPath, backend)
+		for preset in presets:
+			report(convert_preset(preset, outPath, overwriteVmt))
+		return results
+
+	with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(configPath, backend)) as pool:
+		futures = { pool.submit(convert_preset, preset, outPath, overwriteVmt): preset for preset in presets }
+		for future in as_completed(futures):
+			# Workers catch their own errors, so this only fails if the worker itself died.
+			try:				report(future.result())
+			except Exception:	report(BatchResult(str(futures[future]), error=format_exc()))
+
+	return results
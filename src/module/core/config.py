@@ -11,9 +11,11 @@ ResizeFilter = vtfpp.ImageConversion.ResizeFilter
 TexFlags = vtfpp.VTF.Flags
 
 from ..version import __version__
+from .io.resample import ResampleFilter
 
 CONFIG_NAME = 'appconfig.json'
 CACHE_NAME = 'appcache.json'
+DECODE_CACHE_NAME = 'decodecache'
 
 __config__: 'AppConfig'
 __configPath__: Path
@@ -34,6 +36,9 @@ else:
 def get_res() -> Path:
 	return res_path
 
+def get_decode_cache_path() -> Path:
+	return root_path / DECODE_CACHE_NAME
+
 ''' Config structures '''
 
 class TargetRole(Enum):
@@ -87,6 +92,30 @@ class AppConfig():
 	''' If true, always writes to the VMT, even if one already exists. '''
 	watchTimeout: int = 500
 	''' The timeout (milliseconds) to use when listening for input changes before initiating an export. '''
+	watchDrafts: bool = True
+	''' If true, exports triggered by watched files write draft textures, which are quick to encode but lower quality and without mips. Full-quality textures are exported once the watch stops or the inputs settle. '''
+	watchIdleTimeout: int = 3000
+	''' The timeout (milliseconds) to wait after a draft export, without any input changes, before exporting at full quality. '''
+	progressiveExport: bool = True
+	''' If true (and hijackMode is enabled), exports first write a quarter-resolution proxy of the textures that changed and reload it in the game, then write and reload the full-resolution textures. '''
+	exportWorkers: int = 0
+	''' The number of processes used to encode textures in parallel. If 0, uses one per core. If 1, encodes on the calling thread. '''
+	fusedExport: bool = True
+	''' If true, derives every output texture in a single banded pass. If false, uses the reference texops implementation. '''
+	encodeTileRows: int = 256
+	''' Block-compressed textures taller than this are split into bands of this many rows, which are compressed across the encoding pool. If 0, textures are always compressed whole. '''
+	halfPrecision: bool = False
+	''' If true, materials are held as float16 instead of float32, halving their memory and the bytes read while exporting. Textures are still computed in float32, and differ from full precision by at most 1/255. Converting to and from float16 makes exports somewhat slower. '''
+	tiledMemoryLimit: int = 0
+	''' If nonzero, the memory (megabytes) that processing a material may use on top of its inputs and textures. Materials whose inputs would need more than this as float32 are exported in tiled mode, which keeps the inputs at their loaded precision, resizes them one plane at a time, and streams them through the per-pixel math and the uint8 conversion in bands of rows small enough to fit in it. Only resizing, shared mips, and encoding work on whole images. '''
+	integerPath: bool = True
+	''' If true (and fusedExport is set), 8-bit inputs are kept as uint8 and exported through lookup tables and integer blending instead of float32 math. Textures differ from the float path by at most 1/255. '''
+	decodeCacheSize: int = 1024
+	''' The size (megabytes) of the on-disk cache of decoded source images, which lets unchanged images be memory-mapped instead of decoded again. If 0, images are always decoded. '''
+	resizeFilter: ResampleFilter = ResampleFilter.Lanczos
+	''' The filter used to resize inputs to the size of the material. Box and Bilinear are the softest, and Lanczos the sharpest. '''
+	sharedMips: bool = False
+	''' If true, mips are generated by evaluating each texture again on a box-filtered pyramid of the inputs, which is shared by every texture, instead of by downsampling each texture while encoding. Mips of textures derived from roughness are more accurate. The mipmapFilter of each target is ignored. '''
 	targets: dict[TargetRole, TargetConfig] = field(default_factory=lambda: {
 		TargetRole.Basecolor:	TargetConfig("_basecolor.vtf",	True),
 		TargetRole.Bumpmap:		TargetConfig("_bump.vtf",
@@ -109,6 +138,13 @@ class AppConfig():
 	@staticmethod
 	def decode(data) -> 'AppConfig':
 		assert isinstance(data, dict)
+
+		# Earlier names of tiledMemoryLimit.
+		for name in ('exportMemoryLimit', 'tiledExportThreshold'):
+			if name in data:
+				data = { **data, 'tiledMemoryLimit': data[name] }
+				del data[name]
+
 		appConfig =  AppConfig(**{
 			**data,
 			"targets": { TargetRole(k): TargetConfig.decode(v) for k,v in data["targets"].items() }
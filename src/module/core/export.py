@@ -1,8 +1,227 @@
-from .material import Material, MaterialMode, Texture
-from .config import TargetRole
+from .io.image import Image, IOBackend, BufferPool
+from .material import Material, MaterialMode, GameTarget, NormalType, ImageRole, Texture
+from .config import TargetRole, get_config
+from .vmt import make_vmt
+from .fused import export_fused
+from .mips import export_with_mips
+from .manifest import get_manifest_path, get_fingerprints, read_manifest, write_manifest, is_up_to_date, DRAFT_SUFFIX
 from . import texops
 
-def export(src: Material) -> list[Texture]:
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from math import ceil, log2
+from time import perf_counter
+from typing import Any, Callable
+import logging as log
+import numpy as np
+import multiprocessing, os
+
+ExportCallback = Callable[[str|None, int|None], None]
+
+DRAFT_MIPMAPS = 1
+''' The number of mips written for draft textures. '''
+
+# Used as a default dummy callback by save_material()
+CALLBACK_NONE: ExportCallback = lambda _a, _b: None
+
+__encodePool__: ProcessPoolExecutor|None = None
+__encodePoolSize__: int = 0
+
+def get_encode_pool(workers: int) -> ProcessPoolExecutor:
+	'''
+	Returns the persistent texture encoding pool, recreating it if the worker count has changed. Workers are spawned
+	rather than forked, since the GUI starts the pool while other threads (and Qt's) may be holding locks.
+	'''
+	global __encodePool__, __encodePoolSize__
+
+	if __encodePool__ == None or __encodePoolSize__ != workers:
+		if __encodePool__: __encodePool__.shutdown(wait=False)
+		log.debug(f'Starting texture encoding pool with {workers} workers...')
+		__encodePool__ = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=Image.set_backend, initargs=(Image.backend,))
+		__encodePoolSize__ = workers
+
+	return __encodePool__
+
+__decodePool__: ThreadPoolExecutor|None = None
+
+def get_decode_pool() -> ThreadPoolExecutor:
+	'''
+	Returns the persistent pool that role images are decoded and normalized on, with a thread per role.
+	Decoders and NumPy release the GIL for most of their work, so the roles are processed in parallel.
+	'''
+	global __decodePool__
+
+	if __decodePool__ == None:
+		__decodePool__ = ThreadPoolExecutor(len(ImageRole), thread_name_prefix='decode')
+
+	return __decodePool__
+
+def load_images(paths: dict[ImageRole, Path|None], size: tuple[int, int]|None=None) -> dict[ImageRole, Image|None]:
+	'''
+	Loads the image of each role that has a path, in parallel, with only the channels the role uses. (See ROLE_CHANNELS)
+	If size is specified, images are decoded nearer to it. (See get_load_size)
+	'''
+	pool = get_decode_pool()
+	jobs = { role: pool.submit(Image.load, path, None, size, ROLE_CHANNELS[role]) for role, path in paths.items() if path }
+	return { role: jobs[role].result() if role in jobs else None for role in paths }
+
+def get_encode_workers(workers: int) -> int:
+	''' Resolves the configured worker count, where 0 means one per core. '''
+	if workers <= 0: workers = os.cpu_count() or 1
+	return workers
+
+def encode_texture(image: Image, path: Path, options: dict[str, Any]) -> float:
+	''' Saves a single texture, returning the time taken. Runs inside the encoding pool. '''
+	TIME_BEFORE = perf_counter()
+	image.save(path, **options)
+	return perf_counter() - TIME_BEFORE
+
+def read_text(path: Path) -> str|None:
+	''' Reads a text file, or returns None if it can't be read. '''
+	try:
+		with open(path, 'r') as file:
+			return file.read()
+	except (OSError, UnicodeDecodeError):
+		return None
+
+def get_texture_dims(size: tuple[int, int], scaleTarget: int) -> tuple[int, int]:
+	''' Determines the power-of-two output size for an albedo of the given size. '''
+
+	def to_pow2(x: float) -> int:
+		return pow(2, ceil(log2(int(x))))
+
+	albedoWidth, albedoHeight = size
+	albedoMaxSize = max(albedoWidth, albedoHeight)
+	texScale      = (min(albedoMaxSize, scaleTarget) / albedoMaxSize) if scaleTarget else 1
+	return (to_pow2(albedoWidth * texScale), to_pow2(albedoHeight * texScale))
+
+def get_load_size(albedoPath: str|Path|None, scaleTarget: int, backend: type[IOBackend]|None=None) -> tuple[int, int]|None:
+	'''
+	Returns the size that role images can be decoded at, which is the size of the textures made from them,
+	or None if the albedo's size can't be read without decoding it. Every role is resized to it by make_material.
+	'''
+	if not albedoPath: return None
+	size = (backend or Image.backend).read_size(albedoPath)
+	return get_texture_dims(size, scaleTarget) if size else None
+
+ROLE_CHANNELS: dict[ImageRole, int] = {
+	ImageRole.Albedo:		4,
+	ImageRole.Roughness:	1,
+	ImageRole.Metallic:		1,
+	ImageRole.Emit:			3,
+	ImageRole.AO:			1,
+	ImageRole.Normal:		3,
+	ImageRole.Height:		1,
+}
+''' The number of channels each role has once it is normalized, and is decoded with. (See IOBackend.load) '''
+
+def get_material_footprint(images: dict[ImageRole, Image|None], size: tuple[int, int]) -> int:
+	''' Estimates the bytes needed to hold the provided role images as float32 at the specified size. '''
+	channels = sum(ROLE_CHANNELS[role] for role, image in images.items() if image != None)
+	return size[0] * size[1] * channels * 4
+
+def make_material(
+		images: dict[ImageRole, Image|None],
+		mode: MaterialMode,
+		game: GameTarget,
+		normalType: NormalType=NormalType.DX,
+		scaleTarget: int=0,
+		tiled: bool|None=None,
+		half: bool|None=None,
+		sources: dict[ImageRole, str]|None=None,
+		size: tuple[int, int]|None=None) -> Material:
+	'''
+	Normalizes the decoded role images and constructs a material from them. If the images were
+	decoded at a reduced size, size must be the one they were loaded with. (See get_load_size) If tiled is
+	unspecified, materials that wouldn't fit in `AppConfig.tiledMemoryLimit` are made tiled. If half
+	is unspecified, images are converted to float16 if `AppConfig.halfPrecision` is set. 8-bit images
+	are kept as uint8 if `AppConfig.integerPath` is set. sources are the hashes of the images'
+	files, which let unchanged textures be skipped. (See manifest.get_source_hashes)
+	'''
+
+	albedo = images.get(ImageRole.Albedo)
+	assert albedo != None, 'A basetexture is required to convert the material!'
+
+	roughness = images.get(ImageRole.Roughness)
+	assert roughness != None, 'A roughness map is required to convert the material!'
+
+	metallic = images.get(ImageRole.Metallic) or Image.constant(roughness.size, (0.0,))
+	emit = images.get(ImageRole.Emit)
+	ao = images.get(ImageRole.AO)
+	normal = images.get(ImageRole.Normal) or Image.constant(roughness.size, (0.5, 0.5, 1.0))
+	height = images.get(ImageRole.Height)
+
+	texDims = size or get_texture_dims(albedo.size, scaleTarget)
+	log.info(f'Determined size {texDims} via scale target {scaleTarget}')
+
+	if half == None:
+		half = get_config().halfPrecision
+	dtype = np.float16 if half else np.float32
+
+	if tiled == None:
+		limit = get_config().tiledMemoryLimit
+		footprint = get_material_footprint(images, texDims)
+		tiled = limit > 0 and footprint > limit * 1024 * 1024
+		if tiled: log.info(f'Using tiled mode: float inputs would need {footprint // (1024 * 1024)}MB, over the limit of {limit}MB')
+
+	# The integer path lives in export_fused, so it is skipped when the reference implementation is used.
+	appConfig = get_config()
+	integerPath = appConfig.integerPath and appConfig.fusedExport
+
+	filter = appConfig.resizeFilter
+
+	def prepare(image: Image, **kwargs) -> Image:
+		keepDtype = tiled or (integerPath and image.dtype == np.uint8)
+		return texops.normalize(image, texDims, keepDtype=keepDtype, dtype=dtype, filter=filter, batch=not tiled, **kwargs)
+
+	def submit(image: Image, **kwargs) -> Future[Image]:
+		# Tiled materials are prepared one role at a time, so only a single plane is resampled in float32 at once.
+		if not tiled: return pool.submit(prepare, image, **kwargs)
+		future: Future[Image] = Future()
+		future.set_result(prepare(image, **kwargs))
+		return future
+
+	log.info('Constructing material...')
+
+	# Each color role is resized and converted on its own thread.
+	pool = get_decode_pool()
+	jobs: dict[ImageRole, Future[Image]] = {
+		ImageRole.Albedo:		submit(albedo, mode='RGBA'),
+		ImageRole.Normal:		submit(normal, mode='RGB'),
+	}
+	if emit: jobs[ImageRole.Emit] = submit(emit, noAlpha=True)
+
+	# Single-channel roles share their resampling weights, so they are resized together in the meantime.
+	grays = { role: image.normalize('L') for role, image in ((ImageRole.Roughness, roughness), (ImageRole.Metallic, metallic), (ImageRole.AO, ao), (ImageRole.Height, height)) if image }
+	for role, image in zip(grays, Image.resize_all(list(grays.values()), texDims, filter, batch=not tiled)):
+		jobs[role] = submit(image, mode='L')
+
+	def result(role: ImageRole) -> Image|None:
+		return jobs[role].result() if role in jobs else None
+
+	return Material(
+		mode,
+		game,
+		texDims,
+		albedo=jobs[ImageRole.Albedo].result(),
+		roughness=jobs[ImageRole.Roughness].result(),
+		metallic=jobs[ImageRole.Metallic].result(),
+		emit=result(ImageRole.Emit),
+		ao=result(ImageRole.AO),
+		normal=jobs[ImageRole.Normal].result(),
+		height=result(ImageRole.Height),
+		normalType=normalType,
+		tiled=tiled,
+		sources=sources
+	)
+
+def export(src: Material, pool: BufferPool|None=None, roles: set[TargetRole]|None=None) -> list[Texture]:
+	'''
+	Generates the textures for a material with the texops functions. Intermediate images are leased
+	from pool (or a new pool for this export), and are given back once each texture is converted.
+	If roles is specified, only those textures are generated.
+	'''
 
 	# config = get_config()
 	# def apply_scale(img: Image, role: TargetRole) -> Image:
@@ -11,35 +230,233 @@ def export(src: Material) -> list[Texture]:
 	# 	w, h = img.size
 	# 	return img.resize((int(w * scale), int(h * scale)))
 
+	if pool == None: pool = BufferPool()
+
+	def wants(role: TargetRole) -> bool:
+		return roles == None or role in roles
+
 	textures = []
-	basecolor = texops.make_basecolor(src)
-	basecolor = basecolor.resize(src.size)
-	basecolor = basecolor.convert('uint8', clip=True)
-	textures.append(Texture(basecolor, TargetRole.Basecolor))
+	if wants(TargetRole.Basecolor):
+		basecolor = texops.make_basecolor(src, pool)
+		basecolor = basecolor.resize(src.size)
+		textures.append(Texture(basecolor.convert('uint8', clip=True), TargetRole.Basecolor))
+		pool.release(basecolor)
 
-	bumpmap = texops.make_bumpmap(src)
-	bumpmap = bumpmap.convert('uint8', clip=True)
-	textures.append(Texture(bumpmap, TargetRole.Bumpmap))
+	if wants(TargetRole.Bumpmap):
+		bumpmap = texops.make_bumpmap(src, pool)
+		textures.append(Texture(bumpmap.convert('uint8', clip=True), TargetRole.Bumpmap))
+		pool.release(bumpmap)
 
-	if (MaterialMode.has_selfillum(src.mode) or MaterialMode.is_pbr(src.mode)) and src.emit:
-			emit = texops.make_emit(src)
+	if (MaterialMode.has_selfillum(src.mode) or MaterialMode.is_pbr(src.mode)) and src.emit and wants(TargetRole.Emit):
+			emit = texops.make_emit(src, pool)
 			illum_mask = emit.convert('uint8')
 			textures.append(Texture(illum_mask, TargetRole.Emit))
+			pool.release(emit)
 
 	if MaterialMode.is_pbr(src.mode):
-		mrao = texops.make_mrao(src)
-		mrao = mrao.convert('uint8')
-		textures.append(Texture(mrao, TargetRole.Mrao))
-		
+		if wants(TargetRole.Mrao):
+			mrao = texops.make_mrao(src)
+			mrao = mrao.convert('uint8')
+			textures.append(Texture(mrao, TargetRole.Mrao))
+
 	else:
-		if MaterialMode.has_phong(src.mode):
-			phong_exp = texops.make_phong_exponent(src)
-			phong_exp = phong_exp.convert('uint8', clip=True)
-			textures.append(Texture(phong_exp, TargetRole.PhongExp))
+		if MaterialMode.has_phong(src.mode) and wants(TargetRole.PhongExp):
+			phong_exp = texops.make_phong_exponent(src, pool)
+			textures.append(Texture(phong_exp.convert('uint8', clip=True), TargetRole.PhongExp))
+			pool.release(phong_exp)
 
-		if MaterialMode.has_envmap(src.mode) and not MaterialMode.embed_envmap(src.mode):
-			envmap_mask = texops.make_envmask(src)
-			envmap_mask = envmap_mask.convert('uint8', clip=True)
-			textures.append(Texture(envmap_mask, TargetRole.EnvmapMask))
+		if MaterialMode.has_envmap(src.mode) and not MaterialMode.embed_envmap(src.mode) and wants(TargetRole.EnvmapMask):
+			envmap_mask = texops.make_envmask(src, pool)
+			textures.append(Texture(envmap_mask.convert('uint8', clip=True), TargetRole.EnvmapMask))
+			pool.release(envmap_mask)
 
+	log.debug(f'Buffer pool: {pool.hits} hits, {pool.misses} misses')
 	return textures
+
+@dataclass
+class SaveResult():
+	vmt: bool
+	''' True if the VMT was written. '''
+	textures: list[TargetRole] = field(default_factory=list)
+	''' The textures that were written. Textures that haven't changed since the last export are skipped. (See manifest) '''
+
+def get_stale_textures(material: Material, folder: Path, draft=False) -> set[TargetRole]:
+	''' Returns the textures of a material that aren't up-to-date in the specified folder, which save_material would write. (See manifest) '''
+	assert material.name != None, 'Cannot check a material without a name!'
+
+	appConfig = get_config()
+	materialName = material.name.rsplit('/', 1)[-1]
+	fingerprints = get_fingerprints(material, appConfig)
+	previous = read_manifest(get_manifest_path(folder, materialName))
+
+	return { role for role, fingerprint in fingerprints.items()
+		if not is_up_to_date(previous.get(role), fingerprint, draft) or not (folder / (materialName + appConfig.targets[role].postfix)).exists() }
+
+def make_material_header(
+		paths: dict[ImageRole, Path|None],
+		mode: MaterialMode,
+		game: GameTarget,
+		normalType: NormalType,
+		size: tuple[int, int],
+		sources: dict[ImageRole, str]) -> Material:
+	'''
+	Returns a material with the settings and sources of the one make_material would make from the specified files,
+	but with placeholder images. This is enough to fingerprint its outputs and make its VMT without decoding anything.
+	size must be the size the material would be made at. (See get_load_size)
+	'''
+	placeholder = Image.constant((1, 1), (0.0,))
+	def optional(role: ImageRole) -> Image|None:
+		return placeholder if paths.get(role) else None
+
+	return Material(
+		mode,
+		game,
+		size,
+		albedo=placeholder,
+		roughness=placeholder,
+		metallic=placeholder,
+		emit=optional(ImageRole.Emit),
+		ao=optional(ImageRole.AO),
+		normal=placeholder,
+		height=optional(ImageRole.Height),
+		normalType=normalType,
+		sources=sources
+	)
+
+def is_material_current(material: Material, folder: Path, overwrite_vmt=True, draft=False) -> bool:
+	''' Returns true if save_material would write nothing, because every texture and the VMT are up-to-date. The material must be named! '''
+	if get_stale_textures(material, folder, draft): return False
+
+	vmtPath = folder / (material.name.rsplit('/', 1)[-1] + '.vmt') # type: ignore
+	if not overwrite_vmt and vmtPath.exists(): return True
+	return read_text(vmtPath) == make_vmt(material)
+
+def save_material(material: Material, folder: Path, callback: ExportCallback=CALLBACK_NONE, overwrite_vmt=True, encodeWorkers: int|None=None, draft=False, only: set[TargetRole]|None=None) -> SaveResult:
+	'''
+	Processes the material and writes its VMT and textures to the specified folder. The material must be named!
+	Textures are encoded across `encodeWorkers` processes, or `AppConfig.exportWorkers` if unspecified.
+	Draft textures are encoded as quickly as possible, with a single mip, and are replaced by the next full export.
+	If only is specified, the other textures are left as they are.
+	'''
+	assert material.name != None, 'Cannot save a material without a name!'
+
+	appConfig = get_config()
+	materialName = material.name.rsplit('/', 1)[-1]
+
+	# Skip the textures that haven't changed since the last export. (See manifest)
+	manifestPath = get_manifest_path(folder, materialName)
+	fingerprints = get_fingerprints(material, appConfig)
+	previous = read_manifest(manifestPath)
+	roles = get_stale_textures(material, folder, draft)
+	if only != None: roles &= only
+
+	if len(roles) < len(fingerprints):
+		log.info(f'Skipping unchanged textures: {", ".join(role.name for role in fingerprints if role not in roles)}')
+
+	# Forget the textures that are about to be rewritten, so an interrupted export can't leave them looking up-to-date.
+	if any(role in previous for role in roles):
+		write_manifest(manifestPath, { role: fingerprint for role, fingerprint in previous.items() if role not in roles })
+
+	callback('Processing textures...', 20)
+
+	TIME_BEFORE = perf_counter()
+
+	# Tiled, half-precision, and uint8 materials are only converted to float32 band-by-band, which texops can't do.
+	def export_level(level: Material, roles: set[TargetRole]) -> list[Texture]:
+		if level.tiled:											return export_fused(level, appConfig.integerPath, roles, appConfig.tiledMemoryLimit * 1024 * 1024)
+		elif appConfig.fusedExport or not level.is_float32():	return export_fused(level, appConfig.integerPath, roles)
+		else:													return export(level, roles=roles)
+
+	textures: list[Texture] = []
+	if roles:
+		if appConfig.sharedMips and not draft:	textures = export_with_mips(material, roles, export_level)
+		else:									textures = export_level(material, roles)
+	textureVersion = GameTarget.vtf_version(material.target)
+	textureCount = len(textures)
+
+	TIME_AFTER = perf_counter()
+	log.debug(f'Processed textures in {round(TIME_AFTER - TIME_BEFORE, 4)}ms')
+
+	vmtPath = folder / (materialName + '.vmt')
+	shouldWriteVmt = overwrite_vmt or (not Path(vmtPath).exists())
+
+	result = SaveResult(False, [texture.role for texture in textures])
+
+	callback(None, 50)
+	if shouldWriteVmt:
+		callback('Writing VMT...', None)
+		vmt = make_vmt(material)
+		if read_text(vmtPath) != vmt:
+			with open(vmtPath, 'w') as vmtFile:
+				vmtFile.write(vmt)
+			result.vmt = True
+		else:
+			log.info('Skipped writing VMT! (It is unchanged)')
+	else:
+		log.info('Skipped generating VMT! (overwriteVmts is False)')
+
+	callback(f'Writing textures...', 60)
+
+	jobs: list[tuple[Texture, Path, dict[str, Any]]] = []
+	for texture in textures:
+		textureConfig = appConfig.targets[texture.role]
+		jobs.append((texture, folder / (materialName + textureConfig.postfix), {
+			'mips': texture.mips,
+			'version': textureVersion,
+			'lossy': textureConfig.lossy,
+			'zip': textureConfig.zip and not draft,
+			'flags': textureConfig.flags,
+			'mipmaps': DRAFT_MIPMAPS if draft else textureConfig.mipmaps,
+			'mipmapFilter': textureConfig.mipmapFilter,
+			'draft': draft
+		}))
+
+	encodedCount = 0
+	def on_encoded(texture: Texture, duration: float):
+		nonlocal encodedCount
+		encodedCount += 1
+		log.debug(f'Encoded {texture.role.name} in {round(duration, 4)}s')
+		callback(f'Writing textures... [{encodedCount}/{textureCount}]', 60 + int(encodedCount / textureCount * 40))
+
+	TIME_BEFORE = perf_counter()
+	workers = get_encode_workers(appConfig.exportWorkers if encodeWorkers == None else encodeWorkers)
+
+	if workers == 1 or not jobs:
+		for texture, path, options in jobs:
+			on_encoded(texture, encode_texture(texture.image, path, options))
+	else:
+		pool = get_encode_pool(workers)
+		tileRows = appConfig.encodeTileRows
+
+		# Large textures are split into bands on this process, so the pool can compress them in parallel.
+		tiled = [job for job in jobs if tileRows > 0 and job[0].image.size[1] > tileRows]
+		pooled = [job for job in jobs if not (tileRows > 0 and job[0].image.size[1] > tileRows)]
+
+		futures: dict[Future[float], Texture] = { pool.submit(encode_texture, texture.image, path, options): texture for texture, path, options in pooled }
+		try:
+			for texture, path, options in tiled:
+				on_encoded(texture, encode_texture(texture.image, path, { **options, 'tilePool': pool, 'tileRows': tileRows }))
+			for future in as_completed(futures):
+				on_encoded(futures[future], future.result())
+		except:
+			for future in futures: future.cancel()
+			raise
+
+	TIME_AFTER = perf_counter()
+	log.debug(f'Encoded {textureCount} textures with {workers} workers in {round(TIME_AFTER - TIME_BEFORE, 4)}s')
+
+	# Textures that were skipped keep their previous fingerprints, which may be drafts.
+	current: dict[TargetRole, str] = {}
+	for role, fingerprint in fingerprints.items():
+		if role not in roles:
+			if role in previous: current[role] = previous[role]
+		elif fingerprint != None:
+			current[role] = fingerprint + DRAFT_SUFFIX if draft else fingerprint
+	if current != previous: write_manifest(manifestPath, current)
+
+	if shouldWriteVmt:
+		callback(f'Finished exporting {materialName}!', 100)
+	else:
+		callback(f'Finished exporting {materialName}_*.vtf!', 100)
+
+	return result
@@ -0,0 +1,411 @@
+from .material import Material, MaterialMode, NormalType, Texture
+from .config import TargetRole
+from .io.image import Image, max_value
+from numpy.typing import DTypeLike
+from typing import Callable
+import numpy as np
+
+'''
+A fused implementation of export(). Rather than building each output from its own
+full-size copies of the inputs, the material is walked in bands of rows small enough
+to stay in cache. Each band computes the shared terms (1 - roughness, its powers, the
+AO blends) once into reusable scratch buffers, and writes every output straight into
+its preallocated uint8 texture.
+
+The texops functions remain the reference implementation. This module mirrors their
+math operation-for-operation in float32, so the results should match them exactly.
+Inputs that are not float32 (see Material.tiled and AppConfig.halfPrecision) are
+converted one band at a time, exactly as Image.convert would have converted them up-front.
+Tiled materials are walked in bands sized to fit their scratch buffers in
+AppConfig.tiledMemoryLimit, so the only full-size arrays an export allocates are its textures.
+Constant inputs (see Image.constant) are folded the same way Image folds them: a
+constant metallic is evaluated once, a metallic of zero removes the darkening mask
+entirely, and a constant normal is filled rather than converted per-pixel.
+
+uint8 inputs (see AppConfig.integerPath) mostly skip float32 altogether. Every uint8
+value survives the round trip through float32 unchanged, so pass-through channels are
+copied as-is, and outputs that depend on a single uint8 input are read from 256-entry
+tables built with the same curves as the banded math. Curves that are combined with
+other inputs afterwards (the phong and envmap powers of roughness) come from float32
+tables rather than calling pow per-pixel. The basetexture is darkened by integer
+blending with a 16-bit fixed-point mask, which is the only step that can differ from
+float32, by at most 1/255.
+'''
+
+BAND_PIXELS = 1 << 16
+''' The approximate number of pixels processed per band. '''
+
+SCRATCH_BUFFERS = 13
+''' The most scratch buffers a band uses, each of which holds 4 bytes per pixel. (See Scratch, get_band_rows) '''
+
+BUDGET_RESERVE = 1 << 17
+''' The bytes of a budget set aside for the lookup tables and numpy's internal buffers. (See get_band_rows) '''
+
+MASK_BITS = 16
+''' The fractional bits of the fixed-point mask used to darken uint8 basetextures. '''
+
+def get_band_rows(width: int, budget: int=0) -> int:
+	'''
+	Returns the rows per band of a material width pixels wide. If budget is specified, bands are made small enough
+	that every scratch buffer of a band, plus BUDGET_RESERVE, fits in budget bytes. Bands are never smaller than a row.
+	'''
+	rows = max(1, BAND_PIXELS // width)
+	if budget > 0: rows = max(1, min(rows, (budget - BUDGET_RESERVE) // (width * SCRATCH_BUFFERS * 4)))
+	return rows
+
+class Scratch():
+	''' A set of reusable buffers (float32 unless specified), sliced down to the size of each band. '''
+
+	def __init__(self, rows: int, width: int) -> None:
+		self.shape = (rows, width)
+		self.buffers: dict[str, np.ndarray] = {}
+
+	def get(self, name: str, rows: int, dtype: DTypeLike=np.float32) -> np.ndarray:
+		buffer = self.buffers.get(name)
+		if buffer is None:
+			assert len(self.buffers) < SCRATCH_BUFFERS and np.dtype(dtype).itemsize == 4, 'Scratch buffers must fit in the budget of get_band_rows!'
+			buffer = self.buffers[name] = np.empty(self.shape, dtype)
+		return buffer[:rows]
+
+def write_u8(src: np.ndarray, dst: np.ndarray, clip: bool=True):
+	''' Equivalent to Image.convert('uint8', clip), but writes into an existing array. src is overwritten! '''
+	if clip: np.clip(src, 0, 1, out=src)
+	np.multiply(src, 255.0, out=src)
+	dst[...] = src
+
+def read_band(plane: np.ndarray, band: slice, out: np.ndarray) -> np.ndarray:
+	''' Returns a band of a plane as float32, converting it into out as Image.convert would if necessary. '''
+	if plane.dtype == np.float32: return plane[band]
+	if plane.dtype.kind == 'f':	out[...] = plane[band]
+	else:						np.multiply(plane[band], 1 / max_value(plane.dtype), out=out)
+	return out
+
+def constant_u8(value: np.ndarray, clip: bool=True) -> np.ndarray:
+	''' Converts the single color of a constant image as write_u8 would. value is overwritten! '''
+	out = np.empty(value.shape, np.uint8)
+	write_u8(value, out, clip)
+	return out
+
+def is_u8(plane: np.ndarray|None) -> bool:
+	return plane is not None and plane.dtype == np.uint8
+
+# Curves shared by the banded math and the lookup tables. Each writes into out and returns it.
+
+def curve_phong(inv: np.ndarray, out: np.ndarray) -> np.ndarray:
+	''' The phong mask, from 1 - roughness. (See texops.make_phong_mask) '''
+	np.power(inv, 3, out=out)
+	return np.multiply(out, 1.1, out=out)
+
+def curve_phong_exponent(r: np.ndarray, out: np.ndarray) -> np.ndarray:
+	''' The phong exponent, from roughness. (See texops.make_phong_exponent) '''
+	MAX_EXPONENT = 32 # $phongexponentfactor 32
+	with np.errstate(divide='ignore'):
+		np.power(r, -2, out=out)
+	return np.multiply(out, 0.8 / MAX_EXPONENT, out=out)
+
+def curve_emit(x: np.ndarray, out: np.ndarray) -> np.ndarray:
+	''' Gamma-corrects emission, as texops.make_emit does outside of PBR. '''
+	return np.power(x, 2.2, out=out)
+
+U8_FLOATS = np.multiply(np.arange(256, dtype=np.uint8), 1 / 255).astype(np.float32)
+''' Every uint8 value as float32, converted exactly as read_band converts them. '''
+
+def lut_float(curve: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+	''' Evaluates a float32 curve for every uint8 value. The curve may overwrite its input. '''
+	return curve(U8_FLOATS.copy())
+
+def lut_u8(curve: Callable[[np.ndarray], np.ndarray], clip: bool=True) -> np.ndarray:
+	''' Evaluates a float32 curve for every uint8 value, and converts the results as write_u8 would. '''
+	out = np.empty(256, np.uint8)
+	write_u8(lut_float(curve), out, clip)
+	return out
+
+def export_fused(src: Material, integerBlend: bool=True, roles: set[TargetRole]|None=None, budget: int=0) -> list[Texture]:
+	'''
+	Generates the same textures as export(), in a single banded pass. If integerBlend is false,
+	uint8 basetextures are darkened in float32 too, so every output matches export() exactly.
+	If roles is specified, only those textures are generated. If budget is specified, bands are
+	made small enough that everything besides the textures fits in that many bytes. (See get_band_rows)
+	'''
+
+	mode = src.mode
+	width, height = src.size
+	pbr = MaterialMode.is_pbr(mode)
+	swap = src.swap_phong_envmap()
+	hasPhong = MaterialMode.has_phong(mode)
+	envExponent = 5 if hasPhong else 3
+
+	''' Decide what each output contains. This mirrors the branches in texops. '''
+
+	def wants(role: TargetRole) -> bool:
+		return roles == None or role in roles
+
+	# Basetexture alpha: 'albedo', 'phong', 'envmask', or None for RGB.
+	baseAlpha: str|None
+	if pbr:						baseAlpha = 'albedo' if wants(TargetRole.Basecolor) and src.albedo.has_transparency() else None
+	elif MaterialMode.has_alpha(mode):			baseAlpha = 'albedo'
+	elif swap and hasPhong:						baseAlpha = 'phong'
+	elif not swap and MaterialMode.embed_envmap(mode):	baseAlpha = 'envmask'
+	else:										baseAlpha = None
+
+	# Bumpmap alpha: 'height', 'phong', 'envmask', or None for RGB.
+	bumpAlpha: str|None = None
+	if pbr:
+		bumpAlpha = 'height' if src.height else None
+	elif swap:
+		if MaterialMode.embed_envmap(mode): bumpAlpha = 'envmask'
+	elif hasPhong:
+		bumpAlpha = 'phong'
+
+	# texops.make_bumpmap returns the normal untouched when it has nothing to embed in PBR mode.
+	invertGreen = src.normalType == NormalType.GL and not (pbr and not src.height)
+
+	hasBasecolor = wants(TargetRole.Basecolor)
+	hasBumpmap = wants(TargetRole.Bumpmap)
+	hasEmit = (MaterialMode.has_selfillum(mode) or pbr) and src.emit != None and wants(TargetRole.Emit)
+	hasMrao = pbr and wants(TargetRole.Mrao)
+	hasPhongExp = not pbr and hasPhong and wants(TargetRole.PhongExp)
+	hasEnvmask = not pbr and MaterialMode.has_envmap(mode) and not MaterialMode.embed_envmap(mode) and wants(TargetRole.EnvmapMask)
+
+	''' Allocate outputs '''
+
+	def alloc(channels: int) -> np.ndarray:
+		return np.empty((height, width, channels), np.uint8)
+
+	basecolor = alloc(3 if baseAlpha == None else 4) if hasBasecolor else None
+	bumpmap = alloc(3 if bumpAlpha == None else 4) if hasBumpmap else None
+	emit = alloc(src.emit.channels) if hasEmit and src.emit else None
+	mrao = alloc(3) if hasMrao else None
+	phongExp = alloc(1) if hasPhongExp else None
+	envmask = alloc(1) if hasEnvmask else None
+
+	alphas = (baseAlpha if hasBasecolor else None, bumpAlpha if hasBumpmap else None)
+	needsPhong = 'phong' in alphas
+	needsEnvmask = hasEnvmask or 'envmask' in alphas
+
+	''' Walk the material in bands '''
+
+	bandRows = get_band_rows(width, budget)
+	scratch = Scratch(bandRows, width)
+
+	# Planes are read directly, so planar inputs are never interleaved.
+	albedo = [src.albedo.plane(c) for c in range(src.albedo.channels)]
+	normal = [src.normal.plane(c) for c in range(src.normal.channels)]
+	roughness = src.roughness.plane(0)
+	metallic = src.metallic.plane(0)
+	ao = src.ao.plane(0) if src.ao else None
+	heightMap = src.height.plane(0) if src.height else None
+	emitPlanes = [src.emit.plane(c) for c in range(src.emit.channels)] if src.emit else []
+
+	# Fold constant inputs
+	metallicZero = src.metallic.is_constant and metallic[0, 0] == 0
+
+	envScale: np.ndarray|None = None
+	if src.metallic.is_constant:
+		envScale = src.metallic.convert(np.float32).data[:1, :1, 0].copy()
+		envScale *= 0.75
+		envScale += 0.25
+
+	normalU8: np.ndarray|None = None
+	if src.normal.is_constant:
+		normalValue = src.normal.convert(np.float32).data[0, 0].copy()
+		if invertGreen: normalValue[1] = 1 - normalValue[1]
+		normalU8 = constant_u8(normalValue)
+
+	# Build lookup tables for the curves of uint8 inputs
+	roughnessU8 = is_u8(roughness)
+	phongFromTable = roughnessU8 and ao is None
+	envFromTable = roughnessU8 and ao is None and envScale is not None
+
+	def env_pow(x: np.ndarray) -> np.ndarray:
+		np.subtract(1, x, out=x)
+		return np.power(x, envExponent, out=x)
+
+	def env_scaled(x: np.ndarray) -> np.ndarray:
+		return np.multiply(env_pow(x), envScale[0, 0], out=x) # type: ignore
+
+	def phong_mask(x: np.ndarray) -> np.ndarray:
+		return curve_phong(np.subtract(1, x, out=x), x)
+
+	def clip_alpha(curve: Callable[[np.ndarray], np.ndarray]) -> Callable[[np.ndarray], np.ndarray]:
+		return lambda x: np.maximum(curve(x), 1 / 255, out=x)
+
+	# Float tables for curves that are multiplied by other inputs afterwards, and uint8 tables (without and
+	# with the 1/255 floor of embedded masks) for curves that depend on roughness alone.
+	phongTable = envTable = phongExpTable = None
+	alphaTables: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+	if roughnessU8:
+		if needsPhong:
+			if phongFromTable:	alphaTables['phong'] = (lut_u8(phong_mask), lut_u8(clip_alpha(phong_mask)))
+			else:				phongTable = lut_float(phong_mask)
+		if needsEnvmask:
+			if envFromTable:	alphaTables['envmask'] = (lut_u8(env_scaled), lut_u8(clip_alpha(env_scaled)))
+			else:				envTable = lut_float(env_pow)
+		if phongExp is not None:
+			phongExpTable = lut_u8(lambda x: curve_phong_exponent(x, x))
+
+	greenTable = lut_u8(lambda x: np.subtract(1, x, out=x)) if invertGreen and is_u8(normal[1]) else None
+	emitTable = lut_u8(lambda x: curve_emit(x, x), clip=False) if not pbr and any(is_u8(x) for x in emitPlanes) else None
+
+	# uint8 albedo is darkened with integer math when every mask input is uint8 or constant, which keeps the mask within [0, 1].
+	hasMask = hasBasecolor and not pbr and not metallicZero
+	blendU8 = integerBlend and not pbr and all(is_u8(x) for x in albedo[:3]) and all(is_u8(x.plane(0)) or x.is_constant for x in (src.roughness, src.metallic, src.ao) if x)
+
+	for y in range(0, height, bandRows):
+		rows = min(bandRows, height - y)
+		band = slice(y, y + rows)
+
+		def read(plane: np.ndarray, name: str) -> np.ndarray:
+			return read_band(plane, band, scratch.get(name, rows))
+
+		tmp = scratch.get('tmp', rows)
+
+		def transfer(plane: np.ndarray, dst: np.ndarray, table: np.ndarray|None=None, clip: bool=True):
+			''' Writes a plane through a table from lut_u8 (or unchanged) into dst. '''
+			if is_u8(plane):
+				# Indices are uint8 and tables have 256 entries, so clipping never applies, but unlike the default mode it doesn't buffer out.
+				if table is None:	dst[...] = plane[band]
+				else:				np.take(table, plane[band], out=dst, mode='clip')
+				return
+			tmp[...] = read(plane, 'src')
+			write_u8(tmp, dst, clip)
+
+		inv: np.ndarray|None = None
+		if hasMask or (not roughnessU8 and (needsPhong or needsEnvmask)):
+			inv = scratch.get('inv', rows)
+			np.subtract(1, read(roughness, 'r'), out=inv)
+
+		a = read(ao, 'a') if ao is not None and not pbr and (hasBasecolor or needsPhong or needsEnvmask) else None
+
+		phong: np.ndarray|None = None
+		if needsPhong and not phongFromTable:
+			phong = scratch.get('phong', rows)
+			if phongTable is not None:	np.take(phongTable, roughness[band], out=phong, mode='clip')
+			else:						curve_phong(inv, phong) # type: ignore
+			if a is not None: np.multiply(phong, a, out=phong)
+
+		env: np.ndarray|None = None
+		if needsEnvmask and not envFromTable:
+			env = scratch.get('env', rows)
+			envPow = scratch.get('envPow', rows)
+			if envTable is not None:	np.take(envTable, roughness[band], out=envPow, mode='clip')
+			else:						np.power(inv, envExponent, out=envPow)
+			if a is not None: np.multiply(envPow, a, out=envPow)
+			if envScale is not None:
+				np.multiply(envPow, envScale[0, 0], out=env)
+			else:
+				np.multiply(read(metallic, 'm'), 0.75, out=env)
+				np.add(env, 0.25, out=env)
+				np.multiply(env, envPow, out=env)
+
+		def write_alpha(kind: str, dst: np.ndarray, clipAlpha: bool):
+			''' Writes the phong or envmap mask into dst, clipped to 1/255 if clipAlpha is set. '''
+			if kind in alphaTables:
+				np.take(alphaTables[kind][clipAlpha], roughness[band], out=dst, mode='clip')
+				return
+			value = phong if kind == 'phong' else env
+			if clipAlpha:	np.maximum(value, 1 / 255, out=tmp) # type: ignore
+			else:			tmp[...] = value # type: ignore
+			write_u8(tmp, dst)
+
+		# Basetexture
+		if basecolor is not None:
+			if pbr:
+				for c in range(basecolor.shape[2]):
+					transfer(albedo[c], basecolor[band, :, c])
+			else:
+				# 1 - (1 - roughness) * 0 == 1, so a zero metallic only leaves the AO term.
+				mask: np.ndarray|None = None
+				if hasMask:
+					mask = scratch.get('mask', rows)
+					np.multiply(inv, read(metallic, 'm'), out=mask)
+					np.subtract(1, mask, out=mask)
+				if a is not None:
+					aoBlend = scratch.get('aoBlend', rows)
+					np.multiply(a, 0.75, out=aoBlend)
+					np.add(aoBlend, 1 - 0.75, out=aoBlend)
+					if mask is None:	mask = aoBlend
+					else:				np.multiply(mask, aoBlend, out=mask)
+
+				if mask is None:
+					for c in range(3):
+						transfer(albedo[c], basecolor[band, :, c])
+				elif blendU8:
+					# (albedo * mask) >> MASK_BITS, where mask is rounded to fixed-point.
+					maskFixed = scratch.get('maskFixed', rows, np.uint32)
+					blend = scratch.get('blend', rows, np.uint32)
+					np.multiply(mask, 1 << MASK_BITS, out=mask)
+					np.add(mask, 0.5, out=mask)
+					maskFixed[...] = mask
+					for c in range(3):
+						np.multiply(albedo[c][band], maskFixed, out=blend)
+						np.right_shift(blend, MASK_BITS, out=blend)
+						basecolor[band, :, c] = blend
+				else:
+					for c in range(3):
+						np.multiply(read(albedo[c], 'src'), mask, out=tmp)
+						write_u8(tmp, basecolor[band, :, c])
+
+				if baseAlpha == 'albedo':
+					transfer(albedo[3], basecolor[band, :, 3])
+				elif baseAlpha != None:
+					write_alpha(baseAlpha, basecolor[band, :, 3], True)
+
+		# Bumpmap
+		if bumpmap is not None:
+			for c in range(3):
+				if normalU8 is not None:
+					bumpmap[band, :, c] = normalU8[c]
+				elif c == 1 and invertGreen and greenTable is not None:
+					transfer(normal[c], bumpmap[band, :, c], greenTable)
+				elif c == 1 and invertGreen:
+					np.subtract(1, read(normal[c], 'src'), out=tmp)
+					write_u8(tmp, bumpmap[band, :, c])
+				else:
+					transfer(normal[c], bumpmap[band, :, c])
+
+			match bumpAlpha:
+				case 'height':	transfer(heightMap, bumpmap[band, :, 3]) # type: ignore
+				case 'phong' | 'envmask':
+					write_alpha(bumpAlpha, bumpmap[band, :, 3], False)
+
+		# Emission
+		if emit is not None:
+			for c in range(emit.shape[2]):
+				if pbr:
+					transfer(emitPlanes[c], emit[band, :, c], clip=False)
+				elif is_u8(emitPlanes[c]):
+					transfer(emitPlanes[c], emit[band, :, c], emitTable)
+				else:
+					curve_emit(read(emitPlanes[c], 'src'), tmp)
+					write_u8(tmp, emit[band, :, c], clip=False)
+
+		# MRAO
+		if mrao is not None:
+			transfer(metallic, mrao[band, :, 0], clip=False)
+			transfer(roughness, mrao[band, :, 1], clip=False)
+			if ao is not None:	transfer(ao, mrao[band, :, 2], clip=False)
+			else:				mrao[band, :, 2] = 255
+
+		# Phong exponent
+		if phongExp is not None:
+			if phongExpTable is not None:
+				np.take(phongExpTable, roughness[band], out=phongExp[band, :, 0], mode='clip')
+			else:
+				curve_phong_exponent(read(roughness, 'r'), tmp)
+				write_u8(tmp, phongExp[band, :, 0])
+
+		# Envmap mask
+		if envmask is not None:
+			write_alpha('envmask', envmask[band, :, 0], False)
+
+	''' Collect outputs in the same order as export() '''
+
+	textures = []
+	if basecolor is not None:	textures.append(Texture(Image(basecolor), TargetRole.Basecolor))
+	if bumpmap is not None:		textures.append(Texture(Image(bumpmap), TargetRole.Bumpmap))
+	if emit is not None:		textures.append(Texture(Image(emit), TargetRole.Emit))
+	if mrao is not None:		textures.append(Texture(Image(mrao), TargetRole.Mrao))
+	if phongExp is not None:	textures.append(Texture(Image(phongExp), TargetRole.PhongExp))
+	if envmask is not None:		textures.append(Texture(Image(envmask), TargetRole.EnvmapMask))
+	return textures
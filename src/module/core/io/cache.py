@@ -0,0 +1,251 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Callable
+
+from .image import Image, IOBackend
+
+import numpy as np
+import logging as log
+import hashlib, json, os, threading, time
+
+'''
+A persistent cache of decoded source images. Decoding a large PNG or TGA takes far longer
+than reading the same pixels back from an uncompressed .npy file, so every decoded image
+is stored in the cache folder and memory-mapped on later loads.
+
+Entries are content-addressed: each is named after a hash of the source file's bytes and
+the backend that decoded it. The index maps source paths to the size, mtime, and hash they
+had when they were last seen, so unchanged files are found with a single stat() rather than
+being hashed again. Files that were touched but not changed are hashed, and still hit.
+
+The index also records the size and last use of every entry, and entries are evicted from
+it least-recently-used first once the cache grows past its budget, without listing the folder.
+
+Role images are decoded on several threads at once, and batch exports may run several processes
+over the same cache, so the index is only read-modified-written under a lock held against both:
+a threading.Lock, and an OS lock on a lock file next to the index. Temporary files are named
+after both the process and the thread that writes them.
+'''
+
+CACHE_VERSION = 2
+''' Bumped whenever the decoded representation changes, which orphans every older entry. '''
+
+INDEX_NAME = 'index.json'
+LOCK_NAME = 'index.lock'
+
+if os.name == 'nt':
+	import msvcrt
+
+	def lock_file(file: IO):
+		''' Blocks until this process holds the lock on file. '''
+		file.seek(0)
+		while True:
+			# LK_LOCK only retries for 10 seconds before failing.
+			try:
+				msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+				return
+			except OSError:
+				continue
+
+	def unlock_file(file: IO):
+		file.seek(0)
+		msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+	import fcntl
+
+	def lock_file(file: IO):
+		''' Blocks until this process holds the lock on file. '''
+		fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+	def unlock_file(file: IO):
+		fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+def hash_file(path: Path) -> str:
+	''' Hashes the contents of a file. '''
+	with open(path, 'rb') as file:
+		return hashlib.file_digest(file, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+def get_temp_suffix() -> str:
+	''' Returns a suffix for temporary files that no other process or thread is using. '''
+	return f'{os.getpid()}-{threading.get_ident()}'
+
+@dataclass
+class CacheIndex():
+	sources: dict[str, tuple[int, int, str]] = field(default_factory=dict)
+	''' The size, mtime, and content hash of each source path when it was last hashed. '''
+	entries: dict[str, tuple[int, float]] = field(default_factory=dict)
+	''' The bytes and last use (time.time) of each entry, by file name. '''
+
+	def encode(self) -> dict:
+		return { 'sources': self.sources, 'entries': self.entries }
+
+	@staticmethod
+	def decode(data) -> 'CacheIndex':
+		assert isinstance(data, dict) and isinstance(data['sources'], dict) and isinstance(data['entries'], dict)
+		return CacheIndex(
+			{ k: (int(v[0]), int(v[1]), str(v[2])) for k, v in data['sources'].items() },
+			{ k: (int(v[0]), float(v[1])) for k, v in data['entries'].items() }
+		)
+
+class DecodeCache():
+	''' A folder of decoded images, bounded to budget bytes. '''
+
+	def __init__(self, folder: Path, budget: int) -> None:
+		self.folder = folder
+		self.budget = budget
+		self.folder.mkdir(parents=True, exist_ok=True)
+		self.lock = threading.Lock()
+		self.sources: dict[str, tuple[int, int, str]] = (self.__read_index__() or CacheIndex()).sources
+
+	def __read_index__(self) -> CacheIndex|None:
+		try:
+			with open(self.folder / INDEX_NAME, 'r') as file:
+				return CacheIndex.decode(json.load(file))
+		except (OSError, ValueError, TypeError, KeyError, IndexError, AssertionError):
+			return None
+
+	def __scan_entries__(self) -> dict[str, tuple[int, float]]:
+		''' Lists the entries in the folder. This is only needed when the index is missing or from an older version. '''
+		entries = {}
+		for entryPath in self.folder.glob('*.npy'):
+			try:
+				stat = entryPath.stat()
+				entries[entryPath.name] = (stat.st_size, stat.st_mtime)
+			except OSError:
+				continue
+		return entries
+
+	def __update_index__(self, update: Callable[[CacheIndex], None]) -> bool:
+		'''
+		Applies update to the index on disk, which other threads and processes may have changed since it was last read,
+		and writes it back. Both are done under the lock, so no other update can be lost in between. Returns false if
+		the index couldn't be written.
+		'''
+		with self.lock:
+			try:
+				with open(self.folder / LOCK_NAME, 'a+b') as lockFile:
+					lock_file(lockFile)
+					try:
+						index = self.__read_index__() or CacheIndex(entries=self.__scan_entries__())
+						update(index)
+						self.sources = index.sources
+
+						temp = self.folder / f'{INDEX_NAME}.{get_temp_suffix()}'
+						with open(temp, 'w') as file:
+							json.dump(index.encode(), file)
+						os.replace(temp, self.folder / INDEX_NAME)
+					finally:
+						unlock_file(lockFile)
+			except OSError:
+				log.warning('Failed to write the decode cache index!')
+				return False
+		return True
+
+	def get_hash(self, path: Path) -> str:
+		''' Returns the content hash of a file, which is only computed if the file has changed since it was indexed. '''
+		path = path.absolute()
+		key = str(path)
+		stat = path.stat()
+
+		source = self.sources.get(key)
+		if source == None or source[0] != stat.st_size or source[1] != stat.st_mtime_ns:
+			source = (stat.st_size, stat.st_mtime_ns, hash_file(path))
+			def add_source(index: CacheIndex):
+				index.sources[key] = source # type: ignore
+			self.__update_index__(add_source)
+		return source[2]
+
+	def get_entry_path(self, digest: str, backend: type[IOBackend], size: tuple[int, int]|None=None, channels: int|None=None) -> Path:
+		''' Returns the path of an entry. Images decoded at a reduced size or with fewer channels are stored separately from full ones. '''
+		sizeTag = f'-{size[0]}x{size[1]}' if size else ''
+		channelTag = f'-c{channels}' if channels else ''
+		return self.folder / f'{digest}-{backend.__name__}{sizeTag}{channelTag}-v{CACHE_VERSION}.npy'
+
+	def load(self, path: str|Path, backend: type[IOBackend], size: tuple[int, int]|None=None, channels: int|None=None) -> Image:
+		''' Loads an image from the cache, or decodes it with backend and caches it. (See IOBackend.load) '''
+		path = Path(path)
+		try:
+			digest = self.get_hash(path)
+		except OSError:
+			# Let the backend report the failure.
+			return backend.load(path, size, channels)
+
+		entryPath = self.get_entry_path(digest, backend, size, channels)
+		try:
+			# Copy-on-write, so images can still be modified in-place without touching the cache.
+			data = np.asarray(np.load(entryPath, mmap_mode='c'))
+			entrySize = entryPath.stat().st_size
+			def touch(index: CacheIndex):
+				index.entries[entryPath.name] = (entrySize, time.time())
+			self.__update_index__(touch)
+			log.debug(f'Loaded {path.name} from the decode cache')
+			return Image(data)
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError):
+			log.warning(f'Discarding unreadable decode cache entry {entryPath.name}')
+
+		image = backend.load(path, size, channels)
+		self.store(entryPath, image.data)
+		return image
+
+	def store(self, entryPath: Path, data: np.ndarray):
+		''' Writes an entry, then evicts older entries until the cache fits its budget. '''
+		if data.nbytes > self.budget: return
+
+		temp = entryPath.with_name(f'{entryPath.name}.{get_temp_suffix()}')
+		try:
+			with open(temp, 'wb') as file:
+				np.save(file, data, allow_pickle=False)
+				entrySize = file.tell()
+			os.replace(temp, entryPath)
+		except OSError:
+			log.warning(f'Failed to write decode cache entry {entryPath.name}')
+			temp.unlink(missing_ok=True)
+			return
+
+		def add_entry(index: CacheIndex):
+			index.entries[entryPath.name] = (entrySize, time.time())
+			self.__evict__(index, keep=entryPath.name)
+		self.__update_index__(add_entry)
+
+	def evict(self):
+		''' Deletes the least-recently-used entries until the cache fits its budget. '''
+		self.__update_index__(self.__evict__)
+
+	def __evict__(self, index: CacheIndex, keep: str|None=None):
+		''' Evicts entries from index, and deletes their files. Must be called by __update_index__. '''
+		total = sum(size for size, _ in index.entries.values())
+		if total <= self.budget: return
+
+		for name, (size, _) in sorted(index.entries.items(), key=lambda x: x[1][1]):
+			if total <= self.budget: break
+			if name == keep: continue
+			try:
+				(self.folder / name).unlink(missing_ok=True)
+			except OSError:
+				# Entries that are mapped by another process can't be deleted on some platforms.
+				continue
+			del index.entries[name]
+			total -= size
+
+		# Forget paths whose entries are gone, so the index doesn't outgrow the cache.
+		digests = { name.split('-', 1)[0] for name in index.entries }
+		index.sources = { key: source for key, source in index.sources.items() if source[2] in digests }
+
+def get_file_stat(path: str|Path) -> tuple[int, int, int]|None:
+	''' Returns the (mtime, size, inode) of a file, which change whenever it is written or replaced, or None if it can't be accessed. '''
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def get_file_hash(path: str|Path) -> str:
+	''' Hashes the contents of a file, through the decode cache's index if one is set. '''
+	if Image.cache: return Image.cache.get_hash(Path(path))
+	return hash_file(Path(path))
+
+def setup_decode_cache(folder: Path, budget: int):
+	''' Makes Image.load use a decode cache in folder, or no cache if budget (bytes) is 0. '''
+	Image.set_cache(DecodeCache(folder, budget) if budget > 0 else None)
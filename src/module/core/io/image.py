@@ -1,9 +1,15 @@
 import numpy as np
 from numpy.typing import DTypeLike
 from pathlib import Path
-from typing import Literal
+from typing import Callable, Literal
+from typing import TYPE_CHECKING
 from abc import abstractmethod
 
+from .resample import ResampleFilter, resample_planes
+
+if TYPE_CHECKING:
+	from .cache import DecodeCache
+
 class IOBackend():
 	'''
 	Represents an abstract I/O interface for saving and loading images to/from
@@ -17,30 +23,100 @@ class IOBackend():
 
 	@staticmethod
 	@abstractmethod
-	def load(path: str|Path) -> 'Image':
+	def load(path: str|Path, size: tuple[int, int]|None=None, channels: int|None=None) -> 'Image':
+		'''
+		Loads an image at the precision it is stored at. If size is specified and smaller than the image, the backend may
+		decode it at or nearer to that size instead of at full size, so the result must still be resized. (See is_downscale)
+		If channels is specified, only the first channels are kept, so images may still have fewer channels than that.
+		'''
 		...
 
 	@staticmethod
-	@abstractmethod
-	def resize(image: 'Image', dims: tuple[int, int]) -> 'Image':
-		...
+	def read_size(path: str|Path) -> tuple[int, int]|None:
+		''' Returns the size of an image file without decoding it, or None if it can't be read cheaply. '''
+		return None
+
+def is_downscale(source: tuple[int, int], size: tuple[int, int]) -> bool:
+	''' Returns true if an image of the source size would be shrunk to size, and is worth decoding at that size. '''
+	return source != size and size[0] <= source[0] and size[1] <= source[1]
+
+def from_resampled(data: np.ndarray, dtype: DTypeLike) -> np.ndarray:
+	''' Converts a plane from resample_planes back to dtype, clipping the overshoot of the filter to the range of the dtype, or to [0, 1] for floats. '''
+	dtype = np.dtype(dtype)
+	if dtype.kind == 'f':
+		np.clip(data, 0, 1, out=data)
+		return data if dtype == np.float32 else data.astype(dtype)
+
+	np.clip(data, 0, max_value(dtype), out=data)
+	np.rint(data, out=data)
+	return data.astype(dtype)
+
+IO_BACKENDS = ('qt', 'sourcepp')
+''' The names of the available I/O backends. '''
+
+def get_backend(name: str) -> type[IOBackend]:
+	''' Imports an I/O backend by name. Backends are imported lazily, so Qt is only loaded when it is used. '''
+	match name:
+		case 'qt':
+			from .qtio import QtIOBackend
+			return QtIOBackend
+		case 'sourcepp':
+			from .sppio import SourceppIOBackend
+			return SourceppIOBackend
+	raise ValueError(f'Unknown I/O backend "{name}"! Expected one of {IO_BACKENDS}.')
+
+CONVERT_BAND_PIXELS = 1 << 16
+''' The approximate number of pixels converted at a time by Image.convert, which bounds the size of its temporaries. '''
+
+def max_value(dtype: DTypeLike) -> int:
+	''' Returns the value of a full channel in the specified datatype: 1 for floats, and the largest value for integers. '''
+	dtype = np.dtype(dtype)
+	return 1 if dtype.kind == 'f' else 2**(dtype.itemsize*8) - 1
+
+def is_constant_array(data: np.ndarray) -> bool:
+	''' True if the rows and columns of data are a single value broadcast over its size. See Image.constant. '''
+	return data.strides[0] == 0 and data.strides[1] == 0
+
+def fold(data: np.ndarray, fn: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+	''' Applies fn to the single pixel of a constant array, and broadcasts the result back over its size. '''
+	value = fn(data[:1, :1])
+	return np.broadcast_to(value, (*data.shape[:2], *value.shape[2:]))
 
 class Image():
 	'''
 	This class serves as a non-shit backend for vaguely-advanced image operations.
 	It combines the functionality of PIL, while using numpy to skirt the
 	limitations and general badness of the PIL API.
+
+	Pixels are stored either interleaved, as a (height, width, channels) array, or planar,
+	as a tuple of (height, width) arrays. Merging channels produces a planar image that
+	borrows them, splitting a planar image hands its planes back, and operations keep planar
+	images planar. Borrowed planes are copied before they are first modified, and planes are
+	only interleaved once, when the image's data is requested (usually by tobytes, right
+	before encoding).
 	'''
 
 	backend: type[IOBackend] # static
+	cache: 'DecodeCache|None' = None # static
 
 	@staticmethod
 	def set_backend(backend: type[IOBackend]):
 		Image.backend = backend
 
 	@staticmethod
-	def load(path: str|Path) -> 'Image':
-		return Image.backend.load(path)
+	def set_cache(cache: 'DecodeCache|None'):
+		Image.cache = cache
+
+	@staticmethod
+	def load(path: str|Path, backend: type[IOBackend]|None=None, size: tuple[int, int]|None=None, channels: int|None=None) -> 'Image':
+		'''
+		Loads an image with backend (or the default backend), through the decode cache if one is set.
+		If size is specified, the image may be decoded nearer to that size, and if channels is specified,
+		only the first channels are kept. (See IOBackend.load)
+		'''
+		backend = backend or Image.backend
+		if Image.cache: return Image.cache.load(path, backend, size, channels)
+		return backend.load(path, size, channels)
 
 	@staticmethod
 	def blank(size: tuple[int, int], color: tuple[int|float, ...]=(1, 1, 1), dtype: DTypeLike=np.float32) -> 'Image':
@@ -50,19 +126,45 @@ class Image():
 		data *= color
 		return Image(data)
 
+	@staticmethod
+	def constant(size: tuple[int, int], color: tuple[int|float, ...]=(1, 1, 1), dtype: DTypeLike=np.float32) -> 'Image':
+		'''
+		Creates a lazy blank image by size, type, and color. The color is broadcast over the
+		image without allocating any pixels, which are only materialized when they are needed.
+		'''
+		value = np.array(color, dtype)
+		return Image(np.broadcast_to(value, (size[1], size[0], len(color))))
+
+	@staticmethod
+	def from_planes(planes: tuple[np.ndarray, ...], owned: bool=False) -> 'Image':
+		'''
+		Creates a planar image from a tuple of (height, width) arrays. The arrays are not copied.
+		Unless owned is specified, they are copied before the image modifies them.
+		'''
+		if len(planes) == 1: return Image(planes[0])
+		image = Image(planes[0])
+		image.__data__ = None
+		image.__planes__ = tuple(planes)
+		image.__owned__ = owned
+		return image
+
 	@staticmethod
 	def merge(axes: tuple["Image", ...]) -> 'Image':
-		''' Merges N images into one as color channels. '''
+		''' Merges N images into one as color channels. The channels are not copied! '''
 		width, height = axes[0].size
 		for i, img in enumerate(axes):
 			assert img.channels == 1, f'Expected single-channel image when merging channel {i}'
 			assert img.size == (width, height), f'Expected size ({width}, {height}) when merging channel {i}, but got {img.size}'
-		data = np.stack([img.data.reshape((height, width)) for img in axes])
-		return Image(np.swapaxes(np.swapaxes(data, 0, 1), 1, 2))
+		if all(img.is_constant for img in axes):
+			value = np.concatenate([img.data[0, 0] for img in axes])
+			return Image(np.broadcast_to(value, (height, width, len(axes))))
+		return Image.from_planes(tuple(img.plane(0) for img in axes))
 
 
-	data: np.ndarray
 	dna: set[int]
+	__data__: np.ndarray|None
+	__planes__: tuple[np.ndarray, ...]|None
+	__owned__: bool
 
 	def __init__(self, src: np.ndarray, dna: set[int]=set()) -> None:
 		''' Creates a new image. src can be a filepath or a numpy array! '''
@@ -72,43 +174,162 @@ class Image():
 		self.data = src
 		self.dna = dna
 
-		if self.channels == 1:
-			self.data = self.data.reshape((self.size[1], self.size[0], 1))
-	
-	def resize(self, size: tuple[int, int]) -> 'Image':
-		''' Resizes this image if necessary. '''
-		if self.size == size: return self
-		return Image.backend.resize(self, size)
-
-	def convert(self, dtype: DTypeLike, clip=False) -> 'Image':
-		''' Returns a copy of this image, converted to the specified datatype. '''
+	@property
+	def data(self) -> np.ndarray:
+		''' This image's pixels as a (height, width, channels) array. Planar images are interleaved on access. '''
+		if self.__data__ is None:
+			self.__data__ = self.interleave()
+			self.__planes__ = None
+		return self.__data__
+
+	@data.setter
+	def data(self, data: np.ndarray):
+		if len(data.shape) == 2: data = data.reshape((*data.shape, 1))
+		self.__data__ = data
+		self.__planes__ = None
+		self.__owned__ = True
+
+	@property
+	def is_planar(self) -> bool:
+		''' True if this image's channels are stored as separate planes. '''
+		return self.__planes__ is not None
+
+	@property
+	def is_constant(self) -> bool:
+		''' True if this image is a single color broadcast over its size. See Image.constant. '''
+		if self.__planes__ is not None: return all(is_constant_array(x) for x in self.__planes__)
+		return is_constant_array(self.data)
+
+	@property
+	def dtype(self) -> np.dtype:
+		if self.__planes__ is not None: return np.result_type(*self.__planes__)
+		return self.data.dtype
+
+	def plane(self, channel: int) -> np.ndarray:
+		''' Returns a (height, width) view of a single channel, without interleaving planar images. '''
+		if self.__planes__ is not None: return self.__planes__[channel]
+		return self.data[..., channel]
+
+	def interleave(self, dtype: DTypeLike|None=None) -> np.ndarray:
+		''' Returns this image's pixels as a C-contiguous (height, width, channels) array, converted to dtype if specified. '''
+		if self.__planes__ is None:
+			return np.ascontiguousarray(self.data, dtype)
+
+		if self.is_constant:
+			value = np.array([x[0, 0] for x in self.__planes__], dtype or self.dtype)
+			return np.broadcast_to(value, (self.size[1], self.size[0], self.channels))
+
+		out = np.empty((self.size[1], self.size[0], self.channels), dtype or self.dtype)
+		for i, plane in enumerate(self.__planes__):
+			out[..., i] = plane
+		return out
+
+	def materialize(self) -> 'Image':
+		''' Allocates real pixels for a constant image in-place, returning self. '''
+		if self.__planes__ is not None: self.__own_planes__(True)
+		elif self.is_constant: self.data = self.data.copy()
+		return self
+
+	def __own_planes__(self, copyConstants: bool):
+		''' Copies any borrowed planes (and constants, if specified) so they can be modified in-place. '''
+		assert self.__planes__ is not None
+		planes = list(self.__planes__)
+		for i, plane in enumerate(planes):
+			if is_constant_array(plane):
+				if copyConstants: planes[i] = plane.copy()
+			elif not self.__owned__:
+				planes[i] = plane.copy()
+		self.__planes__ = tuple(planes)
+		self.__owned__ = True
+
+	def __map__(self, fn: Callable[[np.ndarray], np.ndarray]) -> 'Image':
+		''' Returns a new image with fn applied to its data, or to each plane. fn must return a new array. Constants are folded. '''
+		def apply(data: np.ndarray) -> np.ndarray:
+			return fold(data, fn) if is_constant_array(data) else fn(data)
+
+		if self.__planes__ is not None: return Image.from_planes(tuple(apply(x) for x in self.__planes__), owned=True)
+		return Image(apply(self.data))
+
+	def resize(self, size: tuple[int, int], filter: ResampleFilter=ResampleFilter.Lanczos, batch: bool=True) -> 'Image':
+		''' Resizes this image if necessary. (See resize_all) '''
+		return Image.resize_all([self], size, filter, batch)[0]
+
+	@staticmethod
+	def resize_all(images: list['Image'], size: tuple[int, int], filter: ResampleFilter=ResampleFilter.Lanczos, batch: bool=True) -> list['Image']:
+		'''
+		Resizes images to size if necessary. The planes of every image of the same size are resampled together,
+		and share their weights. (See resample_planes) Images keep their dtype, and constant planes stay constant.
+		If batch is false, planes are resampled and converted back one at a time instead, so only one is held as float32 at once.
+		'''
+		results = list(images)
+		groups: dict[tuple[int, int], list[int]] = {}
+		for i, image in enumerate(images):
+			if image.size == size: continue
+			if image.is_constant:	results[i] = Image(np.broadcast_to(image.data[0, 0], (size[1], size[0], image.channels)))
+			else:					groups.setdefault(image.size, []).append(i)
+
+		for indices in groups.values():
+			planes = [images[i].plane(c) for i in indices for c in range(images[i].channels)]
+			varying = [plane for plane in planes if not is_constant_array(plane)]
+			if batch:	resampled = iter(resample_planes(varying, size, filter))
+			else:		resampled = (resample_planes([plane], size, filter)[0] for plane in varying)
+
+			def resize_plane(plane: np.ndarray) -> np.ndarray:
+				if is_constant_array(plane): return np.broadcast_to(plane[0, 0], (size[1], size[0]))
+				return from_resampled(next(resampled), plane.dtype)
+
+			for i in indices:
+				image = images[i]
+				results[i] = Image.from_planes(tuple(resize_plane(image.plane(c)) for c in range(image.channels)), owned=True)
+
+		return results
+
+	def convert(self, dtype: DTypeLike, clip=False, out: np.ndarray|None=None) -> 'Image':
+		'''
+		Returns a copy of this image, converted to the specified datatype. If out is specified, the
+		result is written into it (interleaving planar images), unless this image is constant.
+		'''
 		obj_dtype = np.dtype(dtype)
-		data = self.data
+		data_dtype = self.dtype
+
+		max_from = max_value(data_dtype)
+		max_to   = max_value(obj_dtype)
+
+		def convert(data: np.ndarray, out: np.ndarray|None=None) -> np.ndarray:
+			if out is None: out = np.empty(data.shape, obj_dtype)
 
-		max_from: int = 1 if data.dtype.kind == 'f' else 2**(data.dtype.itemsize*8) - 1
-		max_to: int   = 1 if obj_dtype.kind == 'f' else 2**(obj_dtype.itemsize*8) - 1
+			# Convert in bands of rows, so the temporaries stay small.
+			rows = max(1, CONVERT_BAND_PIXELS // max(1, data.shape[1]))
+			for y in range(0, data.shape[0], rows):
+				band = data[y : y + rows]
+				if clip:
+					band = band.clip(0, max_from)
+				out[y : y + rows] = band * (max_to / max_from)
 
-		if clip:
-			data = data.clip(0, max_from)
+			return out
 
-		new_data = data.copy('C') * (max_to / max_from)
-		return Image(new_data.astype(obj_dtype))
+		if out is not None and not self.is_constant:
+			for i in range(self.channels):
+				convert(self.plane(i), out[..., i])
+			return Image(out)
+
+		return self.__map__(convert)
 
 	def split(self) -> list["Image"]:
-		''' Returns this image's data as a list of channels '''
-		channels = np.swapaxes(np.swapaxes(self.data, 2, 1), 1, 0)
-		return [Image(x) for x in channels]
+		''' Returns this image's data as a list of channels. The channels are not copied! '''
+		return [Image(self.plane(i)) for i in range(self.channels)]
 
 	def normalize(self, mode: Literal['RGB', 'RGBA', 'L']) -> 'Image':
 		s = self.split()
+		opaque = (max_value(self.dtype),)
 		if self.channels == 1:
 			if mode == 'L': return self
 			if mode == 'RGB': return Image.merge(( s[0], s[0], s[0] ))
-			return Image.merge(( s[0], s[0], s[0], Image.blank(self.size, dtype=self.data.dtype, color=(1,)) ))
+			return Image.merge(( s[0], s[0], s[0], Image.constant(self.size, dtype=self.dtype, color=opaque) ))
 		if self.channels == 3:
 			if mode == 'L': return self.split()[0]
 			if mode == 'RGB': return self
-			return Image.merge(( s[0], s[1], s[2], Image.blank(self.size, dtype=self.data.dtype, color=(1,)) ))
+			return Image.merge(( s[0], s[1], s[2], Image.constant(self.size, dtype=self.dtype, color=opaque) ))
 		if self.channels == 4:
 			if mode == 'L': return self.split()[0]
 			if mode == 'RGB': return Image.merge(tuple(self.split()[:3]))
@@ -131,11 +352,15 @@ class Image():
 	def has_transparency(self) -> bool:
 		''' Attempts to determine what kind of transparency this image has. '''
 		if self.channels < 4: return False
-		alpha = self.get_channel(3)
-		count_all = alpha.size
-		count_solid = np.sum(alpha == 1.0)
-		if count_solid == count_all: return False
-		return True
+		alpha = self.plane(3)
+		opaque = max_value(alpha.dtype)
+		if is_constant_array(alpha): return bool(alpha[0, 0] != opaque)
+
+		# Compared in bands of rows, so large images don't need a full-size mask.
+		rows = max(1, CONVERT_BAND_PIXELS // alpha.shape[1])
+		for y in range(0, alpha.shape[0], rows):
+			if not np.all(alpha[y : y + rows] == opaque): return True
+		return False
 		# While this is cool, it should definitely be user-controlled.
 		# count_alpha = np.sum(alpha == 0.0)
 		# percent_cutout = ((count_alpha + count_solid) / count_all)
@@ -144,67 +369,152 @@ class Image():
 
 	def get_channel(self, channel: int) -> np.ndarray:
 		if channel >= self.channels: raise ValueError(f'Attempted to get channel {channel+1} of {self.channels}-channel image!')
-		return self.data.swapaxes(0, 2)[channel]
+		return self.plane(channel).T
 
 	def set_channel(self, channel: int, data: np.ndarray):
 		if channel >= self.channels: raise ValueError(f'Attempted to set channel {channel+1} of {self.channels}-channel image!')
-		self.data.swapaxes(0, 2)[channel] = data
+		self.materialize()
+		self.get_channel(channel)[...] = data
 
 	def tobytes(self, format: DTypeLike) -> bytes:
-		''' Converts this image to bytes. '''
-		if self.data.dtype == format: return self.data.tobytes('C')
-		return self.data.astype(format).tobytes('C')
+		''' Converts this image to bytes. Planar images are interleaved straight into the target format. '''
+		return self.interleave(format).tobytes('C')
 
 	def save(self, path: str|Path, **kwargs) -> bool:
 		''' Saves this image to a file. Useful for debug. '''
 		return Image.backend.save(self, path, **kwargs)
 
-	def copy(self) -> "Image":
-		''' Clones this image. '''
-		return Image(self.data.copy())
+	def copy(self, out: np.ndarray|None=None) -> "Image":
+		'''
+		Clones this image. Constant images and planes share their (read-only) data. If out is
+		specified, the pixels are copied into it (interleaving planar images), unless this image is constant.
+		'''
+		if out is not None and not self.is_constant:
+			if self.__planes__ is None: np.copyto(out, self.data)
+			else:
+				for i, plane in enumerate(self.__planes__): out[..., i] = plane
+			return Image(out)
+
+		return self.__map__(lambda data: data.copy())
 
 	@property
 	def size(self) -> tuple[int, int]:
+		if self.__planes__ is not None: return (np.size(self.__planes__[0], 1), np.size(self.__planes__[0], 0))
 		return (np.size(self.data, 1), np.size(self.data, 0))
 
 	@property
 	def channels(self) -> int:
+		if self.__planes__ is not None: return len(self.__planes__)
 		return 1 if len(self.data.shape) == 2 else np.size(self.data, 2)
 
-	def mult(self, other: "Image|int|float"):
-		''' Multiplies in-place, returning self. '''
-		v: np.ndarray|int|float = other.data if isinstance(other, Image) else other
-		self.data *= v
+	def __apply__(self, op: Callable[[np.ndarray, np.ndarray|int|float], np.ndarray], other: "Image|int|float"):
+		'''
+		Applies an in-place operation, returning self. Constant operands are folded,
+		so the result only allocates pixels if either operand has real pixels.
+		Planar operands are applied plane-by-plane, so neither is interleaved.
+		'''
+		if isinstance(other, Image) and other.is_constant:
+			other = other.data[0, 0]
+
+		def fold_op(value: np.ndarray, operand) -> np.ndarray:
+			value = value.copy()
+			op(value, operand)
+			return value
+
+		if self.__planes__ is not None or (isinstance(other, Image) and other.is_planar):
+			def operand(channel: int):
+				if isinstance(other, Image): return other.plane(channel if other.channels > 1 else 0)
+				if isinstance(other, np.ndarray) and other.size > 1: return other[channel]
+				return other
+
+			if self.__planes__ is None:
+				self.materialize()
+				for i in range(self.channels):
+					op(self.plane(i), operand(i))
+				return self
+
+			self.__own_planes__(False)
+			planes = list(self.__planes__)
+			for i, plane in enumerate(planes):
+				value = operand(i)
+				if not is_constant_array(plane):
+					op(plane, value)
+				elif isinstance(value, np.ndarray) and value.ndim == 2:
+					planes[i] = plane.copy()
+					op(planes[i], value)
+				else:
+					planes[i] = fold(plane, lambda x: fold_op(x, value))
+			self.__planes__ = tuple(planes)
+
+		elif isinstance(other, Image):
+			self.materialize()
+			op(self.data, other.data)
+		elif self.is_constant:
+			self.data = fold(self.data, lambda x: fold_op(x, other))
+		else:
+			op(self.data, other)
+
 		return self
 
+	@staticmethod
+	def __const_equals__(other: "Image|int|float", value: float) -> bool:
+		''' Returns true if other is a scalar or constant image that is entirely equal to value. '''
+		if isinstance(other, Image):
+			return other.is_constant and bool(np.all(other.data[0, 0] == value))
+		return other == value
+
+	def mult(self, other: "Image|int|float"):
+		''' Multiplies in-place, returning self. Multiplying by a constant zero folds to a constant zero. '''
+		if Image.__const_equals__(other, 1): return self
+		if Image.__const_equals__(other, 0):
+			self.data = np.broadcast_to(np.zeros(self.channels, self.dtype), (self.size[1], self.size[0], self.channels))
+			return self
+		if isinstance(other, Image) and (other.size, other.channels) == (self.size, self.channels) and Image.__const_equals__(self, 1):
+			dtype = self.dtype
+			copy = other.__map__(lambda data: data.astype(dtype))
+			self.__data__, self.__planes__, self.__owned__ = copy.__data__, copy.__planes__, copy.__owned__
+			return self
+		def op(a, b): a *= b
+		return self.__apply__(op, other)
+
 	def div(self, other: "Image|int|float"):
 		''' Divides in-place, returning self. '''
-		v = other.data if isinstance(other, Image) else other
-		self.data /= v
-		return self
+		if Image.__const_equals__(other, 1): return self
+		def op(a, b): a /= b
+		return self.__apply__(op, other)
 
 	def pow(self, other: "Image|int|float"):
 		''' Powers in-place, returning self. '''
-		v = other.data if isinstance(other, Image) else other
-		self.data **= other
-		return self
+		if Image.__const_equals__(other, 1): return self
+		def op(a, b): a **= b
+		return self.__apply__(op, other)
 
 	def add(self, other: "Image|int|float"):
 		''' Adds in-place, returning self. '''
-		v = other.data if isinstance(other, Image) else other
-		self.data += v
-		return self
+		if Image.__const_equals__(other, 0): return self
+		def op(a, b): a += b
+		return self.__apply__(op, other)
 
 	def sub(self, other: "Image|int|float"):
 		''' Subtracts in-place, returning self. '''
-		v = other.data if isinstance(other, Image) else other
-		self.data -= v
-		return self
+		if Image.__const_equals__(other, 0): return self
+		def op(a, b): a -= b
+		return self.__apply__(op, other)
+
+	def invert(self, out: np.ndarray|None=None):
+		'''
+		Inverts in-place, returning self. If out is specified, the result is written into it (which
+		may be this image's own data) instead of a new array, unless this image is constant.
+		'''
+		full = max_value(self.dtype)
+		if out is not None and not self.is_constant:
+			for i in range(self.channels):
+				np.subtract(full, self.plane(i), out=out[..., i])
+			self.data = out
+			return self
 
-	def invert(self):
-		''' Inverts in-place, returning self. '''
-		max_value: int = 1 if self.data.dtype.kind == 'f' else 2**(self.data.dtype.itemsize*8) - 1
-		self.data = max_value - self.data
+		inverted = self.__map__(lambda data: full - data)
+		self.__data__, self.__planes__, self.__owned__ = inverted.__data__, inverted.__planes__, inverted.__owned__
 		return self
 
 	def rot90(self, num: int=1):
@@ -218,3 +528,67 @@ class Image():
 	def flip_v(self):
 		self.data = np.flip(self.data, 1)
 		return self
+
+class BufferPool():
+	'''
+	A pool of scratch arrays, keyed by size and type. Arrays are leased with get() or copy(),
+	and are reused once they are given back with release(). Used by export() to recycle the
+	full-size intermediate images of each texture, rather than allocating new ones.
+	'''
+
+	def __init__(self) -> None:
+		self.free: dict[tuple[int, np.dtype], list[np.ndarray]] = {}
+		self.leased: dict[int, np.ndarray] = {}
+		self.hits = 0
+		''' The number of leases that reused a released array. '''
+		self.misses = 0
+		''' The number of leases that allocated a new array. '''
+
+	def get(self, shape: tuple[int, ...], dtype: DTypeLike=np.float32) -> np.ndarray:
+		''' Leases an uninitialized array of the specified shape and type. Arrays of the same size are shared between shapes. '''
+		size = int(np.prod(shape))
+		free = self.free.get((size, np.dtype(dtype)))
+		if free:
+			self.hits += 1
+			array = free.pop()
+		else:
+			self.misses += 1
+			array = np.empty(size, dtype)
+
+		self.leased[id(array)] = array
+		return array.reshape(shape)
+
+	def copy(self, image: Image) -> Image:
+		'''
+		Copies an image into leased arrays. Each channel is copied into its own plane, so every
+		lease is the size of a single channel and can be reused by any other. Constant images are shared instead.
+		'''
+		if image.is_constant: return image.copy()
+
+		width, height = image.size
+		if image.channels == 1:
+			return image.copy(out=self.get((height, width, 1), image.dtype))
+
+		planes: list[np.ndarray] = []
+		for i in range(image.channels):
+			plane = image.plane(i)
+			if not is_constant_array(plane):
+				copy = self.get((height, width), plane.dtype)
+				np.copyto(copy, plane)
+				plane = copy
+			planes.append(plane)
+		return Image.from_planes(tuple(planes), owned=True)
+
+	def release(self, *items: Image|np.ndarray|None):
+		'''
+		Gives the arrays backing the specified images back to the pool. The images must no longer be used!
+		Arrays (and views of arrays) that were not leased from this pool are ignored.
+		'''
+		for item in items:
+			if item is None: continue
+			arrays = [item.plane(i) for i in range(item.channels)] if isinstance(item, Image) else [item]
+			for array in arrays:
+				for candidate in (array, array.base):
+					leased = self.leased.pop(id(candidate), None)
+					if leased is None: continue
+					self.free.setdefault((leased.size, leased.dtype), []).append(leased)
@@ -1,159 +1,184 @@
 from pathlib import Path
 
-from .image import Image, IOBackend
+from .image import Image, IOBackend, is_downscale
+from .sppio import SPP_SUPPORTED, get_path_suffix, load_sourcepp, read_vtf_size, save_vtf
 
-from PySide6.QtGui import QImage
-from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage, QImageReader, QPixelFormat
+from PySide6.QtCore import QSize
 
 import numpy as np
-from typing import IO
+from numpy.typing import DTypeLike
+from concurrent.futures import Executor
 from sourcepp import vtfpp
-ImageFormats = vtfpp.ImageFormat
-ImageConversion = vtfpp.ImageConversion
 
 qimage_test: QImage|None = None
 
-def get_path_suffix(path: str | Path) -> str:
-	split = str(path).rsplit('.', 1)
-	if len(split) > 1: return split[-1]
-	return ''
-
-def load_sourcepp(file: IO[bytes], kind: str):
-	raw_data: bytes
-	width: int
-	height: int
-	format: ImageFormats
-
-	if kind == 'vtf':
-		vtf = vtfpp.VTF(file.read())
-		raw_data = vtf.get_image_data_raw()
-		format = vtf.format
-		width = vtf.width
-		height = vtf.height
-	else:
-		raw_data, format, width, height, frame_count = ImageConversion.convert_file_to_image_data(file.read())
-
-	f32_data = ImageConversion.convert_image_data_to_format(raw_data, format, ImageFormats.RGBA32323232F, width, height)
-	data = np.frombuffer(f32_data, dtype=np.float32).reshape(height, width, 4)
-	return Image(data)
-
-def image_to_qimage(image: Image) -> QImage:
-	''' Converts an Image to a Qt QImage. (U8) '''
-	width, height = image.size
-	bpp = image.channels
-	data = image.convert(np.uint8).tobytes(np.uint8)
-
-	format: QImage.Format
-	match image.channels:
-		case 1: format = QImage.Format.Format_Grayscale8
-		case 3: format = QImage.Format.Format_RGB888
-		case 4: format = QImage.Format.Format_RGBA8888
-		case count:
-			raise Exception(f'Cannot convert Image to QImage with {count} channels!')
-
-	qimage = QImage(data, width, height, bpp*width, format)
+QIMAGE_FORMATS: dict[QImage.Format, tuple[DTypeLike, int]] = {
+	QImage.Format.Format_Grayscale8:	(np.uint8, 1),
+	QImage.Format.Format_Grayscale16:	(np.uint16, 1),
+	QImage.Format.Format_RGB888:		(np.uint8, 3),
+	QImage.Format.Format_RGBA8888:		(np.uint8, 4),
+	QImage.Format.Format_RGBA64:		(np.uint16, 4),
+	QImage.Format.Format_RGBA16FPx4:	(np.float16, 4),
+	QImage.Format.Format_RGBA32FPx4:	(np.float32, 4),
+}
+''' QImage formats that can be used as numpy arrays without conversion, and their dtypes and channel counts. '''
+
+DCT_SCALED_FORMATS = (b'jpeg', b'jpg')
+''' Formats Qt decodes at 1/2, 1/4 or 1/8 of their size in the DCT domain, when asked for a scaled size. (See get_nearest_dct_size) '''
+DCT_SCALES = (8, 4, 2)
+
+def get_nearest_dct_size(source: tuple[int, int], size: tuple[int, int]) -> tuple[int, int]:
+	'''
+	Returns the smallest DCT scale of a JPEG that is at least size, which can be decoded instead of the full image.
+	Asking Qt for exactly that size keeps it from smoothing the rest of the way, which is left for Image.resize.
+	'''
+	for scale in DCT_SCALES:
+		# libjpeg rounds the scaled size up.
+		scaled = (-(-source[0] // scale), -(-source[1] // scale))
+		if scaled[0] >= size[0] and scaled[1] >= size[1]: return scaled
+	return source
+
+def get_qimage_format(qimage: QImage, channels: int|None=None) -> QImage.Format:
+	''' Returns the format in QIMAGE_FORMATS that a QImage can be converted to without losing precision. Alpha is dropped if fewer than 4 channels are needed. '''
+	format = qimage.format()
+	if format in QIMAGE_FORMATS: return format
+
+	if qimage.pixelFormat().typeInterpretation() == QPixelFormat.TypeInterpretation.FloatingPoint:
+		return QImage.Format.Format_RGBA32FPx4 if qimage.depth() > 64 else QImage.Format.Format_RGBA16FPx4
+	if qimage.depth() > 32:
+		return QImage.Format.Format_RGBA64
+
+	alpha = qimage.hasAlphaChannel() and (channels == None or channels >= 4)
+	return QImage.Format.Format_RGBA8888 if alpha else QImage.Format.Format_RGB888
+
+QIMAGE_U8_FORMATS: dict[int, QImage.Format] = {
+	1: QImage.Format.Format_Grayscale8,
+	3: QImage.Format.Format_RGB888,
+	4: QImage.Format.Format_RGBA8888,
+}
+''' The uint8 QImage format of each channel count. '''
+
+class QImageBuffer():
+	'''
+	Exposes the pixels of a QImage to numpy without copying them. Arrays made from it (with np.asarray)
+	keep it, and so the QImage, alive for as long as they exist. Rows are padded to 4 bytes by Qt,
+	so the arrays are strided by bytesPerLine, and are only C-contiguous if the rows have no padding.
+	'''
+
+	qimage: QImage
+	__array_interface__: dict
+
+	def __init__(self, qimage: QImage) -> None:
+		dtype, count = QIMAGE_FORMATS[qimage.format()]
+		itemSize = np.dtype(dtype).itemsize
+
+		# bits() only copies the pixels if the QImage shares them, which would make them unsafe to write to.
+		ptr = qimage.bits()
+		assert ptr != None, 'Failed to get QImage data handle. This might mean that the file could not be accessed!'
+
+		self.qimage = qimage
+		self.__array_interface__ = {
+			'version': 3,
+			'shape': (qimage.height(), qimage.width(), count),
+			'typestr': np.dtype(dtype).str,
+			'strides': (qimage.bytesPerLine(), count * itemSize, itemSize),
+			'data': (np.frombuffer(ptr, np.uint8).ctypes.data, False),
+		}
+
+	def is_viewed_by(self, data: np.ndarray) -> bool:
+		''' Returns true if data is a view of every pixel of this buffer, as returned by qimage_to_array. '''
+		interface = self.__array_interface__
+		return (data.shape, data.dtype.str, data.strides, data.ctypes.data) == (interface['shape'], interface['typestr'], interface['strides'], interface['data'][0])
+
+def qimage_to_array(qimage: QImage, channels: int|None=None) -> np.ndarray:
+	'''
+	Returns a (height, width, channels) view of a QImage's pixels at the precision they were decoded at. (See QImageBuffer)
+	QImages in other formats are converted first, to a format without alpha if fewer than 4 channels are needed.
+	'''
+	format = get_qimage_format(qimage, channels)
+	if format != qimage.format():
+		qimage = qimage.convertToFormat(format)
+	return np.asarray(QImageBuffer(qimage))
+
+def array_to_qimage(data: np.ndarray) -> QImage:
+	'''
+	Returns a QImage of a (height, width, channels) uint8 array. Arrays of a QImage (See qimage_to_array) return
+	that QImage, and other C-contiguous arrays are wrapped without being copied. The QImage keeps the array alive.
+	'''
+	assert data.dtype == np.uint8, f'Expected uint8 pixels, but got {data.dtype}!'
+	height, width, count = data.shape
+	if count not in QIMAGE_U8_FORMATS:
+		raise Exception(f'Cannot convert Image to QImage with {count} channels!')
+
+	if isinstance(data.base, QImageBuffer) and data.base.is_viewed_by(data):
+		return data.base.qimage
+
+	# Qt may copy bytesPerLine * height bytes at once, so rows padded by anything but a QImage are packed first.
+	data = np.ascontiguousarray(data)
+	qimage = QImage(data, width, height, width * count, QIMAGE_U8_FORMATS[count])
 	if qimage.isNull():
 		raise Exception(f'QImage is null: Failed to convert the data to an acceptable format? Report this issue!')
 
 	return qimage
 
-def qimage_to_image(qimage: QImage) -> Image:
-	''' Converts a Qt QImage to an Image. (U8/F16x4) '''
-	channels: int
-	dtype = np.uint8
-	match qimage.format():
-		case QImage.Format.Format_Grayscale8: channels = 1
-		case QImage.Format.Format_RGB888: channels = 3
-		case QImage.Format.Format_RGBA8888: channels = 4
-		case _:
-			channels = 4
-			dtype = np.float16
-			qimage = qimage.convertToFormat(QImage.Format.Format_RGBA16FPx4)
-
-	ptr = qimage.constBits()
-	assert ptr != None, 'Failed to get QImage data handle. This might mean that the file could not be accessed!'
-
-	data = np.frombuffer(ptr, dtype=dtype).copy().reshape(qimage.height(), qimage.width(), channels)
+def image_to_qimage(image: Image) -> QImage:
+	''' Converts an Image to a Qt QImage. (U8) The pixels of interleaved uint8 images are shared, not copied. (See array_to_qimage) '''
+	width, height = image.size
+	if image.dtype != np.uint8:
+		data = image.convert(np.uint8, out=np.empty((height, width, image.channels), np.uint8)).data
+	elif image.is_planar:
+		data = image.interleave()
+	else:
+		data = image.data
+	return array_to_qimage(data)
+
+def qimage_to_image(qimage: QImage, channels: int|None=None) -> Image:
+	''' Converts a Qt QImage to an Image at the precision it was decoded at, keeping only the first channels if specified. The pixels are shared, not copied. '''
+	data = qimage_to_array(qimage, channels)
+	if channels and channels < data.shape[2]:
+		# Copy the channels that are kept, so the rest are freed along with the QImage.
+		data = data[..., :channels].copy()
 	return Image(data)
 
-SPP_SUPPORTED = ('vtf', 'hdr', 'exr')
-''' A list of file extensions that sourcepp should handle instead of Qt. '''
-
 class QtIOBackend(IOBackend):
 	@staticmethod
-	def load_qimage(path: str | Path) -> QImage:
-		im = QImage()
-		assert im.load(str(path)), 'Failed to load image!'
+	def load_qimage(path: str | Path, size: tuple[int, int]|None=None) -> QImage:
+		'''
+		Loads a QImage. If size is smaller, JPEGs are decoded at their nearest DCT scale that is at least that size
+		(See get_nearest_dct_size), and the rest of the resize is left for Image.resize, like every other format.
+		'''
+		reader = QImageReader(str(path))
+		source = reader.size()
+		if size and source.isValid() and reader.format() in DCT_SCALED_FORMATS:
+			scaled = get_nearest_dct_size((source.width(), source.height()), size)
+			if is_downscale((source.width(), source.height()), scaled): reader.setScaledSize(QSize(*scaled))
+
+		im = reader.read()
+		assert not im.isNull(), 'Failed to load image!'
 		return im
 
 	@staticmethod
-	def load(path: str|Path) -> Image:
+	def load(path: str|Path, size: tuple[int, int]|None=None, channels: int|None=None) -> Image:
 		kind = get_path_suffix(path)
 
 		if kind not in SPP_SUPPORTED:
-			return qimage_to_image(QtIOBackend.load_qimage(path))
+			return qimage_to_image(QtIOBackend.load_qimage(path, size), channels)
 
 		with open(path, 'rb') as file:
-			return load_sourcepp(file, kind)
+			return load_sourcepp(file, kind, size, channels)
 
 	@staticmethod
-	def save(image: Image, path: str | Path, version=4, lossy=True, zip=False, flags=0, mipmaps=-1, mipmapFilter=vtfpp.ImageConversion.ResizeFilter.DEFAULT, **kwargs) -> bool:
-		height, width, bands = image.data.shape
+	def read_size(path: str|Path) -> tuple[int, int]|None:
+		if get_path_suffix(path) in SPP_SUPPORTED: return read_vtf_size(path)
 
+		size = QImageReader(str(path)).size()
+		return (size.width(), size.height()) if size.isValid() else None
+
+	@staticmethod
+	def save(image: Image, path: str | Path, version=4, lossy=True, zip=False, flags=0, mipmaps=-1, mipmapFilter=vtfpp.ImageConversion.ResizeFilter.DEFAULT, tilePool: Executor|None=None, tileRows=0, mips: list[Image]|None=None, draft=False, **kwargs) -> bool:
 		path = str(path)
 		if get_path_suffix(path) not in SPP_SUPPORTED:
 			return image_to_qimage(image).save(path)
 
-		format = None
-		target_format = None
-		is_strata = version == 6
-
-		match (bands, image.data.dtype):
-			case (1, 'uint8'):
-				format = ImageFormats.I8
-			case (3, 'uint8'):
-				format = ImageFormats.RGB888
-				if lossy: target_format = ImageFormats.DXT1
-				elif is_strata: target_format = ImageFormats.RGBA8888 # TODO: Expand this to any DX11 game
-			case (4, 'uint8'):
-				format = ImageFormats.RGBA8888
-				if lossy: target_format = ImageFormats.BC7 if is_strata else ImageFormats.DXT5
-				flags |= vtfpp.VTF.Flags.V0_MULTI_BIT_ALPHA.value
-			case (4, 'float16'):
-				format = ImageFormats.RGBA16161616F
-				if lossy and is_strata: target_format = ImageFormats.BC6H
-				flags |= vtfpp.VTF.Flags.V0_MULTI_BIT_ALPHA.value
-
-		if format == None:
-			raise TypeError(f"Could not match format {image.data.dtype}x{bands}!")
-
-		if target_format == None:
-			target_format = format
-
-		vtf = vtfpp.VTF()
-		vtf.set_image(image.data.tobytes('C'), format, width, height, mipmapFilter)
-		vtf.version = version
-		vtf.flags = flags
-
-		if mipmaps != -1:	vtf.mip_count = mipmaps
-		else:				vtf.set_recommended_mip_count()
-
-		vtf.compute_mips(mipmapFilter)
-		vtf.set_format(target_format, quality=1)
-
-		if is_strata and zip:
-			vtf.compression_level = -1
-
-		with open(path, 'wb') as file:
-			data = vtf.bake()
-			file.write(data)
-
-		return True
-	
-	@staticmethod
-	def resize(image: Image, dims: tuple[int, int]) -> Image:
-		# TODO: This causes segfaults sometimes. WTF?
-		# TODO: Verify fixes. AGAIN.
-		qimage = image_to_qimage(image)
-		scaled = qimage.scaled(dims[0], dims[1], Qt.AspectRatioMode.IgnoreAspectRatio)
-		return qimage_to_image(scaled)
+		return save_vtf(image, path, version=version, lossy=lossy, zip=zip, flags=flags, mipmaps=mipmaps, mipmapFilter=mipmapFilter, tilePool=tilePool, tileRows=tileRows, mips=mips, draft=draft)
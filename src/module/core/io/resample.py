@@ -0,0 +1,183 @@
+from enum import IntEnum
+from functools import lru_cache
+from math import ceil
+from typing import Callable, Sequence
+import numpy as np
+
+'''
+Separable resampling in float32. Each output pixel is a weighted sum of the input pixels under
+a filter kernel, which is stretched by the scale factor when downscaling so that every input
+pixel contributes. The weights of each axis are computed once, as (taps, outputs) tables of
+indices and weights, and applied one tap at a time, so the work is vectorized over whole rows.
+
+Axes that are shrunk by an integer factor, which is most of them since textures are powers of two,
+have the same weights for every output pixel. They are resampled with strided slices of a window
+of the input instead, which avoids gathering every tap.
+
+Images are resampled as lists of planes. Planes of the same size share their weights, and are
+resized by a single call, which is how every single-channel role of a material is resized.
+'''
+
+RESAMPLE_BAND_PIXELS = 1 << 16
+''' The approximate number of output pixels resampled at a time, which bounds the size of the temporaries. '''
+
+class ResampleFilter(IntEnum):
+	Box = 0
+	Bilinear = 1
+	Kaiser = 2
+	Lanczos = 3
+
+KAISER_BETA = 4.0
+''' The shape of the Kaiser window. Higher values trade sharpness for less ringing. '''
+
+def box(x: np.ndarray) -> np.ndarray:
+	return ((x >= -0.5) & (x < 0.5)).astype(np.float64)
+
+def triangle(x: np.ndarray) -> np.ndarray:
+	return np.maximum(0.0, 1.0 - np.abs(x))
+
+def kaiser(x: np.ndarray) -> np.ndarray:
+	''' A sinc windowed by a Kaiser window of radius 3. '''
+	t = np.clip(1.0 - (x / 3) ** 2, 0.0, None)
+	return np.where(np.abs(x) < 3, np.sinc(x) * np.i0(KAISER_BETA * np.sqrt(t)) / np.i0(KAISER_BETA), 0.0)
+
+def lanczos(x: np.ndarray) -> np.ndarray:
+	''' A sinc windowed by a sinc of radius 3. '''
+	return np.where(np.abs(x) < 3, np.sinc(x) * np.sinc(x / 3), 0.0)
+
+FILTERS: dict[ResampleFilter, tuple[Callable[[np.ndarray], np.ndarray], float]] = {
+	ResampleFilter.Box:			(box,		0.5),
+	ResampleFilter.Bilinear:	(triangle,	1.0),
+	ResampleFilter.Kaiser:		(kaiser,	3.0),
+	ResampleFilter.Lanczos:		(lanczos,	3.0),
+}
+''' The kernel of each filter, and the radius outside of which it is zero. '''
+
+WEIGHT_EPSILON = 1e-6
+''' Taps with smaller weights are dropped. Sinc kernels are only nearly zero at integer offsets. '''
+
+@lru_cache(maxsize=32)
+def get_strided_taps(factor: int, filter: ResampleFilter) -> tuple[np.ndarray, np.ndarray]:
+	''' Returns the offsets from factor * output, and the float32 weights, of the taps of an axis that is shrunk by an integer factor. '''
+	kernel, radius = FILTERS[filter]
+	support = radius * factor
+
+	offsets = np.floor(factor / 2 - support + 0.5) + np.arange(int(ceil(support)) * 2 + 1)
+	weights = kernel((offsets + 0.5 - factor / 2) / factor)
+
+	used = np.abs(weights) > WEIGHT_EPSILON
+	offsets, weights = offsets[used], weights[used]
+	return (offsets.astype(np.intp), (weights / weights.sum()).astype(np.float32))
+
+def get_factor(inSize: int, outSize: int) -> int:
+	''' Returns the integer factor an axis is shrunk by, or 0 if it isn't. '''
+	return inSize // outSize if inSize % outSize == 0 else 0
+
+def get_window(factor: int, offsets: np.ndarray, start: int, count: int, size: int) -> np.ndarray:
+	''' Returns the (clamped) input indices covered by the taps of count outputs, from start. '''
+	return np.clip(np.arange(factor * start + offsets[0], factor * (start + count - 1) + offsets[-1] + 1), 0, size - 1)
+
+@lru_cache(maxsize=32)
+def get_weights(inSize: int, outSize: int, filter: ResampleFilter) -> tuple[np.ndarray, np.ndarray]:
+	''' Returns the (taps, outSize) input indices and float32 weights of each output pixel along an axis. Edges are clamped. '''
+	kernel, radius = FILTERS[filter]
+	scale = inSize / outSize
+	stretch = max(scale, 1.0)
+	support = radius * stretch
+
+	centers = (np.arange(outSize) + 0.5) * scale
+	first = np.floor(centers - support + 0.5)
+	indices = first[:, None] + np.arange(int(ceil(support)) * 2 + 1)
+	weights = kernel((indices + 0.5 - centers[:, None]) / stretch)
+
+	# Drop the taps that are outside of the kernel for every output pixel.
+	used = np.any(np.abs(weights) > WEIGHT_EPSILON, axis=0)
+	indices, weights = indices[:, used], weights[:, used]
+	weights /= weights.sum(axis=1, keepdims=True)
+
+	indices = np.clip(indices, 0, inSize - 1).astype(np.intp)
+	return (np.ascontiguousarray(indices.T), np.ascontiguousarray(weights.T, dtype=np.float32))
+
+def resample_rows(plane: np.ndarray, outWidth: int, filter: ResampleFilter, out: np.ndarray):
+	''' Resamples the rows of a (height, width) array of any dtype into a (height, outWidth) float32 array. '''
+	height, width = plane.shape
+	rows = max(1, RESAMPLE_BAND_PIXELS // max(width, outWidth))
+	tap = np.empty((rows, outWidth), np.float32)
+
+	factor = get_factor(width, outWidth)
+	if factor:
+		offsets, taps = get_strided_taps(factor, filter)
+		columns = get_window(factor, offsets, 0, outWidth, width)
+		for y in range(0, height, rows):
+			window = np.take(plane[y : y + rows], columns, axis=1).astype(np.float32, copy=False)
+			dst = out[y : y + rows]
+			tmp = tap[:len(window)]
+
+			for k in range(len(offsets)):
+				source = window[:, offsets[k] - offsets[0] :: factor][:, :outWidth]
+				if k == 0:	np.multiply(source, taps[k], out=dst)
+				else:		np.multiply(source, taps[k], out=tmp); dst += tmp
+		return
+
+	indices, weights = get_weights(width, outWidth, filter)
+	for y in range(0, height, rows):
+		band = plane[y : y + rows].astype(np.float32)
+		dst = out[y : y + rows]
+		tmp = tap[:len(band)]
+
+		np.take(band, indices[0], axis=1, out=dst, mode='clip')
+		dst *= weights[0]
+		for k in range(1, len(indices)):
+			np.take(band, indices[k], axis=1, out=tmp, mode='clip')
+			tmp *= weights[k]
+			dst += tmp
+
+def resample_columns(planes: np.ndarray, outHeight: int, filter: ResampleFilter) -> np.ndarray:
+	''' Resamples the columns of a (count, height, width) float32 array, returning a (count, outHeight, width) array. '''
+	count, height, width = planes.shape
+	out = np.empty((count, outHeight, width), np.float32)
+	rows = max(1, RESAMPLE_BAND_PIXELS // (width * count))
+	tap = np.empty((count, rows, width), np.float32)
+
+	factor = get_factor(height, outHeight)
+	if factor:
+		offsets, taps = get_strided_taps(factor, filter)
+		for y in range(0, outHeight, rows):
+			dst = out[:, y : y + rows]
+			tmp = tap[:, :dst.shape[1]]
+			window = np.take(planes, get_window(factor, offsets, y, dst.shape[1], height), axis=1)
+
+			for k in range(len(offsets)):
+				source = window[:, offsets[k] - offsets[0] :: factor][:, :dst.shape[1]]
+				if k == 0:	np.multiply(source, taps[k], out=dst)
+				else:		np.multiply(source, taps[k], out=tmp); dst += tmp
+		return out
+
+	indices, weights = get_weights(height, outHeight, filter)
+	for y in range(0, outHeight, rows):
+		dst = out[:, y : y + rows]
+		tmp = tap[:, :dst.shape[1]]
+
+		np.take(planes, indices[0, y : y + rows], axis=1, out=dst, mode='clip')
+		dst *= weights[0, y : y + rows, None]
+		for k in range(1, len(indices)):
+			np.take(planes, indices[k, y : y + rows], axis=1, out=tmp, mode='clip')
+			tmp *= weights[k, y : y + rows, None]
+			dst += tmp
+
+	return out
+
+def resample_planes(planes: Sequence[np.ndarray], size: tuple[int, int], filter: ResampleFilter) -> np.ndarray:
+	'''
+	Resamples (height, width) arrays of the same size to size, returning a (count, height, width) float32 array.
+	Values keep the scale of their dtype, and negative lobes of the filter may overshoot the range of the inputs.
+	'''
+	width, height = size
+	count = len(planes)
+	srcHeight = planes[0].shape[0]
+
+	rows = np.empty((count, srcHeight, width), np.float32)
+	for i, plane in enumerate(planes):
+		resample_rows(plane, width, filter, rows[i])
+
+	return resample_columns(rows, height, filter)
@@ -0,0 +1,344 @@
+from pathlib import Path
+
+from .image import Image, IOBackend
+
+import numpy as np
+import logging as log
+import os, struct
+from typing import IO, Callable
+from concurrent.futures import Executor, Future
+from sourcepp import vtfpp
+ImageFormats = vtfpp.ImageFormat
+ImageConversion = vtfpp.ImageConversion
+FileFormats = ImageConversion.FileFormat
+ImageFormatDetails = vtfpp.ImageFormatDetails
+
+SPP_SUPPORTED = ('vtf', 'hdr', 'exr')
+''' A list of file extensions that sourcepp should handle instead of Qt. '''
+
+SPP_FORMATS: dict[tuple[str, int], ImageFormats] = {
+	('uint8', 1):	ImageFormats.I8,
+	('uint8', 3):	ImageFormats.RGB888,
+	('uint8', 4):	ImageFormats.RGBA8888,
+	('uint16', 4):	ImageFormats.RGBA16161616,
+	('float16', 1):	ImageFormats.R16F,
+	('float16', 4):	ImageFormats.RGBA16161616F,
+	('float32', 1):	ImageFormats.R32F,
+	('float32', 3):	ImageFormats.RGB323232F,
+	('float32', 4):	ImageFormats.RGBA32323232F,
+}
+''' Maps (dtype, channels) pairs to the equivalent uncompressed sourcepp format. '''
+
+SPP_NATIVE_FORMATS: dict[ImageFormats, tuple[str, int]] = { format: key for key, format in SPP_FORMATS.items() }
+''' Sourcepp formats that can be used as numpy arrays without conversion, and their dtypes and channel counts. '''
+
+SPP_FILE_FORMATS: dict[str, FileFormats] = {
+	'png':	FileFormats.PNG,
+	'jpg':	FileFormats.JPG,
+	'jpeg':	FileFormats.JPG,
+	'bmp':	FileFormats.BMP,
+	'tga':	FileFormats.TGA,
+	'hdr':	FileFormats.HDR,
+	'exr':	FileFormats.EXR,
+}
+
+BLOCK_FORMATS = (ImageFormats.DXT1, ImageFormats.DXT5, ImageFormats.BC7, ImageFormats.BC6H)
+''' Block-compressed formats, which encode each 4x4 block independently and can be compressed in bands. '''
+
+SLOW_BLOCK_FORMATS = (ImageFormats.BC7, ImageFormats.BC6H)
+''' Block-compressed formats that take far longer to compress than to write uncompressed. Drafts skip them. '''
+
+def get_path_suffix(path: str | Path) -> str:
+	split = str(path).rsplit('.', 1)
+	if len(split) > 1: return split[-1]
+	return ''
+
+def get_image_format(image: Image) -> ImageFormats:
+	''' Returns the sourcepp format matching this image's data layout. '''
+	format = SPP_FORMATS.get((image.dtype.name, image.channels))
+	if format == None:
+		raise TypeError(f"Could not match format {image.dtype}x{image.channels}!")
+	return format
+
+def get_nearest_mip(vtf: vtfpp.VTF, size: tuple[int, int]) -> int:
+	''' Returns the smallest mip of a VTF that is at least size, which can be decoded instead of the full image. '''
+	mip = 0
+	while mip + 1 < vtf.mip_count and vtf.width_for_mip(mip + 1) >= size[0] and vtf.height_for_mip(mip + 1) >= size[1]:
+		mip += 1
+	return mip
+
+def get_decoded_format(format: ImageFormats) -> ImageFormats:
+	''' Returns the uncompressed format that images of a format are decoded to without losing precision. '''
+	if format in SPP_NATIVE_FORMATS: return format
+	if ImageFormatDetails.decimal(format): return ImageFormats.RGBA32323232F
+	if ImageFormatDetails.large(format): return ImageFormats.RGBA16161616
+	return ImageFormats.RGBA8888
+
+def load_sourcepp(file: IO[bytes], kind: str, size: tuple[int, int]|None=None, channels: int|None=None):
+	'''
+	Decodes a file with sourcepp. Images are kept at their decoded precision (such as 8 or 16-bit), and only
+	the first channels are kept if specified. If size is specified, VTFs are decoded from their nearest mip that is at least that size.
+	'''
+	raw_data: bytes
+	width: int
+	height: int
+	format: ImageFormats
+
+	if kind == 'vtf':
+		vtf = vtfpp.VTF(file.read())
+		mip = get_nearest_mip(vtf, size) if size else 0
+		raw_data = vtf.get_image_data_raw(mip)
+		format = vtf.format
+		width = vtf.width_for_mip(mip)
+		height = vtf.height_for_mip(mip)
+	else:
+		raw_data, format, width, height, frame_count = ImageConversion.convert_file_to_image_data(file.read())
+
+	decoded = get_decoded_format(format)
+	if decoded != format:
+		raw_data = ImageConversion.convert_image_data_to_format(raw_data, format, decoded, width, height)
+
+	dtype, count = SPP_NATIVE_FORMATS[decoded]
+	data = np.frombuffer(raw_data, dtype=dtype).reshape(height, width, count)
+	if channels and channels < count:
+		data = np.ascontiguousarray(data[..., :channels])
+	return Image(data)
+
+def read_vtf_size(path: str|Path) -> tuple[int, int]|None:
+	''' Returns the size of a VTF file, or None if the path isn't a readable VTF. '''
+	if get_path_suffix(path).lower() != 'vtf': return None
+	try:
+		vtf = vtfpp.VTF(str(path))
+	except Exception:
+		return None
+	return (vtf.width, vtf.height) if vtf else None
+
+def read_png_size(file: IO[bytes]) -> tuple[int, int]|None:
+	header = file.read(24)
+	if len(header) < 24 or header[12:16] != b'IHDR': return None
+	return struct.unpack('>II', header[16:24])
+
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - { 0xC4, 0xC8, 0xCC }
+''' The markers of the frame headers that hold a JPEG's size. The others in the range are tables. '''
+
+def read_jpeg_size(file: IO[bytes]) -> tuple[int, int]|None:
+	''' Skips from segment to segment until the frame header, without reading the metadata (like EXIF) before it. '''
+	file.seek(2)
+	while True:
+		marker = file.read(2)
+		if len(marker) < 2 or marker[0] != 0xFF: return None
+		# Markers may be padded with any number of 0xFF bytes.
+		code = marker[1]
+		while code == 0xFF:
+			byte = file.read(1)
+			if not byte: return None
+			code = byte[0]
+
+		# The image data starts after the scan header, so a frame header can't follow it.
+		if code == 0xDA: return None
+		if code == 0x01 or 0xD0 <= code <= 0xD8: continue
+
+		length = file.read(2)
+		if len(length) < 2: return None
+		if code in JPEG_SOF_MARKERS:
+			frame = file.read(5)
+			if len(frame) < 5: return None
+			height, width = struct.unpack('>xHH', frame)
+			return (width, height) if width and height else None
+		file.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+
+def read_bmp_size(file: IO[bytes]) -> tuple[int, int]|None:
+	header = file.read(26)
+	if len(header) < 26: return None
+	# Old OS/2 bitmaps have 16-bit sizes. Bitmaps stored top-down have a negative height.
+	if struct.unpack('<I', header[14:18])[0] == 12: return struct.unpack('<HH', header[18:22])
+	width, height = struct.unpack('<ii', header[18:26])
+	return (width, abs(height))
+
+def read_tga_size(file: IO[bytes]) -> tuple[int, int]|None:
+	''' TGAs have no signature, so only their image type and depth are checked. '''
+	header = file.read(18)
+	if len(header) < 18 or header[2] not in (1, 2, 3, 9, 10, 11) or header[16] not in (8, 15, 16, 24, 32): return None
+	return struct.unpack('<HH', header[12:16])
+
+HEADER_SIGNATURES: list[tuple[bytes, Callable[[IO[bytes]], tuple[int, int]|None]]] = [
+	(b'\x89PNG\r\n\x1a\n',	read_png_size),
+	(b'\xFF\xD8',				read_jpeg_size),
+	(b'BM',						read_bmp_size),
+]
+''' The signature of each format whose size read_header_size can read, and the function that reads it from the start of the file. '''
+
+def read_header_size(path: str|Path) -> tuple[int, int]|None:
+	'''
+	Returns the size of a PNG, JPEG, BMP, or TGA file from its header, or None if it isn't one or can't be read.
+	Formats are recognized by their signature rather than their extension, except for TGAs, which have none.
+	'''
+	try:
+		with open(path, 'rb') as file:
+			start = file.read(8)
+			for signature, reader in HEADER_SIGNATURES:
+				if start.startswith(signature):
+					file.seek(0)
+					return reader(file)
+
+			if get_path_suffix(path).lower() != 'tga': return None
+			file.seek(0)
+			return read_tga_size(file)
+	except (OSError, struct.error):
+		return None
+
+def compress_band(data: bytes, format: ImageFormats, target_format: ImageFormats, width: int, height: int, quality: float=1) -> bytes:
+	''' Compresses a band of whole block rows. Runs inside the encoding pool. '''
+	# convert_image_data_to_format returns nothing for DXT targets in some sourcepp versions.
+	return ImageConversion.convert_several_image_data_to_format(data, format, target_format, 1, 1, 1, width, height, 1, quality)
+
+def compress_mips_tiled(vtf: vtfpp.VTF, target_format: ImageFormats, pool: Executor, tileRows: int, quality: float=1) -> list[bytes]:
+	'''
+	Compresses every mip of an uncompressed VTF by splitting each level into bands of
+	tileRows rows and compressing the bands across the pool. Since blocks are stored
+	row-major, the compressed bands of a level can simply be concatenated.
+	'''
+	tileRows = max(4, tileRows - tileRows % 4)
+	mipFutures: list[list[Future[bytes]]] = []
+
+	for mip in range(vtf.mip_count):
+		width = vtf.width_for_mip(mip)
+		height = vtf.height_for_mip(mip)
+		data = vtf.get_image_data_raw(mip)
+		rowBytes = len(data) // height
+
+		bands: list[Future[bytes]] = []
+		for y in range(0, height, tileRows):
+			rows = min(tileRows, height - y)
+			band = data[y * rowBytes : (y + rows) * rowBytes]
+			bands.append(pool.submit(compress_band, band, vtf.format, target_format, width, rows, quality))
+		mipFutures.append(bands)
+
+	return [b''.join(band.result() for band in bands) for bands in mipFutures]
+
+def save_vtf(image: Image, path: str | Path, version=4, lossy=True, zip=False, flags=0, mipmaps=-1, mipmapFilter=ImageConversion.ResizeFilter.DEFAULT, tilePool: Executor|None=None, tileRows=0, mips: list[Image]|None=None, draft=False) -> bool:
+	'''
+	Encodes an image as a VTF and writes it to the specified path. If a tilePool is specified,
+	block-compressed formats are compressed in bands of tileRows rows across the pool. If mips
+	are specified, they are used as mips 1 and onwards instead of being computed from the image.
+	Drafts are compressed at the lowest quality, and slow block formats are written uncompressed.
+	'''
+	width, height = image.size
+	bands = image.channels
+
+	format = None
+	target_format = None
+	is_strata = version == 6
+
+	match (bands, image.dtype):
+		case (1, 'uint8'):
+			format = ImageFormats.I8
+		case (3, 'uint8'):
+			format = ImageFormats.RGB888
+			if lossy: target_format = ImageFormats.DXT1
+			elif is_strata: target_format = ImageFormats.RGBA8888 # TODO: Expand this to any DX11 game
+		case (4, 'uint8'):
+			format = ImageFormats.RGBA8888
+			if lossy: target_format = ImageFormats.BC7 if is_strata else ImageFormats.DXT5
+			flags |= vtfpp.VTF.Flags.V0_MULTI_BIT_ALPHA.value
+		case (4, 'float16'):
+			format = ImageFormats.RGBA16161616F
+			if lossy and is_strata: target_format = ImageFormats.BC6H
+			flags |= vtfpp.VTF.Flags.V0_MULTI_BIT_ALPHA.value
+
+	if format == None:
+		raise TypeError(f"Could not match format {image.dtype}x{bands}!")
+
+	if target_format == None or (draft and target_format in SLOW_BLOCK_FORMATS):
+		target_format = format
+	quality = 0 if draft else 1
+
+	# Planar images are interleaved here, straight into the buffer handed to sourcepp.
+	vtf = vtfpp.VTF()
+	if not vtf.set_image(image.tobytes(image.dtype), format, width, height, mipmapFilter):
+		raise ValueError(f'Failed to set the image of {path}!')
+	vtf.version = version
+	vtf.flags = flags
+
+	# Mips are only set if every level is accepted. Otherwise, they are computed as if none were passed.
+	# sourcepp accepts levels of the wrong size, so their sizes are checked here.
+	sized = all(level.size == (vtf.width_for_mip(mip), vtf.height_for_mip(mip)) for mip, level in enumerate(mips or [], 1))
+	if mips and not (sized and set_mips(vtf, [level.tobytes(image.dtype) for level in mips], format, mipmapFilter)):
+		log.warning(f'Failed to set the mips of {path}, so they will be computed by the encoder instead.')
+		mips = None
+
+	if not mips:
+		if mipmaps != -1:	vtf.mip_count = mipmaps
+		else:				vtf.set_recommended_mip_count()
+
+		# Computing mips for a single-mip VTF gives it a full chain.
+		if vtf.mip_count > 1: vtf.compute_mips(mipmapFilter)
+
+	tiled: vtfpp.VTF|None = None
+	if tilePool and tileRows > 0 and target_format in BLOCK_FORMATS:
+		compressed = compress_mips_tiled(vtf, target_format, tilePool, tileRows, quality)
+
+		# Rebuild the VTF around the compressed mips
+		tiled = vtfpp.VTF()
+		if tiled.set_image(compressed[0], target_format, width, height, mipmapFilter) and set_mips(tiled, compressed[1:], target_format, mipmapFilter):
+			tiled.version = version
+			tiled.flags = flags
+		else:
+			log.warning(f'Failed to set the compressed mips of {path}, so it will be compressed whole instead.')
+			tiled = None
+
+	if tiled != None:	vtf = tiled
+	else:				vtf.set_format(target_format, quality=quality)
+
+	if is_strata and zip:
+		vtf.compression_level = -1
+
+	with open(path, 'wb') as file:
+		data = vtf.bake()
+		file.write(data)
+
+	return True
+
+def set_mips(vtf: vtfpp.VTF, levels: list[bytes], format: ImageFormats, mipmapFilter: ImageConversion.ResizeFilter) -> bool:
+	''' Gives a VTF the specified mips, from mip 1 onwards. Returns false if sourcepp rejects any of them, leaving the mips incomplete. '''
+	vtf.mip_count = len(levels) + 1
+	for mip, level in enumerate(levels, 1):
+		if not vtf.set_image(level, format, vtf.width_for_mip(mip), vtf.height_for_mip(mip), mipmapFilter, mip=mip): return False
+	return True
+
+class SourceppIOBackend(IOBackend):
+	'''
+	An I/O backend that decodes and encodes images with sourcepp alone.
+	It never imports Qt, so it is cheap to start and safe to use from worker threads and processes.
+	'''
+
+	@staticmethod
+	def load(path: str|Path, size: tuple[int, int]|None=None, channels: int|None=None) -> Image:
+		with open(path, 'rb') as file:
+			return load_sourcepp(file, get_path_suffix(path).lower(), size, channels)
+
+	@staticmethod
+	def read_size(path: str|Path) -> tuple[int, int]|None:
+		''' Reads the size of VTFs, PNGs, JPEGs, BMPs, and TGAs. (See read_header_size) HDRs and EXRs aren't read without decoding them. '''
+		if get_path_suffix(path).lower() == 'vtf': return read_vtf_size(path)
+		return read_header_size(path)
+
+	@staticmethod
+	def save(image: Image, path: str | Path, **kwargs) -> bool:
+		kind = get_path_suffix(path).lower()
+		if kind == 'vtf':
+			return save_vtf(image, path, **kwargs)
+
+		# Only HDR formats can store float data.
+		if kind not in ('hdr', 'exr'):
+			if image.dtype != np.uint8: image = image.convert(np.uint8, clip=True)
+		elif image.dtype != np.float32:
+			image = image.convert(np.float32)
+
+		width, height = image.size
+		data = ImageConversion.convert_image_data_to_file(image.tobytes(image.dtype), get_image_format(image), width, height, SPP_FILE_FORMATS.get(kind, FileFormats.DEFAULT))
+		if not data: return False
+
+		with open(path, 'wb') as file:
+			file.write(data)
+		return True
@@ -0,0 +1,87 @@
+from .material import Material, ImageRole
+from .config import AppConfig, TargetRole
+from .io.cache import get_file_hash
+from ..version import __version__
+
+from pathlib import Path
+import logging as log
+import hashlib, json, os
+
+'''
+Incremental exports. Every output texture is fingerprinted from the content hashes of the
+source images it is derived from (see Material.get_outputs) and every setting that affects
+it. The fingerprints of the last export are kept in a manifest beside the VMT, and outputs
+whose fingerprint hasn't changed since are neither processed, encoded, nor rewritten.
+'''
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.manifest.json'
+
+DRAFT_SUFFIX = ':draft'
+''' Appended to the fingerprints of draft textures, which are only up-to-date for other drafts. '''
+
+def get_manifest_path(folder: Path, materialName: str) -> Path:
+	return folder / (materialName + MANIFEST_SUFFIX)
+
+def get_source_hashes(paths: dict[ImageRole, str|Path|None]) -> dict[ImageRole, str]:
+	''' Hashes the source file of each role, or '' for roles without one. Roles whose files can't be read are left out. '''
+	hashes: dict[ImageRole, str] = {}
+	for role in ImageRole:
+		path = paths.get(role)
+		if path == None:
+			hashes[role] = ''
+			continue
+		try:
+			hashes[role] = get_file_hash(path)
+		except OSError:
+			log.warning(f'Could not hash {path}, so its outputs will always be exported.')
+	return hashes
+
+def get_fingerprints(material: Material, appConfig: AppConfig) -> dict[TargetRole, str|None]:
+	''' Fingerprints each output of a material. Outputs derived from a role without a known hash have no fingerprint. '''
+	fingerprints: dict[TargetRole, str|None] = {}
+
+	for role, inputs in material.get_outputs().items():
+		if any(x not in material.sources for x in inputs):
+			fingerprints[role] = None
+			continue
+
+		# The size already accounts for the scale target.
+		state = {
+			'manifest': MANIFEST_VERSION,
+			'version': __version__,
+			'role': role.value,
+			'mode': int(material.mode),
+			'game': int(material.target),
+			'normalType': int(material.normalType),
+			'size': material.size,
+			'target': appConfig.targets[role].encode(),
+			'precision': (appConfig.fusedExport, appConfig.integerPath, appConfig.halfPrecision),
+			'sharedMips': appConfig.sharedMips,
+			'resizeFilter': int(appConfig.resizeFilter),
+			'inputs': { x.value: material.sources[x] for x in inputs },
+		}
+		fingerprints[role] = hashlib.blake2b(json.dumps(state, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+	return fingerprints
+
+def is_up_to_date(previous: str|None, fingerprint: str|None, draft: bool=False) -> bool:
+	''' True if a texture written with the previous fingerprint doesn't need to be written again. '''
+	if previous == None or fingerprint == None: return False
+	return previous == fingerprint or (draft and previous == fingerprint + DRAFT_SUFFIX)
+
+def read_manifest(path: Path) -> dict[TargetRole, str]:
+	''' Reads the fingerprints from the last export, or nothing if they can't be read. '''
+	try:
+		with open(path, 'r') as file:
+			data = json.load(file)
+		if data.get('version') != MANIFEST_VERSION: return {}
+		return { TargetRole(k): v for k, v in data['outputs'].items() }
+	except (OSError, ValueError, KeyError, TypeError, AttributeError):
+		return {}
+
+def write_manifest(path: Path, fingerprints: dict[TargetRole, str]):
+	temp = path.with_name(path.name + '.tmp')
+	with open(temp, 'w') as file:
+		json.dump({ 'version': MANIFEST_VERSION, 'outputs': { k.value: v for k, v in fingerprints.items() } }, file, indent='\t')
+	os.replace(temp, path)
@@ -1,6 +1,16 @@
 from .io.image import Image
 from .config import TargetRole
-from enum import IntEnum
+from enum import IntEnum, StrEnum
+import numpy as np
+
+class ImageRole(StrEnum):
+	Albedo = 'albedo'
+	Roughness = 'roughness'
+	Metallic = 'metallic'
+	Emit = 'emit'
+	AO = 'ao'
+	Normal = 'normal'
+	Height = 'height'
 
 class MaterialMode(IntEnum):
 	PBRModel			= 0		# PBR: PBR model mode
@@ -72,11 +82,55 @@ class NormalType(IntEnum):
 	GL = 0
 	DX = 1
 
+def swaps_phong_envmap(mode: MaterialMode, target: GameTarget) -> bool:
+	''' See Material.swap_phong_envmap. '''
+	return target == GameTarget.VGMOD and mode == MaterialMode.PhongEnvmap
+
+def get_output_dependencies(mode: MaterialMode, swap: bool, height: bool, emit: bool) -> dict[TargetRole, tuple[ImageRole, ...]]:
+	'''
+	Returns the textures that export() generates in the specified mode, and the roles each one is derived from.
+	swap is Material.swap_phong_envmap(), and height and emit are whether the material has those roles.
+	This mirrors the branches in texops, which fused.export_fused mirrors in turn.
+	'''
+	pbr = MaterialMode.is_pbr(mode)
+
+	phongMask = (ImageRole.Roughness, ImageRole.AO)
+	envmapMask = (ImageRole.Roughness, ImageRole.Metallic, ImageRole.AO)
+
+	# The basetexture is darkened by every mask input, so its alpha never adds any.
+	basecolor = (ImageRole.Albedo,) if pbr else (ImageRole.Albedo, ImageRole.Roughness, ImageRole.Metallic, ImageRole.AO)
+
+	bumpmap: tuple[ImageRole, ...] = (ImageRole.Normal,)
+	if pbr:
+		if height: bumpmap += (ImageRole.Height,)
+	elif swap:
+		if MaterialMode.embed_envmap(mode): bumpmap += envmapMask
+	elif MaterialMode.has_phong(mode):
+		bumpmap += phongMask
+
+	outputs = { TargetRole.Basecolor: basecolor, TargetRole.Bumpmap: bumpmap }
+	if (MaterialMode.has_selfillum(mode) or pbr) and emit:
+		outputs[TargetRole.Emit] = (ImageRole.Emit,)
+	if pbr:
+		outputs[TargetRole.Mrao] = (ImageRole.Metallic, ImageRole.Roughness, ImageRole.AO)
+	else:
+		if MaterialMode.has_phong(mode):
+			outputs[TargetRole.PhongExp] = (ImageRole.Roughness,)
+		if MaterialMode.has_envmap(mode) and not MaterialMode.embed_envmap(mode):
+			outputs[TargetRole.EnvmapMask] = envmapMask
+	return outputs
+
+def get_affected_outputs(outputs: dict[TargetRole, tuple[ImageRole, ...]], roles: set[ImageRole]) -> set[TargetRole]:
+	''' Returns the outputs (from get_output_dependencies) that are derived from any of the specified roles. '''
+	return { output for output, inputs in outputs.items() if any(x in roles for x in inputs) }
+
 class Material:
 	mode: MaterialMode
 	target: GameTarget
 	size: tuple[int, int]
 	name: str|None = None
+	tiled: bool = False		# If true, images are kept at their loaded precision. (See is_float32)
+	sources: dict['ImageRole', str]	# Content hashes of each role's source file, or '' for roles without one. (See manifest)
 
 	albedo: Image			# Linear RGBAf
 	roughness: Image		# Linear f
@@ -102,7 +156,9 @@ class Material:
 
 			normal: Image,
 			height: Image|None,
-			normalType: NormalType=NormalType.DX):
+			normalType: NormalType=NormalType.DX,
+			tiled: bool=False,
+			sources: dict[ImageRole, str]|None=None):
 
 		self.mode = mode
 		self.target = target
@@ -117,15 +173,28 @@ class Material:
 		self.normal = normal
 		self.normalType = normalType
 		self.height = height
+		self.tiled = tiled
+		self.sources = sources or {}
 	
+	def is_float32(self) -> bool:
+		''' True if every image is float32, which the texops functions expect. Other materials can only be exported by export_fused(). '''
+		images = (self.albedo, self.roughness, self.metallic, self.emit, self.ao, self.normal, self.height)
+		return all(x.dtype == np.float32 for x in images if x != None)
+
 	def swap_phong_envmap(self):
 		''' If true, phong mask uses basetexture alpha, and envmap mask uses normal map alpha. '''
-		return self.target == GameTarget.VGMOD and self.mode == MaterialMode.PhongEnvmap
+		return swaps_phong_envmap(self.mode, self.target)
+
+	def get_outputs(self) -> dict[TargetRole, tuple[ImageRole, ...]]:
+		''' Returns the textures that export() generates for this material, and the roles each one is derived from. '''
+		return get_output_dependencies(self.mode, self.swap_phong_envmap(), self.height != None, self.emit != None)
 
 class Texture():
 	image: Image
 	role: TargetRole
+	mips: list[Image]	# Mips 1 and onwards, if they were generated with the texture. Otherwise, the encoder computes them. (See mips)
 
-	def __init__(self, image: Image, role: TargetRole) -> None:
+	def __init__(self, image: Image, role: TargetRole, mips: list[Image]|None=None) -> None:
 		self.image = image
 		self.role = role
+		self.mips = mips or []
@@ -0,0 +1,116 @@
+from .io.image import Image, max_value, is_constant_array
+from .material import Material, Texture
+from .config import TargetRole, get_config
+
+from typing import Callable
+from math import log2
+import logging as log
+import numpy as np
+
+'''
+Shared mip pyramids. Normally the encoder computes each texture's mips by downsampling the
+finished texture. With AppConfig.sharedMips, the material's inputs are box-filtered into a
+pyramid instead, once per role, and every output is evaluated again at each level. The
+levels are a third of the size of the material in total, and are shared by all outputs.
+
+Since outputs like the phong exponent are non-linear in their inputs, evaluating them on
+downsampled inputs gives a closer approximation of the filtered surface than downsampling
+the outputs does.
+'''
+
+MIP_BAND_PIXELS = 1 << 16
+
+ExportFunction = Callable[[Material, set[TargetRole]], list[Texture]]
+
+def get_mip_count(size: tuple[int, int], mipmaps: int) -> int:
+	''' Returns the number of mips a texture of the specified size has, where -1 is the full chain. (See TargetConfig.mipmaps) '''
+	full = int(log2(max(size))) + 1
+	if mipmaps < 0: return full
+	return max(1, min(mipmaps, full))
+
+def downsample_plane(plane: np.ndarray) -> np.ndarray:
+	''' Box-filters a (height, width) array to half its size, as a float32 array in the 0-1 range. '''
+	height, width = plane.shape
+	outHeight, outWidth = max(1, height // 2), max(1, width // 2)
+	fy, fx = height // outHeight, width // outWidth
+	maxValue = max_value(plane.dtype)
+
+	out = np.empty((outHeight, outWidth), np.float32)
+	rows = max(1, MIP_BAND_PIXELS // width)
+	for y in range(0, outHeight, rows):
+		band = plane[y * fy : (y + rows) * fy]
+		dst = out[y : y + rows]
+
+		# Sum the pixels of each box in float32, then divide, so opaque pixels stay exactly 1.
+		taps = [band[dy::fy, dx::fx] for dy in range(fy) for dx in range(fx)]
+		dst[...] = taps[0]
+		for tap in taps[1:]: np.add(dst, tap, out=dst)
+		dst /= len(taps) * maxValue
+	return out
+
+def downsample(image: Image) -> Image:
+	''' Returns a float32 copy of an image at half its size. Constant channels stay constant. '''
+	width, height = image.size
+	size = (max(1, width // 2), max(1, height // 2))
+
+	def plane(channel: int) -> np.ndarray:
+		data = image.plane(channel)
+		if is_constant_array(data):
+			value = np.float32(data[0, 0]) / max_value(data.dtype)
+			return np.broadcast_to(value, (size[1], size[0]))
+		return downsample_plane(data)
+
+	return Image.from_planes(tuple(plane(i) for i in range(image.channels)), owned=True)
+
+def downsample_material(src: Material) -> Material:
+	''' Returns the next level of a material's pyramid. '''
+	def scale(image: Image|None) -> Image|None:
+		return downsample(image) if image else None
+
+	width, height = src.size
+	level = Material(
+		src.mode,
+		src.target,
+		(max(1, width // 2), max(1, height // 2)),
+		albedo=downsample(src.albedo),
+		roughness=downsample(src.roughness),
+		metallic=downsample(src.metallic),
+		emit=scale(src.emit),
+		ao=scale(src.ao),
+		normal=downsample(src.normal),
+		height=scale(src.height),
+		normalType=src.normalType,
+		sources=src.sources
+	)
+	level.name = src.name
+	return level
+
+def make_proxy(src: Material, levels: int) -> Material:
+	''' Returns a copy of a material, box-filtered to 1/2^levels of its size. '''
+	for _ in range(levels): src = downsample_material(src)
+	return src
+
+def export_with_mips(src: Material, roles: set[TargetRole], exporter: ExportFunction) -> list[Texture]:
+	'''
+	Generates the textures for a material with exporter, then evaluates them again at each level
+	of the material's pyramid to fill their mips. Textures whose levels can't be stored in the same
+	format as the texture itself are left for the encoder to compute mips for.
+	'''
+	targets = get_config().targets
+	textures = exporter(src, roles)
+	counts = { texture.role: get_mip_count(src.size, targets[texture.role].mipmaps) for texture in textures }
+	byRole = { texture.role: texture for texture in textures }
+
+	level = src
+	for mip in range(1, max(counts.values(), default=1)):
+		level = downsample_material(level)
+		for texture in exporter(level, { role for role, count in counts.items() if count > mip }):
+			byRole[texture.role].mips.append(texture.image)
+
+	for texture in textures:
+		image = texture.image
+		if any(x.channels != image.channels or x.dtype != image.dtype for x in texture.mips):
+			log.warning(f'The mips of {texture.role.name} changed format, so they will be computed by the encoder instead.')
+			texture.mips = []
+
+	return textures
@@ -1,5 +1,7 @@
 from typing import Literal
-from .io.image import Image
+from numpy.typing import DTypeLike
+from .io.image import Image, BufferPool
+from .io.resample import ResampleFilter
 from .material import Material, MaterialMode, NormalType
 import numpy as np
 
@@ -16,8 +18,11 @@ References:
 	phongmask     = ((1-roughness)^5.4) * 2
 '''
 
-def normalize(img: Image, size: tuple[int, int]|None=None, mode: Literal['L', 'RGB', 'RGBA']|None=None, noAlpha: bool=False):
-	''' Normalizes an input image to function with other operations. '''
+def normalize(img: Image, size: tuple[int, int]|None=None, mode: Literal['L', 'RGB', 'RGBA']|None=None, noAlpha: bool=False, keepDtype: bool=False, dtype: DTypeLike=np.float32, filter: ResampleFilter=ResampleFilter.Lanczos, batch: bool=True):
+	'''
+	Normalizes an input image to function with other operations. The image is resized with filter (see Image.resize_all
+	for batch), and converted to dtype, unless keepDtype is specified. (See Material.tiled)
+	'''
 
 	# All of this code is necessary to ensure that PIL imports work,
 	# but I do not yet know if the same issues apply to imageio.
@@ -35,9 +40,10 @@ def normalize(img: Image, size: tuple[int, int]|None=None, mode: Literal['L', 'R
 	# 	img = img.convert( 'RGB' )
 
 	if size:
-		img = img.resize(size)
+		img = img.resize(size, filter, batch)
 
-	img = img.convert(np.float32)
+	if not keepDtype:
+		img = img.convert(dtype)
 
 	if mode:
 		img = img.normalize(mode)
@@ -46,7 +52,16 @@ def normalize(img: Image, size: tuple[int, int]|None=None, mode: Literal['L', 'R
 
 	return img
 
-def make_phong_exponent(mat: Material) -> Image:
+def copy(img: Image, pool: BufferPool|None=None) -> Image:
+	''' Copies an image, into pooled arrays if a pool is specified. '''
+	return pool.copy(img) if pool else img.copy()
+
+def clip_alpha(mask: Image) -> Image:
+	''' Clips a mask to 1/255 or above in-place, returning it. '''
+	mask.data = mask.data.clip(min=(1 / 255), out=None if mask.is_constant else mask.data)
+	return mask
+
+def make_phong_exponent(mat: Material, pool: BufferPool|None=None) -> Image:
 	''' Generates an RGB phong exponent texture. '''
 
 	# "The Phong exponent texture [...] red channel defines the Phong exponent value and the green for albedo tinting.
@@ -55,7 +70,7 @@ def make_phong_exponent(mat: Material) -> Image:
 	assert mat.roughness != None
 
 	MAX_EXPONENT = 32 # $phongexponentfactor 32
-	exponent_r = mat.roughness.copy().pow(-2).mult(0.8 / MAX_EXPONENT)
+	exponent_r = copy(mat.roughness, pool).pow(-2).mult(0.8 / MAX_EXPONENT)
 	# exponent_g = Image.blank(mat.size, color=(1,))
 	# exponent_b = Image.blank(mat.size, color=(0,))
 	# exponent = Image.merge((exponent_r, exponent_g, exponent_b))
@@ -64,18 +79,19 @@ def make_phong_exponent(mat: Material) -> Image:
 	return exponent_r
 
 
-def make_phong_mask(mat: Material) -> Image:
+def make_phong_mask(mat: Material, pool: BufferPool|None=None) -> Image:
 	''' Generates a L phong mask texture. '''
 
 	assert mat.roughness != None
 
-	mask = mat.roughness.copy().invert().pow(3).mult(1.1)
+	mask = copy(mat.roughness, pool)
+	mask.invert(out=mask.data).pow(3).mult(1.1)
 	if mat.ao: mask.mult(mat.ao)
 
 	return mask
 
 
-def make_envmask(mat: Material) -> Image:
+def make_envmask(mat: Material, pool: BufferPool|None=None) -> Image:
 	''' Creates an envmapmask texture from a material. '''
 
 	assert mat.metallic != None
@@ -84,42 +100,48 @@ def make_envmask(mat: Material) -> Image:
 	# Decrease exponent when no phong is present to account for lack of reflectivity
 	roughness_exp = 5 if MaterialMode.has_phong(mat.mode) else 3
 
-	mask1 = mat.metallic.copy().mult(0.75).add(0.25)
-	mask2 = mat.roughness.copy().invert().pow(roughness_exp)
+	mask1 = copy(mat.metallic, pool).mult(0.75).add(0.25)
+	mask2 = copy(mat.roughness, pool)
+	mask2.invert(out=mask2.data).pow(roughness_exp)
 	if mat.ao: mask2.mult(mat.ao)
 
-	return mask1.mult(mask2)
+	# mask2 always has real pixels, so multiplying into it never has to expand a constant mask1.
+	mask2.mult(mask1)
+	if pool: pool.release(mask1)
+	return mask2
 
 
-def make_basecolor(mat: Material) -> Image:
+def make_basecolor(mat: Material, pool: BufferPool|None=None) -> Image:
 	''' Creates a basetexture from a material. '''
 
 	assert mat.metallic != None
 	assert mat.roughness != None
 	assert mat.albedo != None
 
-	basetexture = mat.albedo.copy()
-
 	# Do nothing when converting to PBR
 	if MaterialMode.is_pbr(mat.mode):
-		if not basetexture.has_transparency():
-			return basetexture.normalize('RGB')
-		return basetexture
+		if not mat.albedo.has_transparency():
+			return mat.albedo.normalize('RGB')
+		return mat.albedo
+
+	basetexture = copy(mat.albedo, pool)
 
 	# The mask used to darken the basecolor
-	mask = mat.roughness.copy().invert()
+	mask = copy(mat.roughness, pool)
+	mask.invert(out=mask.data)
 	mask.mult(mat.metallic)
-	mask.invert()
+	mask.invert(out=mask.data)
 
 	if mat.ao is not None:
 		ao_blend = 0.75
-		ao = mat.ao.copy().mult(ao_blend).add(1 - ao_blend)
+		ao = copy(mat.ao, pool).mult(ao_blend).add(1 - ao_blend)
 		mask.mult(ao)
+		if pool: pool.release(ao)
 
 	# Convert mask to an RGBA image to avoid multiplying the alpha
-	mask_alpha = Image.blank(mask.size, (1,))
-	mask = Image.merge((mask, mask, mask, mask_alpha))
-	basetexture.mult(mask)
+	mask_alpha = Image.constant(mask.size, (1,), mask.dtype)
+	basetexture.mult(Image.merge((mask, mask, mask, mask_alpha)))
+	if pool: pool.release(mask)
 	
 	# Basetexture already contains alpha, don't embed masks
 	if MaterialMode.has_alpha(mat.mode):
@@ -133,41 +155,42 @@ def make_basecolor(mat: Material) -> Image:
 	# Phong mask as basetexture alpha
 	if using_phong and MaterialMode.has_phong(mat.mode):
 		# TODO: See below
-		phongmask = make_phong_mask(mat)
-		phongmask.data = phongmask.data.clip(min=(1 / 255))
+		phongmask = clip_alpha(make_phong_mask(mat, pool))
 		return Image.merge((r, g, b, phongmask))
 
 	# Envmap mask as basetexture alpha
 	elif not using_phong and MaterialMode.embed_envmap(mat.mode):
 		# TODO: This sucks, but srctools has forced my hand. Libsquish needs a flag to account for full-alpha, which we can't give it.
 		# TODO: Verify that this is still an issue with sourcepp bcenc?
-		envmask = make_envmask(mat)
-		envmask.data = envmask.data.clip(min=(1 / 255))
+		envmask = clip_alpha(make_envmask(mat, pool))
 		return Image.merge((r, g, b, envmask))
 
 	# No alpha - remove the channel so we can use DXT1.
 	return Image.merge((r, g, b))
 
 
-def make_bumpmap(mat: Material) -> Image:
+def make_bumpmap(mat: Material, pool: BufferPool|None=None) -> Image:
 	''' Generates a RGB/RGBA bumpmap with embedded phong information when applicable. '''
 
+	# If using PBR, then we don't need to worry about phong.
+	if MaterialMode.is_pbr(mat.mode) and not mat.height: return mat.normal
+
 	(r, g, b) = mat.normal.split()
-	if mat.normalType == NormalType.GL: g.invert()
+	if mat.normalType == NormalType.GL:
+		# g is a view of the material's normal, so it is inverted into a new array.
+		g.invert(out=pool.get((g.size[1], g.size[0], 1), g.dtype) if pool else None)
 
-	# If using PBR, then we don't need to worry about phong.
 	if MaterialMode.is_pbr(mat.mode):
-		if not mat.height: return mat.normal
 		return Image.merge((r, g, b, mat.height))
 
 	# Do we need to embed the envmap mask instead of phong mask?
 	if Material.swap_phong_envmap(mat):
 		if MaterialMode.embed_envmap(mat.mode):
-			envmask = make_envmask(mat)
+			envmask = make_envmask(mat, pool)
 			return Image.merge((r, g, b, envmask))
 	else:
 		if MaterialMode.has_phong(mat.mode):
-			phongmask = make_phong_mask(mat)
+			phongmask = make_phong_mask(mat, pool)
 			return Image.merge((r, g, b, phongmask))
 
 	return Image.merge((r, g, b))
@@ -176,14 +199,14 @@ def make_bumpmap(mat: Material) -> Image:
 def make_mrao(mat: Material) -> Image:
 	''' Generates a RGB MRAO texture. '''
 
-	ao = mat.ao or Image.blank(mat.size, color=(1,))
+	ao = mat.ao or Image.constant(mat.size, color=(1,), dtype=mat.roughness.dtype)
 	return Image.merge((mat.metallic, mat.roughness, ao))
 
 
-def make_emit(mat: Material) -> Image:
+def make_emit(mat: Material, pool: BufferPool|None=None) -> Image:
 	''' Gamma-corrects the emission map if necessary to match Strata PBR. '''
 
 	assert mat.emit != None
 
 	if MaterialMode.is_pbr(mat.mode): return mat.emit
-	return mat.emit.pow(2.2)
+	return copy(mat.emit, pool).pow(2.2)
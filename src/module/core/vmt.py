@@ -1,5 +1,6 @@
 from .material import Material, MaterialMode, GameTarget
 from .config import get_config, TargetRole
+from pathlib import Path
 
 
 '''
@@ -29,6 +30,17 @@ def game_lightscale(game: GameTarget) -> float|None:
 	return None
 
 
+def get_material_name(path: Path) -> str:
+	''' Returns the path used by the game to find a VMT. ex. `models/props/my_prop` '''
+	name = path.name.removesuffix('.vmt')
+	namePath = ''
+	for component in reversed(path.parts[:-1]):
+		if component == 'materials':
+			return namePath + name
+		namePath = component + '/' + namePath
+	return name
+
+
 def make_vmt(mat: Material) -> str:
 	pbr = MaterialMode.is_pbr(mat.mode)
 	shader = MaterialMode.get_shader(mat.mode)
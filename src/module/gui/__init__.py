@@ -1,16 +1,20 @@
 from ..version import __version__
 import logging as log
-from ..core.config import AppConfig, AppTheme, get_res, load_config, AppCache, load_cache, save_cache
-from ..core.material import GameTarget, MaterialMode, NormalType
+from ..core.config import AppConfig, AppTheme, HijackMode, get_res, get_decode_cache_path, load_config, AppCache, load_cache, save_cache
+from ..core.io.cache import setup_decode_cache
+from ..core.material import GameTarget, MaterialMode, NormalType, get_affected_outputs
+from ..core.export import SaveResult
 from ..core.io.icns import ICNS
 from ..core.preset import Preset
 
-from .style import STYLESHEET_TILE_REQUIRED, STYLESHEET, STYLESHEET_MIN
+from .style import STYLESHEET_TILE_REQUIRED, STYLESHEET_TILE_ERROR, STYLESHEET, STYLESHEET_MIN
 from .backend import CoreBackend, ImageRole
+from .worker import ExportWorker, ExportRequest
+from .thumbnails import ThumbnailLoader
 
 from typing import Any
 from sys import platform
-from traceback import format_exc
+from traceback import format_exc, format_exception
 from datetime import datetime
 
 from pathlib import Path
@@ -61,6 +65,8 @@ class PickableImage( QFrame ):
 	role: ImageRole
 	required: bool
 	path: Path|None = None
+	error: str|None = None
+	''' Why the picked file couldn't be loaded, if it couldn't. (See ThumbnailLoader.failed) '''
 	
 	path_box: QLineEdit
 	iconButton: QToolButton
@@ -114,9 +120,14 @@ class PickableImage( QFrame ):
 		vlayout.addWidget(self.path_box)
 
 	def __update_required__(self):
-		if self.required:
+		if self.error:
+			self.iconButton.setStyleSheet(STYLESHEET_TILE_ERROR)
+			self.iconButton.update()
+		elif self.required:
 			self.iconButton.setStyleSheet('' if self.path else STYLESHEET_TILE_REQUIRED)
 			self.iconButton.update()
+		else:
+			self.iconButton.setStyleSheet('')
 
 	def mousePressEvent(self, event: QMouseEvent) -> None:
 		if self.path == None or event.button() != Qt.MouseButton.LeftButton:
@@ -147,6 +158,7 @@ class PickableImage( QFrame ):
 
 	def __set_path__(self, path: str):
 		self.path = Path(path)
+		self.error = None
 		self.__update_meta__()
 	
 	def __set_icon__(self, img: QImage|None):
@@ -170,16 +182,28 @@ class PickableImage( QFrame ):
 
 	def __update_meta__(self):
 		''' Updates the text and styling for this widget. '''
-		self.iconButton.setToolTip(f'{self.path.name} Right-click to remove' if self.path else '')
+		if self.path and self.error:	self.iconButton.setToolTip(f"Couldn't load {self.path.name}! ({self.error}) Right-click to remove")
+		elif self.path:					self.iconButton.setToolTip(f'{self.path.name} Right-click to remove')
+		else:							self.iconButton.setToolTip('')
 		self.path_box.setText(self.path.name if self.path else '')
 		self.__update_required__()
 
 	@Slot()
-	def on_role_updated(self, role: ImageRole, path: str, qimage: QImage):
+	def on_role_updated(self, role: ImageRole, path: str):
 		if role != self.role: return
 		self.__set_path__(path)
+
+	@Slot()
+	def on_thumbnail_loaded(self, role: ImageRole, qimage: QImage):
+		if role != self.role: return
 		self.__set_icon__(qimage)
 
+	@Slot()
+	def on_thumbnail_failed(self, role: ImageRole, error: str):
+		if role != self.role: return
+		self.error = error
+		self.__update_meta__()
+
 class MainWindow( QMainWindow ):
 	update_from_preset = Signal( Preset, name='UpdateFromPreset' )
 
@@ -189,9 +213,18 @@ class MainWindow( QMainWindow ):
 	watching: bool = False
 
 	watcherTimeout: QTimer
+	idleTimeout: QTimer
+	drafted: bool = False
+	''' True if the last export wrote draft textures, which should be replaced by a full-quality export. '''
 	watcher: QFileSystemWatcher
 	watcherModifiedFiles: set[str]
 
+	exporter: ExportWorker
+	thumbnails: ThumbnailLoader
+	runningExport: ExportRequest|None = None
+	pendingExport: ExportRequest|None = None
+	''' An export requested while another was running. Requests that arrive before it starts are merged into it. '''
+
 	config: AppConfig
 	backend: CoreBackend
 	progressBar: QProgressBar
@@ -208,9 +241,13 @@ class MainWindow( QMainWindow ):
 
 		self.watcherTimeout = QTimer()
 		self.watcherTimeout.setSingleShot(True)
-		self.watcherTimeout.timeout.connect(self.export)
+		self.watcherTimeout.timeout.connect(self.export_changed)
 		self.watcherModifiedFiles = set()
 
+		self.idleTimeout = QTimer()
+		self.idleTimeout.setSingleShot(True)
+		self.idleTimeout.timeout.connect(self.export_final)
+
 		self.watcher = QFileSystemWatcher(self)
 		self.watcher.fileChanged.connect(self.on_file_changed)
 
@@ -218,6 +255,16 @@ class MainWindow( QMainWindow ):
 		self.backend = CoreBackend()
 		self.cache = load_cache()
 
+		self.exporter = ExportWorker(self.backend)
+		self.exporter.loaded.connect(self.backend.apply_state)
+		self.exporter.progress.connect(self.on_export_progress)
+		self.exporter.proxied.connect(self.on_export_proxied)
+		self.exporter.finished.connect(self.on_export_finished)
+		self.exporter.failed.connect(self.on_export_failed)
+
+		self.thumbnails = ThumbnailLoader()
+		self.backend.role_updated.connect(self.thumbnails.request)
+
 		#endregion
 		''' ========================== MENU ========================== '''
 		#region menu
@@ -303,6 +350,8 @@ class MainWindow( QMainWindow ):
 		def registerWidgets(parent: QBoxLayout, entries: list[PickableImage]):
 			for widget in entries:
 				self.backend.role_updated.connect(widget.on_role_updated)
+				self.thumbnails.loaded.connect(widget.on_thumbnail_loaded)
+				self.thumbnails.failed.connect(widget.on_thumbnail_failed)
 				widget.on_user_modified.connect(self.mark_dirty)
 				parent.addWidget(widget)
 
@@ -423,7 +472,7 @@ class MainWindow( QMainWindow ):
 
 
 		self.exportButton = QPushButton('Export As...')
-		self.exportButton.clicked.connect(self.export_as)
+		self.exportButton.clicked.connect(self.on_export_button)
 		footer.addWidget(self.exportButton)
 		
 		#endregion
@@ -474,56 +523,126 @@ class MainWindow( QMainWindow ):
 	#region Exporting
 
 	@Slot()
-	def export(self, *, noCache=True):
-		if self.exporting: return
-		self.exporting = True
-
+	def export(self, *, noCache=True, reload: set[ImageRole]|None=None, draft=False, proxy=True):
+		''' Exports the material, reloading the roles in reload, or every role if noCache is set. If proxy is false, progressiveExport is ignored. '''
 		overwriteVmts = self.config.overwriteVmts
 		if not overwriteVmts:
 			keyModifiers = QApplication.queryKeyboardModifiers()
 			overwriteVmts = bool(keyModifiers & keyModifiers.AltModifier)
 			if overwriteVmts: log.info('Alt key active: VMT overwrite is enabled for this export.')
 
+		if self.target == None: self.pick_target()
+		if self.target == None:
+			log.info('The export was cancelled by the user.')
+			return
+
+		progressive = proxy and self.config.progressiveExport and self.config.hijackMode != HijackMode.Disabled
+		self.request_export(ExportRequest(noCache and reload == None, reload or set(), overwriteVmts, draft, progressive))
+
+	@Slot()
+	def export_final(self):
+		''' Replaces draft textures with full-quality ones. Only the drafted textures are written again. (See manifest) '''
+		self.idleTimeout.stop()
+		if not self.drafted: return
+		log.info('Replacing draft textures...')
+		# The drafts are already shown, so a proxy would only replace them with something worse.
+		self.export(reload=set(), proxy=False)
+
+	def request_export(self, request: ExportRequest):
+		''' Starts an export, or coalesces it with the next one if an export is already running. '''
+		if not self.exporting:
+			self.start_export(request)
+			return
+
+		if self.pendingExport: request = self.pendingExport.merge(request)
+
+		# Exports that haven't started writing are restarted, so they don't write textures that are already out of date.
+		# The running request is kept until the worker reports back, since it may still finish before it sees the cancellation.
+		if self.exporter.cancelled.is_set():
+			pass # The running export is already stopping, and the pending one starts once it has.
+		elif self.runningExport and not self.exporter.writing:
+			log.info('Restarting the export to include newer changes...')
+			request = self.runningExport.merge(request)
+			self.exporter.cancel()
+		elif self.runningExport:
+			log.info('Queued another export for after the current one.')
+
+		self.pendingExport = request
+
+	def start_export(self, request: ExportRequest):
 		log.info('Exporting...')
-		self.exportButton.setEnabled(False)
+		self.exporting = True
+
+		# The worker exports a copy of the roles and settings, so they can be edited while it runs.
+		request.state = self.backend.snapshot()
+		self.runningExport = request
+		self.exportButton.setText('Cancel')
 		self.progressBar.setFormat('Exporting...')
 		self.progressBar.setValue(0)
-		QApplication.processEvents()
+		self.exporter.start(request)
 
-		try:
-			self.progressBar.setFormat('Creating material...')
-			material = self.backend.make_material(noCache=noCache)
-			self.progressBar.setValue(20)
+	def finish_export(self):
+		self.exporting = False
+		self.runningExport = None
+		self.exportButton.setText('Export As...')
 
-			if self.target == None: self.pick_target()
-			if self.target == None: raise InterruptedError()
+		if self.pendingExport:
+			request = self.pendingExport
+			self.pendingExport = None
+			self.start_export(request)
 
-			def log_callback(msg: str|None, percent: int|None):
-				log.info(f'Export ({self.progressBar.value()}%): {msg}')
-				if msg: self.progressBar.setFormat(msg)
-				if percent: self.progressBar.setValue(percent)
-				QApplication.processEvents()
+	@Slot()
+	def cancel_export(self):
+		if not self.exporting: return
+		log.info('Cancelling export...')
+		self.pendingExport = None
+		self.exporter.cancel()
 
-			self.backend.export(material, log_callback, overwrite_vmt=overwriteVmts)
-			self.progressBar.setValue(100)
+	@Slot()
+	def on_export_button(self):
+		if self.exporting:	self.cancel_export()
+		else:				self.export_as()
+
+	@Slot(object, object)
+	def on_export_progress(self, msg: str|None, percent: int|None):
+		log.info(f'Export ({self.progressBar.value()}%): {msg}')
+		if msg: self.progressBar.setFormat(msg)
+		if percent: self.progressBar.setValue(percent)
+
+	@Slot(ExportRequest, SaveResult)
+	def on_export_proxied(self, request: ExportRequest, result: SaveResult):
+		assert request.state != None
+		command = self.backend.get_reload_command(result, request.state)
+		if command: self.backend.send_engine_command(command)
+
+	@Slot(ExportRequest, SaveResult)
+	def on_export_finished(self, request: ExportRequest, result: SaveResult):
+		self.progressBar.setValue(100)
+
+		# Decided by the request this result belongs to, which is no longer the running one if a restart was requested too late.
+		self.drafted = request.draft
+		if self.drafted: self.idleTimeout.start(self.config.watchIdleTimeout)
+
+		if self.config.hijackMode:
+			assert request.state != None
+			command = self.backend.get_reload_command(result, request.state)
+			if command: self.backend.send_engine_command(command)
+
+		self.finish_export()
+
+	@Slot(Exception)
+	def on_export_failed(self, e: Exception):
+		self.progressBar.setValue(0)
+		self.progressBar.setFormat('')
 
-			if self.config.hijackMode:
-				self.backend.send_engine_command(f'mat_reloadmaterial {self.backend.name}')
-	
-		except Exception as e:
-			self.progressBar.setValue(0)
-			self.progressBar.setFormat('')
-
-			if isinstance(e, InterruptedError):
-				log.info('The export was cancelled by the user.')
-			else:
-				log.warning(f'The export failed!\n\n{format_exc()}')
-				message = QMessageBox(QMessageBox.Icon.Critical, 'Failed to export!', str(e))
-				message.exec()
-		
-		finally:
-			self.exportButton.setEnabled(True)
-			self.exporting = False
+		if isinstance(e, InterruptedError):
+			if self.pendingExport == None: log.info('The export was cancelled by the user.')
+		else:
+			log.warning(f'The export failed!\n\n{"".join(format_exception(e))}')
+			message = QMessageBox(QMessageBox.Icon.Critical, 'Failed to export!', str(e))
+			message.exec()
+
+		self.finish_export()
 
 	@Slot()
 	def export_as(self):
@@ -547,8 +666,11 @@ class MainWindow( QMainWindow ):
 			self.pick_target()
 			if not self.target: return
 
-		if self.watching:	self.stop_watch()
-		else:				self.start_watch()
+		if self.watching:
+			self.stop_watch()
+			self.export_final()
+		else:
+			self.start_watch()
 		log.info(f'Watching {len(self.watcher.files())} files.\n')
 
 	def start_watch(self):
@@ -560,6 +682,8 @@ class MainWindow( QMainWindow ):
 
 	def stop_watch(self):
 		self.watching = False
+		self.watcherTimeout.stop()
+		self.watcherModifiedFiles.clear()
 		self.watchAction.setChecked(False)
 		self.watcher.removePaths(self.watcher.files())
 		self.setWindowTitle()
@@ -577,12 +701,34 @@ class MainWindow( QMainWindow ):
 		message.exec()
 
 	@Slot()
-	def on_file_changed(self, _file: str):
+	def on_file_changed(self, file: str):
 		assert self.watching, 'on_file_changed handler not detatched. Tell a programmer!'
+		self.watcherModifiedFiles.add(file)
+
+		# Editors that save by replacing the file drop it from the watcher.
+		if file not in self.watcher.files() and Path(file).is_file():
+			self.watcher.addPath(file)
+
+		self.idleTimeout.stop()
 		if not self.watcherTimeout.isActive():
 			log.info(f'Files changed! Starting timeout...')
 		self.watcherTimeout.start(self.config.watchTimeout)
 
+	@Slot()
+	def export_changed(self):
+		''' Exports after watched files change, reloading only their roles and skipping the export if no texture uses them. '''
+		changed = self.watcherModifiedFiles
+		self.watcherModifiedFiles = set()
+
+		roles = { role for role, path in self.backend.paths.items() if path != None and path in changed }
+		affected = get_affected_outputs(self.backend.get_outputs(), roles)
+		if not affected:
+			log.info('None of the changed files are used by any texture. Skipping export...')
+			return
+
+		log.info(f'Changed: {", ".join(roles)}. Updating: {", ".join(x.name for x in affected)}')
+		self.export(reload=roles, draft=self.config.watchDrafts)
+
 	#endregion
 	#region Presets
 
@@ -732,6 +878,8 @@ class MainWindow( QMainWindow ):
 			return
 
 		log.info('Shutting down...')
+		self.exporter.stop()
+		self.thumbnails.stop()
 		try:
 			log.debug('Saving app cache...')
 			save_cache(self.cache)
@@ -749,6 +897,7 @@ def start_gui(args):
 	app: QApplication = QApplication()
 	app.setApplicationVersion(__version__)
 	app_config = load_config(True, pathOverride=args.config)
+	setup_decode_cache(get_decode_cache_path(), app_config.decodeCacheSize * 1024 * 1024)
 
 	match app_config.appTheme:
 		case AppTheme.Default:
@@ -1,47 +1,90 @@
 # from PySide6.QtCore import Signal, Slot
 # from PySide6.QtCore import Qt
-from PySide6.QtGui import QImage
-from PySide6.QtCore import Signal, QObject
+from PySide6.QtCore import Signal, Slot, QObject
 
-from ..core.io.qtio import QtIOBackend, image_to_qimage
-from ..core import texops
-from ..core.export import export as core_export
-from ..core.vmt import make_vmt as core_make_vmt
+from ..core.io.qtio import QtIOBackend
+from ..core.export import make_material as core_make_material, save_material as core_save_material, get_stale_textures, get_decode_pool, get_load_size, ROLE_CHANNELS, ExportCallback, SaveResult, CALLBACK_NONE
+from ..core.mips import make_proxy
+from ..core.vmt import get_material_name
 from ..core.io.image import Image
-from ..core.material import Material, MaterialMode, GameTarget, NormalType
-from ..core.config import get_config, HijackMode
+from ..core.material import Material, MaterialMode, GameTarget, NormalType, ImageRole, get_output_dependencies, swaps_phong_envmap
+from ..core.config import get_config, HijackMode, TargetRole
 from ..core.preset import Preset
+from ..core.io.cache import get_file_hash, get_file_stat
 import logging as log
-from math import ceil, log2
 from time import perf_counter
+from typing import Callable
 
 from pathlib import Path
-from enum import StrEnum
-from typing import Callable
+from dataclasses import dataclass, field
 
 import sys
 from sourcepp import gamepp
 from socket import socket
 
-class ImageRole(StrEnum):
-	Albedo = 'albedo'
-	Roughness = 'roughness'
-	Metallic = 'metallic'
-	Emit = 'emit'
-	AO = 'ao'
-	Normal = 'normal'
-	Height = 'height'
-
-# Used as a default dummy callback by export()
-CALLBACK_NONE = lambda _a, _b: None
+PROXY_LEVELS = 2
+''' Proxies are exported at 1/2^PROXY_LEVELS of the material's size. '''
+PROXY_MIN_SIZE = 1024
+''' Materials smaller than this are quick enough to export without a proxy. '''
+
+@dataclass
+class LoadedImage():
+	''' A role's image, loaded by CoreBackend.__load_role__ on any thread. '''
+	image: Image
+	hash: str|None
+	stat: tuple[int, int, int]|None
+	size: tuple[int, int]|None
+	''' The size the image was decoded nearer to. (See get_load_size) '''
+
+@dataclass
+class BackendState():
+	'''
+	A copy of the backend's roles and settings, taken on the GUI thread when an export starts. (See CoreBackend.snapshot)
+	The export checks and loads images against it alone, so the GUI can keep editing the backend in the meantime.
+	'''
+	mode: MaterialMode
+	game: GameTarget
+	normalType: NormalType
+	scaleTarget: int
+	path: Path|None = None
+	''' The folder of the VMT to export to. (See CoreBackend.path) '''
+	name: str|None = None
+	''' The name of the material to export. (See CoreBackend.name) '''
+	paths: dict[ImageRole, str|None] = field(default_factory=dict)
+	images: dict[ImageRole, Image|None] = field(default_factory=dict)
+	hashes: dict[ImageRole, str] = field(default_factory=dict)
+	stats: dict[ImageRole, tuple[int, int, int]] = field(default_factory=dict)
+	sizes: dict[ImageRole, tuple[int, int]|None] = field(default_factory=dict)
+
+def store_role(target: 'CoreBackend|BackendState', role: ImageRole, loaded: LoadedImage|None):
+	''' Sets the image of a role to the result of CoreBackend.__load_role__, or clears it if loaded is None. '''
+	if loaded:
+		target.images[role] = loaded.image
+		target.sizes[role] = loaded.size
+		if loaded.hash != None:	target.hashes[role] = loaded.hash
+		else:					target.hashes.pop(role, None)
+		if loaded.stat != None:	target.stats[role] = loaded.stat
+		else:					target.stats.pop(role, None)
+	else:
+		target.images[role] = None
+		target.hashes[role] = ''
+		target.stats.pop(role, None)
+		target.sizes.pop(role, None)
 
 class CoreBackend(QObject):
 
-	# This event is triggered when a file is picked or when a preset is loaded.
-	role_updated = Signal( ImageRole, str, QImage, name='RoleUpdated' )
+	# This event is triggered when a file is picked, when a preset is loaded, or when a role's image is reloaded.
+	# Thumbnails are loaded separately. (See ThumbnailLoader)
+	role_updated = Signal( ImageRole, str, name='RoleUpdated' )
 
 	images: dict[ImageRole, Image|None] = {}
 	paths: dict[ImageRole, str|None] = {}
+	hashes: dict[ImageRole, str] = {}
+	''' The content hashes of each loaded image's file, taken when it was loaded. (See manifest) '''
+	stats: dict[ImageRole, tuple[int, int, int]] = {}
+	''' The stat of each loaded image's file, taken when it was loaded or last found unchanged. (See get_file_stat) '''
+	sizes: dict[ImageRole, tuple[int, int]|None] = {}
+	''' The size each loaded image was decoded nearer to. Images are reloaded when the size of the material changes. '''
 
 	path: Path|None = None
 	''' The full path to the last-picked VMT's parent folder. '''
@@ -85,150 +128,147 @@ class CoreBackend(QObject):
 		for role in ImageRole:
 			preset.set_path(role, self.get_role_path(role))
 
-	def __load_image__(self, path: str) -> tuple[QImage, Image]:
-		''' Loads the specified path as an image, returning a (QImage, Image) tuple. '''
-		image: QImage = QImage()
-		converted = QtIOBackend.load(path)
-		image = image_to_qimage(converted)
-		return (image, converted)
-
-	def set_role_image(self, path: str|None, role: ImageRole) -> tuple[QImage, Image] | tuple[None, None]:
-		''' Loads the specified path and sets the specified backend image. This method emits the image_updated signal! '''
-		conv: tuple[QImage, Image] | tuple[None, None] = (None, None)
-
-		if path:
-			# Load and cache image
-			conv = self.__load_image__(path)
-			self.images[role] = conv[1]
-		else:
-			# Remove cached image
-			self.images[role] = None
-
-		# Update current path
+	def __load_image__(self, path: str, size: tuple[int, int]|None=None, channels: int|None=None) -> Image:
+		''' Loads the specified path as an image. '''
+		return Image.load(path, QtIOBackend, size, channels)
+
+	def __load_role__(self, role: ImageRole, path: str, size: tuple[int, int]|None) -> LoadedImage:
+		''' Hashes and loads the specified path, with the channels the role uses. Safe to call from any thread. '''
+		# Files are hashed before they are loaded, so a file that changes in between is exported again next time.
+		stat = get_file_stat(path)
+		try:				digest = get_file_hash(path)
+		except OSError:		digest = None
+		return LoadedImage(self.__load_image__(path, size, ROLE_CHANNELS[role]), digest, stat, size)
+
+	def set_role_image(self, path: str|None, role: ImageRole):
+		'''
+		Picks the file of a role. Its image is loaded by the next export, on the export worker's thread,
+		so picking files doesn't decode them on the GUI thread. This method emits the role_updated signal!
+		'''
+		path = path or None
+		store_role(self, role, None)
 		self.set_role_path(role, path)
+		self.role_updated.emit(role, path)
 
-		self.role_updated.emit(role, path, conv[0])
-		return conv
-
-	def pick_vmt(self, pathStr: str):
-		path = Path(pathStr)
-		self.path = path.parent
-
-		name = path.name.removesuffix('.vmt')
-		namePath = ''
-		useNamePath = False
-		for component in reversed(path.parts[:-1]):
-			if component == 'materials':
-				useNamePath = True
-				break
-			namePath = component + '/' + namePath
-
-		self.name = namePath+name if useNamePath else name
-
-	def make_material(self, *, noCache: bool=False):
-		''' Generate the material from the collected textures. '''
-
-		TIME_BEFORE = perf_counter()
+	def snapshot(self) -> BackendState:
+		''' Copies the roles and settings an export works from. Must be called from the GUI thread! '''
+		return BackendState(
+			self.mode,
+			self.game,
+			self.normalType,
+			self.scaleTarget,
+			self.path,
+			self.name,
+			paths={ role: self.get_role_path(role) for role in ImageRole },
+			images=dict(self.images),
+			hashes=dict(self.hashes),
+			stats=dict(self.stats),
+			sizes=dict(self.sizes)
+		)
 
-		def getImage(role: ImageRole) -> Image|None:
-			''' Helper function for re-fetching images when the cache is disabled. '''
-			if noCache:
-				rolePath = self.get_role_path(role)
-				if rolePath == None: return None
-				return self.set_role_image(rolePath, role)[1]
-			return self.get_role_image(role)
+	@Slot(object)
+	def apply_state(self, state: BackendState):
+		'''
+		Keeps the images an export loaded into its state (See make_material), for the roles whose file hasn't
+		been picked again since the state was copied. Must be called from the GUI thread! This method emits the role_updated signal!
+		'''
+		for role in ImageRole:
+			path = state.paths.get(role)
+			if path == None or path != self.get_role_path(role): continue
 
-		albedo = getImage(ImageRole.Albedo)
-		assert albedo != None, 'A basetexture is required to convert the material!'
+			reloaded = state.images.get(role) is not self.images.get(role)
+			self.images[role] = state.images.get(role)
+			for target, source in ((self.hashes, state.hashes), (self.stats, state.stats), (self.sizes, state.sizes)):
+				if role in source:	target[role] = source[role] # type: ignore
+				else:				target.pop(role, None)
 
-		roughness = getImage(ImageRole.Roughness)
-		assert roughness != None, 'A roughness map is required to convert the material!'
+			if reloaded: self.role_updated.emit(role, path)
 
-		metallic = getImage(ImageRole.Metallic) or Image.blank(roughness.size, (0.0,))
-		emit = getImage(ImageRole.Emit)
-		ao = getImage(ImageRole.AO)
-		normal = getImage(ImageRole.Normal) or Image.blank(roughness.size, (0.5, 0.5, 1.0))
-		height = getImage(ImageRole.Height)
+	@staticmethod
+	def has_role_changed(state: BackendState, role: ImageRole) -> bool:
+		'''
+		Returns true if the file of a role's image has changed since it was loaded into state. Files whose stat
+		has changed are hashed, so a file that was touched or rewritten with the same pixels isn't reloaded.
+		'''
+		path = state.paths.get(role)
+		if path == None: return False
 
-		TIME_AFTER = perf_counter()
-		log.debug(f'(Re)loaded images in {round(TIME_AFTER - TIME_BEFORE, 4)}ms (noCache={noCache})')
+		stat = get_file_stat(path)
+		if stat != None and stat == state.stats.get(role): return False
 
-		def to_pow2(x: float) -> int:
-			return pow(2, ceil(log2(int(x))))
+		# Let the loader report files that can't be read.
+		try:				digest = get_file_hash(path)
+		except OSError:		return True
+		if digest != state.hashes.get(role): return True
 
-		albedoWidth, albedoHeight = albedo.size
-		albedoMaxSize = max(albedoWidth, albedoHeight)
-		texScale      = (min(albedoMaxSize, self.scaleTarget) / albedoMaxSize) if self.scaleTarget else 1
-		texDims       = (to_pow2(albedoWidth * texScale), to_pow2(albedoHeight * texScale))
-	
-		log.info(f'Determined size {texDims} via scale target {self.scaleTarget}')
+		if stat != None: state.stats[role] = stat
+		return False
 
-		log.info('Constructing material...')
+	def pick_vmt(self, pathStr: str):
+		path = Path(pathStr)
+		self.path = path.parent
+		self.name = get_material_name(path)
 
-		return Material(
-			self.mode,
-			self.game,
-			texDims,
-			albedo=texops.normalize(albedo, texDims, mode='RGBA'),
-			roughness=texops.normalize(roughness, texDims, mode='L'),
-			metallic=texops.normalize(metallic, texDims, mode='L'),
-			emit=texops.normalize(emit, texDims, noAlpha=True) if emit else None,
-			ao=texops.normalize(ao, texDims, mode='L') if ao else None,
-			normal=texops.normalize(normal, texDims, mode='RGB'),
-			height=texops.normalize(height, texDims, mode='L') if height else None,
-			normalType=self.normalType
-		)
+	def make_material(self, state: BackendState, *, noCache: bool=False, reload: set[ImageRole]|None=None):
+		'''
+		Generate the material from a copy of the backend's roles and settings (See snapshot), checking every image
+		for changes if noCache is set, or the images of the roles in reload. Only images whose files have changed
+		are reloaded, along with images that were decoded for a different size of material, and picked images are
+		loaded, in parallel. (See has_role_changed, get_load_size) The images are loaded into state, which the
+		backend doesn't see until it is passed to apply_state. Safe to call from any thread.
+		'''
 
-	def export(self, material: Material, callback: Callable[[str|None, int|None], None] = CALLBACK_NONE, overwrite_vmt=True):
-		assert self.path != None and self.name != None, 'Something has gone very very wrong. Find a developer!'
+		TIME_BEFORE = perf_counter()
 
-		appConfig = get_config()
-		material.name = self.name
+		checked = [role for role in ImageRole if noCache or (reload and role in reload)]
+		changed = { role for role in checked if self.has_role_changed(state, role) }
 
-		callback('Processing textures...', 20)
+		size = get_load_size(state.paths.get(ImageRole.Albedo), state.scaleTarget, QtIOBackend)
+		reloaded = [role for role in ImageRole if state.paths.get(role) != None and (role in changed or state.images.get(role) == None or state.sizes.get(role) != size)]
 
-		TIME_BEFORE = perf_counter()
-		
-		textures = core_export(material)
-		textureVersion = GameTarget.vtf_version(material.target)
-		textureCount = len(textures)
+		pool = get_decode_pool()
+		jobs = { role: pool.submit(self.__load_role__, role, state.paths[role], size) for role in reloaded }
+		for role, job in jobs.items():
+			store_role(state, role, job.result())
+		images = { role: state.images.get(role) if state.paths.get(role) != None else None for role in ImageRole }
 
 		TIME_AFTER = perf_counter()
-		log.debug(f'Processed textures in {round(TIME_AFTER - TIME_BEFORE, 4)}ms')
-
-		materialName = self.name.rsplit('/', 1)[-1]
-		vmtPath = self.path / (materialName + '.vmt')
-		shouldWriteVmt = overwrite_vmt or (not Path(vmtPath).exists())
-
-		callback(None, 50)
-		if shouldWriteVmt:
-			callback('Writing VMT...', None)
-			vmt = core_make_vmt(material)
-			with open(vmtPath, 'w') as vmtFile:
-				vmtFile.write(vmt)
-		else:
-			log.info('Skipped generating VMT! (overwriteVmts is False)')
-
-		callback(f'Writing textures...', 60)
-
-		for i, texture in enumerate(textures):
-			textureConfig = appConfig.targets[texture.role]
-			fullPath = self.path / (materialName + textureConfig.postfix)
-			texture.image.save(
-				fullPath,
-				version=textureVersion,
-				lossy=textureConfig.lossy,
-				zip=textureConfig.zip,
-				flags=textureConfig.flags,
-				mipmaps=textureConfig.mipmaps,
-				mipmapFilter=textureConfig.mipmapFilter
-			)
-			callback(f'Writing textures... [{i+1}/{textureCount}]', 60 + int((i+1) / textureCount * 40))
-
-		if shouldWriteVmt:
-			callback(f'Finished exporting {materialName}!', 100)
-		else:
-			callback(f'Finished exporting {materialName}_*.vtf!', 100)
+		log.debug(f'(Re)loaded {len(reloaded)}/{len(checked)} images in {round(TIME_AFTER - TIME_BEFORE, 4)}s (noCache={noCache}, reload={reload})')
+
+		return core_make_material(images, state.mode, state.game, state.normalType, state.scaleTarget, sources=dict(state.hashes), size=size)
+
+	def get_outputs(self) -> dict[TargetRole, tuple[ImageRole, ...]]:
+		''' Returns the textures an export would generate with the current settings, and the roles each one is derived from. '''
+		return get_output_dependencies(self.mode, swaps_phong_envmap(self.mode, self.game), self.paths.get(ImageRole.Height) != None, self.paths.get(ImageRole.Emit) != None)
+
+	@staticmethod
+	def export(material: Material, state: BackendState, callback: ExportCallback = CALLBACK_NONE, overwrite_vmt=True, draft=False, on_proxy: Callable[[SaveResult], None]|None=None) -> SaveResult:
+		'''
+		Exports the material to the VMT that was picked when state was copied, so picking another one while the export runs
+		doesn't move it. If on_proxy is specified, a downscaled proxy of the textures that are out-of-date is exported and
+		passed to it first, so it can be shown while the material is exported. Safe to call from any thread.
+		'''
+		assert state.path != None and state.name != None, 'Something has gone very very wrong. Find a developer!'
+		material.name = state.name
+
+		if on_proxy and max(material.size) >= PROXY_MIN_SIZE:
+			stale = get_stale_textures(material, state.path, draft)
+			if stale:
+				callback('Writing proxy...', None)
+				proxy = make_proxy(material, PROXY_LEVELS)
+				on_proxy(core_save_material(proxy, state.path, overwrite_vmt=overwrite_vmt, draft=True, only=stale))
+
+		return core_save_material(material, state.path, callback, overwrite_vmt=overwrite_vmt, draft=draft)
+
+	@staticmethod
+	def get_reload_command(result: SaveResult, state: BackendState) -> str|None:
+		''' Returns the console command that reloads what an export of state wrote, or None if nothing was written. '''
+		if result.vmt: return f'mat_reloadmaterial {state.name}'
+		if not result.textures: return None
+
+		# Textures are named after their path inside the materials folder, without the extension.
+		targets = get_config().targets
+		return ';'.join(f'mat_reloadtexture {state.name}{targets[role].postfix.rsplit(".", 1)[0]}' for role in result.textures)
 
 	def send_engine_command(self, cmd: str) -> bool:
 		config = get_config()
@@ -2,6 +2,10 @@ STYLESHEET_TILE_REQUIRED = '''
 border-color: #999;
 '''
 
+STYLESHEET_TILE_ERROR = '''
+border-color: #d33;
+'''
+
 STYLESHEET_MIN = '''
 QLabel#hint {
 	color: #777;
@@ -0,0 +1,116 @@
+from PySide6.QtCore import QObject, Qt, Signal, Slot
+from PySide6.QtGui import QImage
+
+from ..core.io.qtio import QtIOBackend, image_to_qimage
+from ..core.io.sppio import SPP_SUPPORTED, get_path_suffix
+from ..core.io.cache import get_file_stat
+from ..core.material import ImageRole
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging as log
+
+THUMBNAIL_SIZE = 96
+''' Thumbnails are scaled to fit in a square of this size, twice the size of the icons, so they stay sharp on high-DPI screens. '''
+THUMBNAIL_CACHE_SIZE = 64
+''' The number of thumbnails kept in memory. '''
+THUMBNAIL_THREADS = 2
+
+ThumbnailKey = tuple[str, tuple[int, int, int]|None]
+''' A thumbnail's path, and the stat of its file when it was requested. (See get_file_stat) '''
+
+def get_thumbnail_size(size: tuple[int, int], limit: int) -> tuple[int, int]:
+	''' Returns the size of an image scaled down to fit in a limit x limit square. '''
+	width, height = size
+	scale = min(1.0, limit / max(width, height))
+	return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+def load_thumbnail(path: str, limit: int=THUMBNAIL_SIZE) -> QImage:
+	'''
+	Loads an image scaled down to fit in a limit x limit square. Formats that can be decoded at a reduced size
+	(like JPEG, or VTF through its mips) are, so large images are decoded no larger than they need to be.
+	'''
+	source = QtIOBackend.read_size(path)
+	size = get_thumbnail_size(source, limit) if source else None
+
+	if get_path_suffix(path) in SPP_SUPPORTED:	qimage = image_to_qimage(QtIOBackend.load(path, size))
+	else:										qimage = QtIOBackend.load_qimage(path, size)
+
+	if max(qimage.width(), qimage.height()) <= limit: return qimage
+	return qimage.scaled(limit, limit, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+
+class ThumbnailLoader(QObject):
+	'''
+	Loads the thumbnails of role images on background threads, separately from the images the backend loads
+	for exporting. Thumbnails are cached by the path and stat of their file, so a file is only decoded again
+	once it has changed.
+	'''
+
+	loaded = Signal( ImageRole, QImage, name='Loaded' )
+	''' Emitted with the thumbnail of each role's latest request. The QImage is null if the role has no file, or it couldn't be loaded. '''
+	failed = Signal( ImageRole, str, name='Failed' )
+	''' Emitted after loaded, with the error, when the file of a role's latest request couldn't be loaded. '''
+
+	__finished__ = Signal( object, object, str )
+
+	pool: ThreadPoolExecutor
+	cache: OrderedDict[ThumbnailKey, QImage]
+	requests: dict[ImageRole, ThumbnailKey|None]
+	''' The latest request of each role. Thumbnails that finish loading after another request of their role are cached, but not emitted. '''
+	pending: set[ThumbnailKey]
+
+	def __init__(self) -> None:
+		super().__init__()
+		self.pool = ThreadPoolExecutor(THUMBNAIL_THREADS, thread_name_prefix='thumbnail')
+		self.cache = OrderedDict()
+		self.requests = {}
+		self.pending = set()
+		self.__finished__.connect(self.__on_finished__)
+
+	@Slot(ImageRole, str)
+	def request(self, role: ImageRole, path: str|None):
+		''' Loads the thumbnail of a role's file, and emits it with the loaded signal. Must be called from the GUI thread! '''
+		if not path:
+			self.requests[role] = None
+			self.loaded.emit(role, QImage())
+			return
+
+		key = (path, get_file_stat(path))
+		self.requests[role] = key
+
+		cached = self.cache.get(key)
+		if cached != None:
+			self.cache.move_to_end(key)
+			self.loaded.emit(role, cached)
+			return
+
+		if key in self.pending: return
+		self.pending.add(key)
+		self.pool.submit(self.__load__, key)
+
+	def stop(self):
+		''' Drops the thumbnails that haven't started loading, and waits for the rest. '''
+		self.pool.shutdown(cancel_futures=True)
+
+	def __load__(self, key: ThumbnailKey):
+		thumbnail: QImage|None = None
+		error = ''
+		try:
+			thumbnail = load_thumbnail(key[0])
+		except Exception as e:
+			log.warning(f'Failed to load the thumbnail of {key[0]}! ({e})')
+			error = str(e) or type(e).__name__
+		self.__finished__.emit(key, thumbnail, error)
+
+	@Slot(object, object, str)
+	def __on_finished__(self, key: ThumbnailKey, thumbnail: QImage|None, error: str):
+		self.pending.discard(key)
+		if thumbnail != None:
+			self.cache[key] = thumbnail
+			while len(self.cache) > THUMBNAIL_CACHE_SIZE: self.cache.popitem(last=False)
+
+		# Every role whose latest request is this file gets the thumbnail, including roles that requested it while it was loading.
+		for role, request in list(self.requests.items()):
+			if request != key: continue
+			self.loaded.emit(role, thumbnail if thumbnail != None else QImage())
+			if thumbnail == None: self.failed.emit(role, error)
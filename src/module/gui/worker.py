@@ -0,0 +1,116 @@
+from PySide6.QtCore import QObject, QThread, Signal, Slot
+
+from ..core.export import SaveResult
+from ..core.material import ImageRole
+from .backend import CoreBackend, BackendState
+
+from dataclasses import dataclass, field
+from threading import Event
+import logging as log
+
+WRITE_PERCENT = 50
+''' The progress at which save_material starts writing files. Exports that haven't reached it can be restarted without losing any work. '''
+
+@dataclass
+class ExportRequest():
+	noCache: bool = True
+	''' If true, every image is reloaded before exporting. '''
+	reload: set[ImageRole] = field(default_factory=set)
+	''' The roles whose images are reloaded before exporting, if noCache is false. '''
+	overwriteVmt: bool = False
+	draft: bool = False
+	''' If true, textures are encoded as drafts. (See save_material) '''
+	progressive: bool = False
+	''' If true, a proxy is exported before the material. (See CoreBackend.export) '''
+	state: BackendState|None = None
+	''' The backend's roles and settings, copied on the GUI thread when the export starts. Requests are merged before they have one. '''
+
+	def merge(self, other: 'ExportRequest') -> 'ExportRequest':
+		''' Combines two requests into a single export that does the work of both. '''
+		return ExportRequest(
+			self.noCache or other.noCache,
+			self.reload | other.reload,
+			self.overwriteVmt or other.overwriteVmt,
+			self.draft and other.draft,
+			self.progressive or other.progressive
+		)
+
+class ExportWorker(QObject):
+	'''
+	Runs exports on a background thread, so the window stays responsive while textures are encoded.
+	Progress and results are reported through signals, which Qt delivers on the GUI thread.
+	'''
+
+	progress = Signal( object, object, name='Progress' )
+	''' Emitted with the (message, percent) of each ExportCallback call. Either may be None. '''
+	loaded = Signal( object, name='Loaded' )
+	''' Emitted with the BackendState of the running export once its images are loaded. (See CoreBackend.apply_state) '''
+	proxied = Signal( ExportRequest, SaveResult, name='Proxied' )
+	''' Emitted with the request of a progressive export once its proxy has been written. '''
+	finished = Signal( ExportRequest, SaveResult, name='Finished' )
+	''' Emitted with the request that was exported, which may not be the latest one if it finished before it saw a cancellation. '''
+	failed = Signal( Exception, name='Failed' )
+	''' Emitted with the exception that stopped an export. Cancelled exports fail with InterruptedError. '''
+
+	__requested__ = Signal( ExportRequest )
+
+	backend: CoreBackend
+	cancelled: Event
+	writing: bool = False
+	''' True once the running export has started writing files. '''
+
+	def __init__(self, backend: CoreBackend) -> None:
+		super().__init__()
+		self.backend = backend
+		self.cancelled = Event()
+
+		self.workerThread = QThread()
+		self.workerThread.setObjectName('ExportWorker')
+		self.moveToThread(self.workerThread)
+		self.__requested__.connect(self.__run__)
+		self.workerThread.start()
+
+	def start(self, request: ExportRequest):
+		''' Starts an export on the worker thread. Only one export may run at a time! '''
+		self.cancelled.clear()
+		self.writing = False
+		self.__requested__.emit(request)
+
+	def cancel(self):
+		''' Stops the running export at its next stage. Textures that are already being encoded are finished first. '''
+		self.cancelled.set()
+
+	def stop(self):
+		''' Cancels the running export and waits for the worker thread to exit. '''
+		self.cancel()
+		self.workerThread.quit()
+		self.workerThread.wait()
+
+	def __check__(self):
+		if self.cancelled.is_set(): raise InterruptedError()
+
+	def __callback__(self, message: str|None, percent: int|None):
+		self.__check__()
+		if percent != None and percent >= WRITE_PERCENT: self.writing = True
+		self.progress.emit(message, percent)
+
+	@Slot(ExportRequest)
+	def __run__(self, request: ExportRequest):
+		try:
+			self.__check__()
+			self.progress.emit('Creating material...', 0)
+			assert request.state != None, 'Exports must be started with a copy of the backend state!'
+			material = self.backend.make_material(request.state, noCache=request.noCache, reload=request.reload)
+			self.loaded.emit(request.state)
+			self.__check__()
+			self.progress.emit(None, 20)
+			onProxy = (lambda proxy: self.proxied.emit(request, proxy)) if request.progressive else None
+			result = self.backend.export(material, request.state, self.__callback__, overwrite_vmt=request.overwriteVmt, draft=request.draft, on_proxy=onProxy)
+
+		except Exception as e:
+			if not isinstance(e, InterruptedError):
+				log.debug('The export worker caught an exception!', exc_info=e)
+			self.failed.emit(e)
+			return
+
+		self.finished.emit(request, result)
@@ -0,0 +1,19 @@
+from module.core import config as configModule
+from module.core.config import AppConfig
+from module.core.io.image import Image
+from module.core.io.sppio import SourceppIOBackend
+
+import pytest
+
+@pytest.fixture
+def appConfig(monkeypatch: pytest.MonkeyPatch) -> AppConfig:
+	''' Installs a default config, as load_config would, for the duration of a test. Tests may change it freely. '''
+	config = AppConfig()
+	monkeypatch.setattr(configModule, '__config__', config, raising=False)
+	return config
+
+@pytest.fixture(autouse=True)
+def backend(monkeypatch: pytest.MonkeyPatch):
+	''' Every test loads and saves images through sourcepp, without a decode cache, so none of them need Qt. '''
+	monkeypatch.setattr(Image, 'backend', SourceppIOBackend, raising=False)
+	monkeypatch.setattr(Image, 'cache', None)
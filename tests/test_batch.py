@@ -0,0 +1,64 @@
+from module.core.batch import run_batch
+from module.core.config import AppConfig
+from module.core.io.image import Image, IO_BACKENDS
+from module.core.io.sppio import SourceppIOBackend
+
+from pathlib import Path
+import numpy as np
+import json
+import pytest
+
+SIZE = 64
+
+def write_image(path: Path, channels: int, seed: int):
+	rng = np.random.default_rng(seed)
+	assert SourceppIOBackend.save(Image(rng.integers(0, 256, (SIZE, SIZE, channels), np.uint8)), path)
+
+@pytest.fixture
+def workspace(tmp_path: Path, appConfig: AppConfig) -> tuple[Path, str]:
+	''' A preset with an albedo and a roughness map, and a config without a decode cache. '''
+	write_image(tmp_path / 'albedo.png', 3, 0)
+	write_image(tmp_path / 'rough.png', 1, 1)
+
+	preset = tmp_path / 'material.json'
+	with open(preset, 'w') as file:
+		json.dump({ 'paths': { 'albedo': 'albedo.png', 'roughness': 'rough.png' } }, file)
+
+	config = tmp_path / 'appconfig.json'
+	with open(config, 'w') as file:
+		json.dump(AppConfig(decodeCacheSize=0).encode(), file)
+
+	return (preset, str(config))
+
+def test_converts_presets(workspace: tuple[Path, str]):
+	preset, config = workspace
+	output = preset.parent / 'out'
+
+	[result] = run_batch([preset], output, 1, configPath=config)
+	assert result.ok, result.error
+	assert (output / 'material.vmt').is_file()
+	assert (output / 'material_basecolor.vtf').is_file()
+
+@pytest.mark.parametrize('backend', IO_BACKENDS)
+def test_skips_up_to_date_presets(workspace: tuple[Path, str], backend: str):
+	preset, config = workspace
+	output = preset.parent / 'out'
+
+	[first] = run_batch([preset], output, 1, configPath=config, backend=backend)
+	assert first.ok and 'load' in first.timings
+
+	# Nothing has changed, so the preset is skipped before any image is decoded.
+	[second] = run_batch([preset], output, 1, configPath=config, backend=backend)
+	assert second.ok and 'load' not in second.timings
+
+	write_image(preset.parent / 'rough.png', 1, 2)
+	[third] = run_batch([preset], output, 1, configPath=config, backend=backend)
+	assert third.ok and 'load' in third.timings
+
+def test_reports_failures(workspace: tuple[Path, str]):
+	preset, config = workspace
+	(preset.parent / 'albedo.png').unlink()
+
+	[result] = run_batch([preset], preset.parent / 'out', 1, configPath=config)
+	assert not result.ok
+	assert 'A basetexture is required' in result.error # type: ignore
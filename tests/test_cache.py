@@ -0,0 +1,145 @@
+from module.core.io.cache import DecodeCache, INDEX_NAME
+from module.core.io.image import Image, IOBackend
+from module.core.io.sppio import SourceppIOBackend
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import multiprocessing, json, os
+import pytest
+
+SIZE = (16, 16)
+
+ENTRY_BYTES = SIZE[0] * SIZE[1] * 4 + 128
+''' The size of an entry of an RGBA uint8 image, including the .npy header. '''
+
+class CountingBackend(IOBackend):
+	''' Decodes through sourcepp, and records every path it decoded. '''
+	loads: list[Path] = []
+
+	@staticmethod
+	def load(path: str|Path, size: tuple[int, int]|None=None, channels: int|None=None) -> Image:
+		CountingBackend.loads.append(Path(path))
+		return SourceppIOBackend.load(path, size, channels)
+
+	@staticmethod
+	def save(image: Image, path: str|Path, **kwargs) -> bool:
+		return SourceppIOBackend.save(image, path, **kwargs)
+
+@pytest.fixture(autouse=True)
+def reset_loads():
+	CountingBackend.loads = []
+
+def write_image(path: Path, seed: int) -> Path:
+	data = np.random.default_rng(seed).integers(0, 256, (SIZE[1], SIZE[0], 4), np.uint8)
+	assert SourceppIOBackend.save(Image(data), path)
+	return path
+
+def read_index(folder: Path) -> dict:
+	with open(folder / INDEX_NAME) as file:
+		return json.load(file)
+
+def test_miss_then_hit(tmp_path: Path):
+	source = write_image(tmp_path / 'a.png', 0)
+	cache = DecodeCache(tmp_path / 'cache', 1 << 20)
+
+	decoded = cache.load(source, CountingBackend)
+	cached = cache.load(source, CountingBackend)
+	assert CountingBackend.loads == [source]
+	assert np.array_equal(decoded.data, cached.data)
+
+	# Hits are copy-on-write, so they can be modified without changing the entry.
+	cached.data[...] = 0
+	assert np.array_equal(cache.load(source, CountingBackend).data, decoded.data)
+
+def test_hit_survives_restart(tmp_path: Path):
+	source = write_image(tmp_path / 'a.png', 0)
+	DecodeCache(tmp_path / 'cache', 1 << 20).load(source, CountingBackend)
+	DecodeCache(tmp_path / 'cache', 1 << 20).load(source, CountingBackend)
+	assert len(CountingBackend.loads) == 1
+
+def test_changed_file_misses(tmp_path: Path):
+	source = write_image(tmp_path / 'a.png', 0)
+	cache = DecodeCache(tmp_path / 'cache', 1 << 20)
+	first = cache.load(source, CountingBackend)
+
+	# Touching the file without changing it rehashes it, but still hits.
+	os.utime(source, ns=(0, 0))
+	cache.load(source, CountingBackend)
+	assert len(CountingBackend.loads) == 1
+
+	write_image(source, 1)
+	second = cache.load(source, CountingBackend)
+	assert len(CountingBackend.loads) == 2
+	assert not np.array_equal(first.data, second.data)
+
+def test_sizes_and_channels_are_separate_entries(tmp_path: Path):
+	source = write_image(tmp_path / 'a.png', 0)
+	cache = DecodeCache(tmp_path / 'cache', 1 << 20)
+	cache.load(source, CountingBackend)
+	cache.load(source, CountingBackend, channels=3)
+	cache.load(source, CountingBackend, channels=3)
+	assert len(CountingBackend.loads) == 2
+	assert len(read_index(tmp_path / 'cache')['entries']) == 2
+
+def test_evicts_least_recently_used(tmp_path: Path):
+	sources = [write_image(tmp_path / f'{i}.png', i) for i in range(4)]
+	folder = tmp_path / 'cache'
+	cache = DecodeCache(folder, ENTRY_BYTES * 2)
+
+	cache.load(sources[0], CountingBackend)
+	cache.load(sources[1], CountingBackend)
+	cache.load(sources[0], CountingBackend) # 1 is now the least recently used
+	cache.load(sources[2], CountingBackend)
+	assert CountingBackend.loads == [sources[0], sources[1], sources[2]]
+
+	index = read_index(folder)
+	assert sorted(index['entries']) == sorted(x.name for x in folder.glob('*.npy'))
+	assert len(index['entries']) == 2
+	assert sum(size for size, _ in index['entries'].values()) <= ENTRY_BYTES * 2
+	# Paths whose entries were evicted are forgotten too.
+	assert str(sources[1].absolute()) not in index['sources']
+
+	cache.load(sources[0], CountingBackend)
+	cache.load(sources[1], CountingBackend)
+	assert CountingBackend.loads == [sources[0], sources[1], sources[2], sources[1]]
+
+def test_images_over_budget_are_not_stored(tmp_path: Path):
+	source = write_image(tmp_path / 'a.png', 0)
+	cache = DecodeCache(tmp_path / 'cache', ENTRY_BYTES // 2)
+	cache.load(source, CountingBackend)
+	cache.load(source, CountingBackend)
+	assert len(CountingBackend.loads) == 2
+	assert not list((tmp_path / 'cache').glob('*.npy'))
+
+def test_evicts_entries_missing_from_index(tmp_path: Path):
+	''' Entries from a lost or outdated index are found once, and evicted like any other. '''
+	sources = [write_image(tmp_path / f'{i}.png', i) for i in range(3)]
+	folder = tmp_path / 'cache'
+	DecodeCache(folder, 1 << 20).load(sources[0], CountingBackend)
+	(folder / INDEX_NAME).write_text('{"old": [1, 2, "format"]}')
+
+	cache = DecodeCache(folder, ENTRY_BYTES * 2)
+	cache.load(sources[1], CountingBackend)
+	cache.load(sources[2], CountingBackend)
+	assert len(list(folder.glob('*.npy'))) == 2
+	assert len(read_index(folder)['entries']) == 2
+
+def load_all(folder: Path, paths: list[Path]) -> int:
+	cache = DecodeCache(folder, 1 << 20)
+	for path in paths: cache.load(path, SourceppIOBackend)
+	return os.getpid()
+
+def test_processes_share_index(tmp_path: Path):
+	''' Several processes storing into the same cache at once don't lose each other's changes to the index. '''
+	workers = 4
+	sources = [write_image(tmp_path / f'{i}.png', i) for i in range(workers * 8)]
+	folder = tmp_path / 'cache'
+	DecodeCache(folder, 1 << 20)
+
+	with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+		list(pool.map(load_all, [folder] * workers, [sources[i::workers] for i in range(workers)]))
+
+	index = read_index(folder)
+	assert len(index['entries']) == len(sources)
+	assert sorted(index['sources']) == sorted(str(x.absolute()) for x in sources)
@@ -0,0 +1,79 @@
+from module.core.config import AppConfig
+from module.core.export import export, make_material
+from module.core.fused import export_fused
+from module.core.io.image import Image
+from module.core.material import Material, MaterialMode, GameTarget, NormalType, ImageRole, Texture
+
+from numpy.typing import DTypeLike
+import numpy as np
+import pytest
+
+SIZE = (64, 48)
+
+MODES = [mode for mode in MaterialMode if mode not in (MaterialMode.ALL_PBR, MaterialMode.ALL_VLG)]
+
+def random_image(rng: np.random.Generator, channels: int, dtype: DTypeLike=np.float32) -> Image:
+	return Image(rng.random((SIZE[1], SIZE[0], channels), np.float32).astype(dtype))
+
+def make_test_material(mode: MaterialMode, target: GameTarget=GameTarget.V2011, normalType: NormalType=NormalType.DX, optional: bool=True, dtype: DTypeLike=np.float32, seed: int=0) -> Material:
+	''' A material of random images. If optional is set, it has every optional role, and its albedo has transparency. '''
+	rng = np.random.default_rng(seed)
+	albedo = random_image(rng, 4, dtype)
+	if not optional: albedo.set_channel(3, 1)
+
+	return Material(
+		mode,
+		target,
+		SIZE,
+		albedo=albedo,
+		roughness=random_image(rng, 1, dtype),
+		metallic=random_image(rng, 1, dtype),
+		emit=random_image(rng, 3, dtype) if optional else None,
+		ao=random_image(rng, 1, dtype) if optional else None,
+		normal=random_image(rng, 3, dtype),
+		height=random_image(rng, 1, dtype) if optional else None,
+		normalType=normalType
+	)
+
+def assert_textures_match(actual: list[Texture], expected: list[Texture], tolerance: int=1):
+	''' Asserts that two exports made the same textures, whose pixels are at most tolerance apart. '''
+	assert [x.role for x in actual] == [x.role for x in expected]
+	for a, b in zip(actual, expected):
+		assert a.image.dtype == b.image.dtype == np.uint8, a.role
+		assert a.image.data.shape == b.image.data.shape, a.role
+		difference = np.abs(a.image.data.astype(np.int16) - b.image.data.astype(np.int16)).max()
+		assert difference <= tolerance, f'{a.role.name} differs by {difference}'
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('target', [GameTarget.V2011, GameTarget.VGMOD])
+@pytest.mark.parametrize('normalType', NormalType)
+@pytest.mark.parametrize('optional', [True, False])
+def test_fused_matches_reference(mode: MaterialMode, target: GameTarget, normalType: NormalType, optional: bool):
+	fused = export_fused(make_test_material(mode, target, normalType, optional), integerBlend=False)
+	reference = export(make_test_material(mode, target, normalType, optional))
+	assert_textures_match(fused, reference)
+
+@pytest.mark.parametrize('mode', MODES)
+def test_fused_only_makes_requested_roles(mode: MaterialMode):
+	reference = export(make_test_material(mode))
+	for texture in reference:
+		[fused] = export_fused(make_test_material(mode), integerBlend=False, roles={ texture.role })
+		assert_textures_match([fused], [texture])
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('metallic', [0.0, 0.5])
+def test_fused_folds_constants(mode: MaterialMode, metallic: float):
+	''' Materials made without a metallic or normal map use constants for them, which both paths fold. '''
+	def make() -> Material:
+		material = make_test_material(mode, normalType=NormalType.GL)
+		material.metallic = Image.constant(SIZE, (metallic,))
+		material.normal = Image.constant(SIZE, (0.5, 0.5, 1.0))
+		return material
+
+	assert_textures_match(export_fused(make(), integerBlend=False), export(make()))
+
+def test_missing_roles_are_constant(appConfig: AppConfig):
+	rng = np.random.default_rng(0)
+	material = make_material({ ImageRole.Albedo: random_image(rng, 4), ImageRole.Roughness: random_image(rng, 1) }, MaterialMode.PhongEnvmap, GameTarget.V2011)
+	assert material.metallic.is_constant
+	assert material.normal.is_constant
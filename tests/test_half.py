@@ -0,0 +1,37 @@
+from module.core.config import AppConfig
+from module.core.export import export, make_material
+from module.core.fused import export_fused
+from module.core.material import MaterialMode, GameTarget, NormalType, ImageRole
+
+import numpy as np
+import pytest
+
+from test_fused import MODES, random_image, make_test_material, assert_textures_match
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('normalType', NormalType)
+def test_half_matches_full_precision(mode: MaterialMode, normalType: NormalType):
+	''' AppConfig.halfPrecision documents that textures differ from full precision by at most 1/255. '''
+	half = export_fused(make_test_material(mode, normalType=normalType, dtype=np.float16), integerBlend=False)
+	full = export(make_test_material(mode, normalType=normalType))
+	assert_textures_match(half, full)
+
+@pytest.mark.parametrize('half', [True, False])
+def test_make_material_precision(appConfig: AppConfig, half: bool):
+	appConfig.halfPrecision = half
+	rng = np.random.default_rng(0)
+	images = { ImageRole.Albedo: random_image(rng, 4), ImageRole.Roughness: random_image(rng, 1), ImageRole.AO: random_image(rng, 1).convert(np.uint16) }
+	material = make_material(images, MaterialMode.PhongEnvmap, GameTarget.V2011)
+
+	dtype = np.float16 if half else np.float32
+	assert material.albedo.dtype == material.roughness.dtype == material.ao.dtype == dtype # type: ignore
+	assert material.is_float32() != half
+
+def test_make_material_keeps_uint8(appConfig: AppConfig):
+	''' 8-bit inputs skip float16 too when they can go through the integer path. '''
+	appConfig.halfPrecision = True
+	rng = np.random.default_rng(0)
+	images = { ImageRole.Albedo: random_image(rng, 4).convert(np.uint8), ImageRole.Roughness: random_image(rng, 1) }
+	material = make_material(images, MaterialMode.PhongEnvmap, GameTarget.V2011)
+	assert material.albedo.dtype == np.uint8
+	assert material.roughness.dtype == np.float16
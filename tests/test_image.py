@@ -0,0 +1,134 @@
+from module.core.io.image import Image
+
+import numpy as np
+import pytest
+
+SIZE = (8, 6)
+
+def random_image(channels: int, seed: int=0) -> Image:
+	return Image(np.random.default_rng(seed).random((SIZE[1], SIZE[0], channels), np.float32))
+
+''' Constant images '''
+
+def test_constant_has_no_pixels():
+	image = Image.constant(SIZE, (0.25, 0.5, 1.0))
+	assert image.is_constant
+	assert image.size == SIZE and image.channels == 3
+	assert image.data.base.nbytes == 3 * 4
+	assert np.array_equal(image.data[3, 5], [0.25, 0.5, 1.0])
+
+def test_constant_ops_fold():
+	image = Image.constant(SIZE, (0.5,)).mult(0.5).add(Image.constant(SIZE, (0.25,))).pow(2)
+	assert image.is_constant
+	assert np.allclose(image.data, 0.25)
+
+def test_constant_operands_match_blank():
+	''' Operating on a constant gives the same pixels as operating on a real image of the same color. '''
+	for op in ('mult', 'add', 'sub', 'div', 'pow'):
+		folded = getattr(random_image(3), op)(Image.constant(SIZE, (0.5, 2.0, 0.75)))
+		blank = getattr(random_image(3), op)(Image.blank(SIZE, (0.5, 2.0, 0.75)))
+		assert not folded.is_constant
+		assert np.array_equal(folded.data, blank.data), op
+
+def test_constant_with_real_operand():
+	real = random_image(1)
+	image = Image.constant(SIZE, (0.5,)).mult(real)
+	assert not image.is_constant
+	assert np.allclose(image.data, real.data * 0.5)
+
+def test_multiplying_by_zero_folds():
+	image = random_image(3).mult(Image.constant(SIZE, (0.0,)))
+	assert image.is_constant
+	assert not image.data.any()
+
+def test_multiplying_one_by_image_copies_it():
+	real = random_image(1)
+	image = Image.constant(SIZE, (1.0,)).mult(real)
+	assert np.array_equal(image.data, real.data)
+	assert not np.shares_memory(image.data, real.data)
+
+def test_constant_conversions_stay_constant():
+	image = Image.constant(SIZE, (1.0, 0.5))
+	converted = image.convert(np.uint8)
+	assert converted.is_constant
+	assert np.array_equal(converted.data[0, 0], [255, 127])
+
+	inverted = Image.constant(SIZE, (0.25,)).invert()
+	assert inverted.is_constant and np.allclose(inverted.data, 0.75)
+
+	resized = image.resize((16, 12))
+	assert resized.is_constant and resized.size == (16, 12)
+
+def test_materialize():
+	image = Image.constant(SIZE, (0.5,)).materialize()
+	assert not image.is_constant
+	image.data[0, 0] = 1
+	assert image.data[1, 1] == 0.5
+
+def test_has_transparency():
+	assert not Image.constant(SIZE, (1.0, 1.0, 1.0, 1.0)).has_transparency()
+	assert Image.constant(SIZE, (1.0, 1.0, 1.0, 0.5)).has_transparency()
+	assert not Image.constant(SIZE, (0.5, 0.5, 0.5)).has_transparency()
+
+''' Planar images '''
+
+def test_merge_borrows_planes():
+	planes = random_image(3).split()
+	merged = Image.merge(tuple(planes))
+	assert merged.is_planar
+	for i, plane in enumerate(planes):
+		assert np.shares_memory(merged.plane(i), plane.data)
+
+def test_split_returns_planes():
+	planes = [random_image(1, seed) for seed in range(3)]
+	split = Image.merge(tuple(planes)).split()
+	for plane, channel in zip(planes, split):
+		assert np.shares_memory(plane.data, channel.data)
+
+def test_planar_ops_copy_borrowed_planes():
+	planes = random_image(3).split()
+	before = [plane.data.copy() for plane in planes]
+	merged = Image.merge(tuple(planes)).mult(0.5)
+	for i, plane in enumerate(planes):
+		assert np.array_equal(plane.data, before[i])
+		assert np.allclose(merged.plane(i), before[i][..., 0] * 0.5)
+
+def test_owned_planes_are_modified_in_place():
+	plane = random_image(1).plane(0).copy()
+	image = Image.from_planes((plane, plane.copy()), owned=True)
+	image.add(1)
+	assert image.plane(0) is plane
+
+@pytest.mark.parametrize('op', ['mult', 'add', 'sub', 'div', 'pow'])
+def test_planar_ops_match_interleaved(op: str):
+	interleaved = random_image(3)
+	planar = Image.merge(tuple(random_image(3).split()))
+	operand = random_image(3, seed=1)
+	getattr(interleaved, op)(operand)
+	getattr(planar, op)(Image.merge(tuple(operand.split())))
+	assert planar.is_planar
+	assert np.array_equal(planar.data, interleaved.data)
+
+def test_planar_images_interleave_on_access():
+	interleaved = random_image(4)
+	planar = Image.merge(tuple(interleaved.split()))
+	assert np.array_equal(planar.interleave(), interleaved.data)
+	assert planar.tobytes(np.float32) == interleaved.data.tobytes()
+	assert planar.convert(np.uint8).tobytes(np.uint8) == interleaved.convert(np.uint8).tobytes(np.uint8)
+
+	assert np.array_equal(planar.data, interleaved.data)
+	assert not planar.is_planar
+
+def test_planar_conversions_stay_planar():
+	planar = Image.merge((random_image(1), Image.constant(SIZE, (1.0,))))
+	converted = planar.convert(np.uint8)
+	assert converted.is_planar
+	assert converted.plane(1).strides == (0, 0)
+	assert np.array_equal(converted.plane(1), np.full((SIZE[1], SIZE[0]), 255))
+
+def test_normalize_doesnt_copy():
+	gray = random_image(1)
+	rgba = gray.normalize('RGBA')
+	assert rgba.channels == 4
+	assert all(np.shares_memory(rgba.plane(i), gray.data) for i in range(3))
+	assert not rgba.has_transparency()
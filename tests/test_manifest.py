@@ -0,0 +1,29 @@
+from module.core.config import AppConfig
+from module.core.export import make_material_header
+from module.core.io.resample import ResampleFilter
+from module.core.manifest import get_fingerprints, is_up_to_date
+from module.core.material import MaterialMode, GameTarget, NormalType, ImageRole
+
+def make_header():
+	''' A material with every role picked, whose outputs can be fingerprinted without any images. '''
+	paths = { role: f'{role.name}.png' for role in ImageRole }
+	sources = { role: role.name.lower() for role in ImageRole }
+	return make_material_header(paths, MaterialMode.PBRModel, GameTarget.V2011, NormalType.DX, (512, 512), sources)
+
+def test_resize_filter_marks_outputs_stale():
+	material = make_header()
+	before = get_fingerprints(material, AppConfig(resizeFilter=ResampleFilter.Lanczos))
+	after = get_fingerprints(material, AppConfig(resizeFilter=ResampleFilter.Box))
+
+	assert before.keys() == after.keys()
+	for role in before:
+		assert before[role] != None
+		assert not is_up_to_date(before[role], after[role]), f'{role} was not marked stale'
+
+def test_same_settings_are_up_to_date():
+	material = make_header()
+	before = get_fingerprints(material, AppConfig())
+	after = get_fingerprints(material, AppConfig())
+
+	for role in before:
+		assert is_up_to_date(before[role], after[role])
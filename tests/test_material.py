@@ -0,0 +1,73 @@
+from module.core.config import TargetRole
+from module.core.export import export
+from module.core.material import Material, MaterialMode, GameTarget, ImageRole, get_output_dependencies, get_affected_outputs
+
+import numpy as np
+import pytest
+
+from test_fused import MODES, random_image
+
+ROLE_ATTRIBUTES = {
+	ImageRole.Albedo: 'albedo',
+	ImageRole.Roughness: 'roughness',
+	ImageRole.Metallic: 'metallic',
+	ImageRole.Emit: 'emit',
+	ImageRole.AO: 'ao',
+	ImageRole.Normal: 'normal',
+	ImageRole.Height: 'height',
+}
+
+def make_dependency_material(mode: MaterialMode, target: GameTarget, height: bool, emit: bool, changed: ImageRole|None=None) -> Material:
+	''' A material of random images, of which only the changed role differs between calls. '''
+	rng = np.random.default_rng(0)
+	images = { role: random_image(rng, channels) for role, channels in ((ImageRole.Albedo, 4), (ImageRole.Roughness, 1), (ImageRole.Metallic, 1), (ImageRole.Emit, 3), (ImageRole.AO, 1), (ImageRole.Normal, 3), (ImageRole.Height, 1)) }
+	if changed: images[changed] = random_image(np.random.default_rng(1), images[changed].channels)
+
+	return Material(
+		mode,
+		target,
+		images[ImageRole.Albedo].size,
+		albedo=images[ImageRole.Albedo],
+		roughness=images[ImageRole.Roughness],
+		metallic=images[ImageRole.Metallic],
+		emit=images[ImageRole.Emit] if emit else None,
+		ao=images[ImageRole.AO],
+		normal=images[ImageRole.Normal],
+		height=images[ImageRole.Height] if height else None
+	)
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('target', [GameTarget.V2011, GameTarget.VGMOD])
+@pytest.mark.parametrize('height', [True, False])
+@pytest.mark.parametrize('emit', [True, False])
+def test_dependencies_match_export(mode: MaterialMode, target: GameTarget, height: bool, emit: bool):
+	''' Changing a role changes exactly the textures that get_outputs lists it as an input of. '''
+	material = make_dependency_material(mode, target, height, emit)
+	outputs = material.get_outputs()
+	reference = { x.role: x.image.data for x in export(material) }
+	assert set(outputs) == set(reference)
+
+	for role, attribute in ROLE_ATTRIBUTES.items():
+		if getattr(material, attribute) is None: continue
+		changed = { x.role for x in export(make_dependency_material(mode, target, height, emit, role)) if not np.array_equal(x.image.data, reference[x.role]) }
+		assert changed == get_affected_outputs(outputs, { role }), role.name
+
+def test_swap_moves_masks():
+	''' In Garry's Mod, PhongEnvmap puts the envmap mask in the bumpmap alpha instead of the phong mask. '''
+	plain = get_output_dependencies(MaterialMode.PhongEnvmap, False, False, False)
+	swapped = get_output_dependencies(MaterialMode.PhongEnvmap, True, False, False)
+	assert ImageRole.Metallic not in plain[TargetRole.Bumpmap]
+	assert ImageRole.Metallic in swapped[TargetRole.Bumpmap]
+
+def test_pbr_dependencies_are_narrow():
+	outputs = get_output_dependencies(MaterialMode.PBRModel, False, True, True)
+	assert get_affected_outputs(outputs, { ImageRole.Normal, ImageRole.Height }) == { TargetRole.Bumpmap }
+	assert get_affected_outputs(outputs, { ImageRole.Emit }) == { TargetRole.Emit }
+	assert get_affected_outputs(outputs, { ImageRole.Roughness }) == { TargetRole.Mrao }
+	assert get_affected_outputs(outputs, set()) == set()
+
+def test_unused_roles_affect_nothing():
+	''' Phong has no emission, so changing the emission map skips the export. '''
+	outputs = get_output_dependencies(MaterialMode.Phong, False, True, True)
+	assert TargetRole.Emit not in outputs
+	assert get_affected_outputs(outputs, { ImageRole.Emit, ImageRole.Height }) == set()
@@ -0,0 +1,77 @@
+from module.core.io import resample
+from module.core.io.image import Image
+from module.core.io.resample import ResampleFilter, resample_planes
+
+from numpy.typing import DTypeLike
+import numpy as np
+import pytest
+
+SIZES = [
+	((64, 48), (32, 24)),	# Integer factor
+	((64, 48), (16, 6)),	# Different integer factors per axis
+	((64, 48), (40, 30)),	# Non-integer factor
+	((32, 24), (64, 48)),	# Upscale
+	((64, 48), (64, 12)),	# Only one axis
+]
+
+def random_plane(size: tuple[int, int], dtype: DTypeLike=np.float32, seed: int=0) -> np.ndarray:
+	rng = np.random.default_rng(seed)
+	if np.dtype(dtype).kind == 'f': return rng.random((size[1], size[0]), np.float32).astype(dtype)
+	return rng.integers(0, np.iinfo(dtype).max, (size[1], size[0]), dtype, endpoint=True)
+
+@pytest.mark.parametrize('filter', ResampleFilter)
+@pytest.mark.parametrize('source, size', SIZES)
+def test_uniform_planes_keep_their_value(filter: ResampleFilter, source: tuple[int, int], size: tuple[int, int]):
+	''' The weights of every output pixel sum to 1, edges included. '''
+	[out] = resample_planes([np.full((source[1], source[0]), 0.75, np.float32)], size, filter)
+	assert out.shape == (size[1], size[0])
+	assert np.allclose(out, 0.75, atol=1e-6)
+
+@pytest.mark.parametrize('filter', ResampleFilter)
+def test_constant_images_stay_constant(filter: ResampleFilter):
+	image = Image.constant((64, 48), (0.25, 0.5, 1.0)).resize((40, 30), filter)
+	assert image.is_constant
+	assert image.size == (40, 30)
+	assert np.array_equal(image.data[0, 0], np.array([0.25, 0.5, 1.0], np.float32))
+
+def test_only_varying_planes_are_resampled():
+	image = Image.merge((Image(random_plane((64, 48))[..., None]), Image.constant((64, 48), (0.5,)))).resize((40, 30))
+	assert np.all(image.data[..., 1] == 0.5)
+
+@pytest.mark.parametrize('filter', [ResampleFilter.Kaiser, ResampleFilter.Lanczos])
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.float16, np.float32])
+def test_overshoot_is_clipped(filter: ResampleFilter, dtype: DTypeLike):
+	''' The negative lobes of sinc filters overshoot hard edges, which is clipped to the range of the dtype. '''
+	bars = np.broadcast_to(np.arange(64) // 8 % 2, (48, 64)).astype(np.float32)
+	image = Image(bars[..., None].copy()).convert(dtype)
+
+	raw = resample_planes([image.plane(0)], (40, 30), filter)
+	maximum = 1 if np.dtype(dtype).kind == 'f' else np.iinfo(dtype).max
+	assert raw.min() < 0 and raw.max() > maximum
+
+	resized = image.resize((40, 30), filter)
+	assert resized.dtype == dtype
+	assert resized.data.min() >= 0 and resized.data.max() <= maximum
+
+@pytest.mark.parametrize('filter', ResampleFilter)
+@pytest.mark.parametrize('source, size', [x for x in SIZES if x[0][0] % x[1][0] == 0 or x[0][1] % x[1][1] == 0])
+@pytest.mark.parametrize('dtype', [np.uint8, np.float32])
+def test_integer_factors_match_generic_weights(monkeypatch: pytest.MonkeyPatch, filter: ResampleFilter, source: tuple[int, int], size: tuple[int, int], dtype: DTypeLike):
+	''' Axes shrunk by an integer factor take strided taps, which must give the same results as the general weights. '''
+	planes = [random_plane(source, dtype, seed) for seed in range(3)]
+	strided = resample_planes(planes, size, filter)
+
+	monkeypatch.setattr(resample, 'get_factor', lambda inSize, outSize: 0)
+	generic = resample_planes(planes, size, filter)
+
+	assert np.allclose(strided, generic, rtol=1e-5, atol=1e-5 * np.max(generic))
+
+def test_box_filter_averages():
+	plane = random_plane((64, 48))
+	[out] = resample_planes([plane], (16, 12), ResampleFilter.Box)
+	expected = plane.reshape(12, 4, 16, 4).mean(axis=(1, 3))
+	assert np.allclose(out, expected, atol=1e-6)
+
+def test_same_size_is_unchanged():
+	image = Image(random_plane((64, 48))[..., None])
+	assert image.resize((64, 48)) is image
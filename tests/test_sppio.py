@@ -0,0 +1,39 @@
+from module.core.io.image import Image
+from module.core.io.sppio import SourceppIOBackend
+
+from pathlib import Path
+import numpy as np
+import pytest
+
+SIZE = (48, 20)
+
+def write_image(path: Path, channels: int=3) -> Path:
+	data = np.random.default_rng(0).integers(0, 256, (SIZE[1], SIZE[0], channels), np.uint8)
+	assert SourceppIOBackend.save(Image(data), path)
+	return path
+
+@pytest.mark.parametrize('kind', ['png', 'jpg', 'bmp', 'tga'])
+@pytest.mark.parametrize('channels', [1, 3, 4])
+def test_read_size(tmp_path: Path, kind: str, channels: int):
+	path = write_image(tmp_path / f'image.{kind}', channels)
+	assert SourceppIOBackend.read_size(path) == SIZE
+	assert SourceppIOBackend.load(path).size == SIZE
+
+def test_read_size_skips_jpeg_metadata(tmp_path: Path):
+	''' The frame header of a JPEG comes after its metadata segments, which can be large. '''
+	data = write_image(tmp_path / 'image.jpg').read_bytes()
+	padded = tmp_path / 'padded.jpg'
+	padded.write_bytes(data[:2] + b'\xFF\xE1' + (60002).to_bytes(2, 'big') + bytes(60000) + data[2:])
+	assert SourceppIOBackend.read_size(padded) == SIZE
+
+def test_read_size_ignores_the_extension(tmp_path: Path):
+	path = write_image(tmp_path / 'image.png')
+	renamed = path.rename(tmp_path / 'image.jpg')
+	assert SourceppIOBackend.read_size(renamed) == SIZE
+
+def test_read_size_of_unreadable_files(tmp_path: Path):
+	text = tmp_path / 'image.png'
+	text.write_text('not an image')
+	assert SourceppIOBackend.read_size(text) == None
+	assert SourceppIOBackend.read_size(tmp_path / 'missing.png') == None
+	assert SourceppIOBackend.read_size(write_image(tmp_path / 'image.hdr')) == None
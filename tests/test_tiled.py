@@ -0,0 +1,88 @@
+from module.core.config import AppConfig
+from module.core.export import export, make_material
+from module.core.fused import export_fused, get_band_rows, BUDGET_RESERVE
+from module.core.io.image import Image
+from module.core.material import Material, MaterialMode, GameTarget, NormalType, ImageRole
+
+from numpy.typing import DTypeLike
+import numpy as np
+import tracemalloc
+import pytest
+
+from test_fused import MODES, assert_textures_match
+
+BUDGET = 1 << 20
+
+def random_image(rng: np.random.Generator, size: tuple[int, int], channels: int, dtype: DTypeLike=np.uint8) -> Image:
+	return Image(rng.integers(0, 256, (size[1], size[0], channels), np.uint8)).convert(dtype)
+
+def make_tiled_material(mode: MaterialMode, size: tuple[int, int], dtype: DTypeLike=np.uint8, seed: int=0) -> Material:
+	''' A tiled material of random images with every optional role, as make_material would keep them at their loaded precision. '''
+	rng = np.random.default_rng(seed)
+	return Material(
+		mode,
+		GameTarget.V2011,
+		size,
+		albedo=random_image(rng, size, 4, dtype),
+		roughness=random_image(rng, size, 1, dtype),
+		metallic=random_image(rng, size, 1, dtype),
+		emit=random_image(rng, size, 3, dtype),
+		ao=random_image(rng, size, 1, dtype),
+		normal=random_image(rng, size, 3, dtype),
+		height=random_image(rng, size, 1, dtype),
+		normalType=NormalType.GL,
+		tiled=True
+	)
+
+def get_working_memory(material: Material, budget: int) -> int:
+	''' Returns the peak bytes export_fused allocated besides the textures it returned. '''
+	tracemalloc.start()
+	try:
+		before = tracemalloc.get_traced_memory()[0]
+		textures = export_fused(material, True, None, budget)
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return peak - before - sum(x.image.data.nbytes for x in textures)
+
+def test_band_rows_fit_budget():
+	assert get_band_rows(2048) == 32
+	assert get_band_rows(2048, BUDGET) < get_band_rows(2048)
+	assert get_band_rows(2048, BUDGET_RESERVE) == 1
+	assert get_band_rows(1 << 20, BUDGET) == 1
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.float16])
+def test_tiled_export_stays_under_budget(dtype: DTypeLike):
+	material = make_tiled_material(MaterialMode.PhongEnvmapAlpha, (2048, 2048), dtype)
+	assert get_working_memory(material, BUDGET) <= BUDGET
+	# Without a budget, bands are large enough that the same export goes over it.
+	assert get_working_memory(material, 0) > BUDGET
+
+# uint8 roughness includes 0, whose phong exponent the reference divides by.
+@pytest.mark.filterwarnings('ignore:divide by zero:RuntimeWarning')
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('dtype', [np.uint8, np.float16])
+def test_tiled_export_matches_reference(mode: MaterialMode, dtype: DTypeLike):
+	size = (256, 192)
+	tiled = export_fused(make_tiled_material(mode, size, dtype), True, None, BUDGET)
+	banded = export_fused(make_tiled_material(mode, size, dtype))
+	assert_textures_match(tiled, banded, 0)
+
+	reference = make_tiled_material(mode, size, dtype)
+	for role in ('albedo', 'roughness', 'metallic', 'emit', 'ao', 'normal', 'height'):
+		setattr(reference, role, getattr(reference, role).convert(np.float32))
+	assert_textures_match(tiled, export(reference))
+
+@pytest.mark.parametrize('limit', [0, 1, 64])
+def test_make_material_tiles_over_limit(appConfig: AppConfig, limit: int):
+	''' A 512x512 albedo and roughness need 5MB as float32, so only the 1MB limit should tile them. '''
+	appConfig.tiledMemoryLimit = limit
+	rng = np.random.default_rng(0)
+	size = (512, 512)
+	images = { ImageRole.Albedo: random_image(rng, size, 4), ImageRole.Roughness: random_image(rng, size, 1, np.uint16) }
+	material = make_material(images, MaterialMode.PhongEnvmap, GameTarget.V2011)
+
+	assert material.tiled == (limit == 1)
+	if material.tiled:
+		assert material.albedo.dtype == np.uint8
+		assert material.roughness.dtype == np.uint16